@@ -0,0 +1,46 @@
+import click
+from pathlib import Path
+import spacy
+from transformers import AutoModelForSequenceClassification, AutoTokenizer
+
+# small models with the same architectures as the production models, for CPU benchmarks
+ZERO_SHOT_MODEL = "hf-internal-testing/tiny-random-BartForSequenceClassification"
+SENTIMENT_MODEL = "sshleifer/tiny-distilbert-base-uncased-finetuned-sst-2-english"
+
+
+def save_model(name: str, path: Path) -> None:
+    """
+    Downloads a sequence classification model with its tokenizer and stores it locally.
+
+    Parameters:
+    - name (str): Name of the model on the hugging face hub.
+    - path (Path): Output directory.
+    """
+    AutoTokenizer.from_pretrained(name).save_pretrained(path)
+    AutoModelForSequenceClassification.from_pretrained(name).save_pretrained(path)
+    print(f"-- {name} saved to {path} --")
+
+
+@click.command()
+@click.option(
+    "--output",
+    default=Path("benchmarks/models"),
+    type=click.Path(path_type=Path),
+    help="Directory for the local models",
+)
+@click.option("--zero-shot-model", default=ZERO_SHOT_MODEL, help="Zero-shot model")
+@click.option("--sentiment-model", default=SENTIMENT_MODEL, help="Sentiment model")
+@click.option(
+    "--spacy-model",
+    default="en_core_web_md",
+    help="spaCy model stored next to the transformer models",
+)
+def main(output: Path, zero_shot_model: str, sentiment_model: str, spacy_model: str):
+    save_model(zero_shot_model, output / "zero-shot")
+    save_model(sentiment_model, output / "sentiment")
+    spacy.load(spacy_model).to_disk(output / "spacy")
+    print(f"-- {spacy_model} saved to {output / 'spacy'} --")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import click
+import pandas as pd
+from pathlib import Path
+import time
+from typing import Callable, Dict, List, Optional
+import yaml
+
+from benchmarks.synthetic_data import write_synthetic_csv
+from data_preprocessing.corpus_index import build_corpus_index
+from data_preprocessing.data_preprocess import preprocess_data
+from data_preprocessing.text_normalization import normalize_data
+from keywords_extraction.keywords_extraction import extract_keywords_from_comments
+from keywords_extraction.wordcloud_csv import wordcloud
+from markers_extraction.markers_in_comments import markers_in_comments
+from markers_extraction.rank_keywords_inside_topic import (
+    create_keywords_ranking_for_topics,
+)
+from phrase_modeling.phrase_classification import phrase_classification
+from phrase_modeling.phrase_extraction import phrase_extraction
+from sentiment_analysis.sentiment_analysis import sent_analysis
+from treatment_evolution.treatment_evolution import main as treatment_evolution
+from utils.memory import PeakMemory
+
+ROOT = Path(__file__).parents[1]
+
+# stages in execution order with the stages whose output they need
+STAGE_DEPENDENCIES = {
+    "preprocess": [],
+    "normalize": ["preprocess"],
+    "corpus_index": ["normalize"],
+    "keywords": ["preprocess"],
+    "wordcloud": ["keywords"],
+    "ranking": ["keywords"],
+    "phrases": ["preprocess"],
+    "classification": ["phrases"],
+    "sentiment": ["classification"],
+    "markers": ["normalize"],
+    "treatment_evolution": ["preprocess"],
+}
+
+
+def required_stages(stages: List[str]) -> List[str]:
+    """
+    Adds the stages the selected stages depend on.
+
+    Parameters:
+    - stages (List[str]): The selected stages.
+
+    Returns:
+    - List[str]: The selected stages and their dependencies in execution order.
+    """
+    required = set()
+    todo = list(stages)
+    while todo:
+        stage = todo.pop()
+        if stage not in required:
+            required.add(stage)
+            todo.extend(STAGE_DEPENDENCIES[stage])
+    return [stage for stage in STAGE_DEPENDENCIES if stage in required]
+
+
+def write_benchmark_config(
+    workdir: Path,
+    zero_shot_model: Optional[str],
+    sentiment_model: Optional[str],
+    spacy_model: Optional[str],
+) -> Path:
+    """
+    Writes the config of a benchmark run, based on the config of the repository.
+
+    The classification cache is disabled so that every run measures the inference.
+
+    Parameters:
+    - workdir (Path): Directory of the run, all paths are relative to it.
+    - zero_shot_model (str): Name or local path of the zero-shot model.
+    - sentiment_model (str): Name or local path of the sentiment model.
+    - spacy_model (str): Name or local path of the spaCy model.
+
+    Returns:
+    - Path: Path of the written config.
+    """
+    with open(ROOT / "config.yaml") as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    config.update(
+        {
+            "classification_cache_path": None,
+            "markers_path": "markers",
+            "treatment_evolution_config_path": "treatment_evolution.yaml",
+        }
+    )
+    for key, value in [
+        ("classification_model", zero_shot_model),
+        ("sentiment_model", sentiment_model),
+        ("spacy_model", spacy_model),
+    ]:
+        if value:
+            config[key] = str(Path(value).resolve()) if Path(value).exists() else value
+
+    with open(ROOT / "treatment_evolution" / "config.yaml") as f:
+        treatment_config = yaml.load(f, Loader=yaml.FullLoader)
+    treatment_config.update(
+        {
+            "file_path": config["preprocessing_path"],
+            "output_path": "data/treatment_evolution.csv",
+            "transition_matrix_path": "data/treatment_transitions.csv",
+        }
+    )
+
+    workdir.mkdir(parents=True, exist_ok=True)
+    with open(workdir / "treatment_evolution.yaml", "w") as f:
+        yaml.dump(treatment_config, f)
+    config_path = workdir / "config.yaml"
+    with open(config_path, "w") as f:
+        yaml.dump(config, f, sort_keys=False)
+    return config_path
+
+
+def benchmark_size(
+    n_rows: int, workdir: Path, stages: List[str], workers: int
+) -> List[Dict]:
+    """
+    Generates a synthetic corpus and times the entry point of every selected stage.
+
+    Parameters:
+    - n_rows (int): Number of synthetic comments.
+    - workdir (Path): Directory of the run containing its config.
+    - stages (List[str]): Stages to measure, their dependencies run unmeasured.
+    - workers (int): Number of processes for the CPU-bound text stages.
+
+    Returns:
+    - List[Dict]: One record per measured stage.
+    """
+    config_path = workdir / "config.yaml"
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    write_synthetic_csv(workdir / config["file_path"], n_rows)
+
+    results = []
+    outputs = {}
+
+    def measure(stage: str, rows: int, func: Callable):
+        with PeakMemory() as memory:
+            start = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - start
+        if stage in stages:
+            results.append(
+                {
+                    "rows": n_rows,
+                    "stage": stage,
+                    "input_rows": rows,
+                    "seconds": round(elapsed, 3),
+                    "rows_per_sec": round(rows / elapsed, 1) if elapsed else None,
+                    "peak_rss_mb": round(memory.peak_mb, 1),
+                }
+            )
+        return output
+
+    runs = {
+        "preprocess": lambda: measure(
+            "preprocess", n_rows, lambda: preprocess_data(config_path)
+        ),
+        "normalize": lambda: measure(
+            "normalize",
+            len(outputs["preprocess"]),
+            lambda: normalize_data(
+                outputs["preprocess"].copy(), config_path, workers=workers
+            ),
+        ),
+        "corpus_index": lambda: measure(
+            "corpus_index",
+            len(outputs["preprocess"]),
+            lambda: build_corpus_index(config_path, outputs["preprocess"].copy()),
+        ),
+        "keywords": lambda: measure(
+            "keywords",
+            len(outputs["preprocess"]),
+            lambda: extract_keywords_from_comments(
+                outputs["preprocess"].copy(), config_path, workers=workers
+            ),
+        ),
+        "wordcloud": lambda: measure(
+            "wordcloud", len(outputs["keywords"]), lambda: wordcloud(config_path)
+        ),
+        "ranking": lambda: measure(
+            "ranking",
+            len(outputs["keywords"]),
+            lambda: create_keywords_ranking_for_topics(
+                outputs["keywords"], config_path
+            ),
+        ),
+        "phrases": lambda: measure(
+            "phrases",
+            len(outputs["preprocess"]),
+            lambda: phrase_extraction(
+                outputs["preprocess"].copy(),
+                min_length=config["min_length"],
+                max_length=config["max_length"],
+                workers=workers,
+            ),
+        ),
+        "classification": lambda: measure(
+            "classification",
+            len(outputs["phrases"]),
+            lambda: phrase_classification(
+                outputs["phrases"],
+                file_path=Path(workdir / config["phrase_path"]),
+                category_labels=config["topics"],
+                batch_size=config.get("classification_batch_size"),
+                model=config["classification_model"],
+                output_mode=config.get("phrase_output_mode", "rows"),
+            ),
+        ),
+        "sentiment": lambda: measure(
+            "sentiment",
+            len(outputs["classification"]),
+            lambda: sent_analysis(
+                outputs["classification"],
+                out_path=Path(workdir / config["sent_phrase_path"]),
+                batch_size=config.get("sentiment_batch_size", 32),
+                max_length=config.get("sentiment_max_length", 512),
+                truncation=config.get("sentiment_truncation", True),
+                model=config.get("sentiment_model"),
+                topic_priority=config.get("topic_priority"),
+                topic_min_score=config.get("topic_min_score", 0.4),
+            ),
+        ),
+        "markers": lambda: measure(
+            "markers",
+            len(outputs["preprocess"]),
+            lambda: markers_in_comments(config_path),
+        ),
+        "treatment_evolution": lambda: measure(
+            "treatment_evolution",
+            len(outputs["preprocess"]),
+            lambda: treatment_evolution(
+                workdir / config["treatment_evolution_config_path"], workers=workers
+            ),
+        ),
+    }
+
+    for stage in required_stages(stages):
+        outputs[stage] = runs[stage]()
+        print(f"-- {stage} done for {n_rows} rows --")
+
+    return results
+
+
+@click.command()
+@click.option(
+    "--sizes",
+    default="1000,10000,100000,1000000",
+    help="Comma separated numbers of synthetic comments",
+)
+@click.option(
+    "--stages",
+    default=",".join(STAGE_DEPENDENCIES),
+    help="Comma separated stages to measure",
+)
+@click.option(
+    "--workdir",
+    default=Path("benchmarks/runs"),
+    type=click.Path(path_type=Path),
+    help="Directory for the generated data and outputs",
+)
+@click.option(
+    "--output",
+    default=Path("benchmarks/results.csv"),
+    type=click.Path(path_type=Path),
+    help="Csv file collecting the measurements",
+)
+@click.option("--zero-shot-model", help="Name or local path of the zero-shot model")
+@click.option("--sentiment-model", help="Name or local path of the sentiment model")
+@click.option("--spacy-model", help="Name or local path of the spaCy model")
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes for the CPU-bound text stages",
+)
+def main(
+    sizes: str,
+    stages: str,
+    workdir: Path,
+    output: Path,
+    zero_shot_model: str,
+    sentiment_model: str,
+    spacy_model: str,
+    workers: int,
+):
+    stages = [stage.strip() for stage in stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGE_DEPENDENCIES)
+    if unknown:
+        raise click.BadParameter(f"Unknown stages {unknown}", param_hint="--stages")
+
+    results = []
+    for n_rows in [int(size) for size in sizes.split(",")]:
+        run_dir = workdir / f"rows_{n_rows}"
+        write_benchmark_config(run_dir, zero_shot_model, sentiment_model, spacy_model)
+        results.extend(benchmark_size(n_rows, run_dir, stages, workers))
+
+        # write after every size, so that long runs keep their measurements
+        output.parent.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(results).to_csv(output, index=False)
+
+    print(pd.DataFrame(results).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import click
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Optional
+
+TREATMENTS = [
+    ("Humira", "adalimumab"),
+    ("Stelara", "ustekinumab"),
+    ("Entyvio", "vedolizumab"),
+    ("Remicade", "infliximab"),
+    ("Cimzia", "certolizumab pegol"),
+    ("Simponi", "golimumab"),
+    ("Tysabri", "natalizumab"),
+    ("Lialda", None),
+    ("Apriso", None),
+    ("Uceris", None),
+]
+DISEASES = ["Crohn's Disease", "Ulcerative Colitis", "Rheumatoid Arthritis"]
+TREATMENT_TYPES = [", Maintenance", ", Acute", ""]
+
+OPENINGS = [
+    "I have been on {treatment} for {duration}.",
+    "Started {treatment} {duration} ago after {other} stopped working.",
+    "My doctor switched me from {other} to {treatment}.",
+    "{treatment} was prescribed {duration} ago.",
+]
+SENTENCES = [
+    "The {symptom} is much better now and I finally feel normal.",
+    "I still have {symptom} every morning, it is exhausting.",
+    "It is very expensive but my insurance company covers most of the cost.",
+    "The injections are convenient and only needed every two weeks.",
+    "I had to go to the emergency room because of severe {symptom}.",
+    "After three months I was in full remission.",
+    "Side effects include headache, nausea and extreme fatigue.",
+    "I can not afford it without the savings card.",
+    "The procedure to get it approved took forever.",
+    "Significant improvement in my bowel movements, no more bloody stools.",
+    "Sometimes I feel weakness and muscle pain after the dose.",
+    "It did not work for me and I gained weight.",
+]
+SYMPTOMS = [
+    "stomach pain",
+    "abdominal cramping",
+    "diarrhea",
+    "bloating",
+    "fatigue",
+    "joint pain",
+    "inflammation",
+    "bleeding",
+]
+DURATIONS = ["two weeks", "a month", "six months", "a year", "three years"]
+
+
+def medication_string(rng: np.random.Generator) -> str:
+    """
+    Builds a medication string in the format of the raw export.
+
+    Parameters:
+    - rng (np.random.Generator): Random generator.
+
+    Returns:
+    - str: e.g. "Humira (adalimumab) for Crohn's Disease, Maintenance"
+    """
+    treatment, antibody = TREATMENTS[rng.integers(len(TREATMENTS))]
+    disease = DISEASES[rng.choice(len(DISEASES), p=[0.45, 0.45, 0.1])]
+    treatment_type = TREATMENT_TYPES[rng.integers(len(TREATMENT_TYPES))]
+    name = f"{treatment} ({antibody})" if antibody else treatment
+    return f"{name} for {disease}{treatment_type}"
+
+
+def synthetic_comment(rng: np.random.Generator, treatment: str) -> str:
+    """
+    Builds a patient comment mentioning the treatment, other treatments, symptoms and prices.
+
+    Parameters:
+    - rng (np.random.Generator): Random generator.
+    - treatment (str): The treatment of the comment.
+
+    Returns:
+    - str: The comment.
+    """
+    other = TREATMENTS[rng.integers(len(TREATMENTS))][0]
+    parts = [
+        OPENINGS[rng.integers(len(OPENINGS))].format(
+            treatment=treatment,
+            other=other,
+            duration=DURATIONS[rng.integers(len(DURATIONS))],
+        )
+    ]
+    for _ in range(rng.integers(1, 6)):
+        parts.append(
+            SENTENCES[rng.integers(len(SENTENCES))].format(
+                symptom=SYMPTOMS[rng.integers(len(SYMPTOMS))]
+            )
+        )
+    return " ".join(parts)
+
+
+def generate_comments(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Generates synthetic patient comments with the schema of the raw csv.
+
+    Parameters:
+    - n_rows (int): Number of comments.
+    - seed (int): Seed of the random generator.
+
+    Returns:
+    - pd.DataFrame: Dataframe with 'text_index', 'medication', 'comment' and 'rate' columns.
+    """
+    rng = np.random.default_rng(seed)
+    medications = [medication_string(rng) for _ in range(n_rows)]
+    comments = [
+        synthetic_comment(rng, medication.split(" ")[0]) for medication in medications
+    ]
+    return pd.DataFrame(
+        {
+            "text_index": np.arange(n_rows),
+            "medication": medications,
+            "comment": comments,
+            "rate": rng.integers(1, 11, size=n_rows),
+        }
+    )
+
+
+def write_synthetic_csv(
+    path: Path, n_rows: int, seed: int = 0, chunk_rows: Optional[int] = 100000
+) -> None:
+    """
+    Writes synthetic comments to a csv file in chunks to keep memory flat for large sizes.
+
+    Parameters:
+    - path (Path): Output csv file.
+    - n_rows (int): Number of comments.
+    - seed (int): Seed of the random generator.
+    - chunk_rows (int): Number of comments generated at once.
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    chunk_rows = chunk_rows or n_rows
+    for chunk, start in enumerate(range(0, n_rows, chunk_rows)):
+        df = generate_comments(min(chunk_rows, n_rows - start), seed=seed + chunk)
+        df["text_index"] += start
+        df.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+
+@click.command()
+@click.option("--rows", default=1000, type=int, help="Number of comments")
+@click.option("--seed", default=0, type=int, help="Seed of the random generator")
+@click.option(
+    "--output",
+    default=Path("data/raw_data_healthcare.csv"),
+    type=click.Path(path_type=Path),
+    help="Output csv file",
+)
+def main(rows: int, seed: int, output: Path):
+    write_synthetic_csv(output, rows, seed)
+    print(f"------- {rows} synthetic comments written to {output} -------")
+
+
+if __name__ == "__main__":
+    main()
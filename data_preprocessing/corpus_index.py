@@ -0,0 +1,286 @@
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from scipy import sparse
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import yaml
+
+from data_preprocessing.text_normalization import load_normalized_comments
+from utils.io import read_table, write_table
+
+# row metadata kept next to the matrix
+METADATA_COLUMNS = ["text_index", "disease", "treatment", "antibody"]
+
+
+def ngrams(tokens: List[str], max_n: int = 2) -> Iterable[str]:
+    """
+    Yields the unigrams up to max_n-grams of a token list, joined by spaces.
+
+    Parameters:
+    - tokens (List[str]): Tokens of a comment.
+    - max_n (int): Length of the longest n-gram.
+    """
+    for n in range(1, max_n + 1):
+        for start in range(len(tokens) - n + 1):
+            yield " ".join(tokens[start : start + n])
+
+
+class CorpusIndex:
+    """Sparse document-term matrix of the normalized comments.
+
+    Every row is a comment with its text_index, disease, treatment and antibody in
+    `rows`, every column a unigram or bigram of its tokens in `terms`. The entries
+    count how often a term occurs in a comment.
+    """
+
+    def __init__(
+        self, matrix: sparse.csr_matrix, terms: List[str], rows: pd.DataFrame
+    ) -> None:
+        """
+        Parameters:
+        - matrix (sparse.csr_matrix): (comments x terms) term counts.
+        - terms (List[str]): The term of every column.
+        - rows (pd.DataFrame): The metadata of every row.
+        """
+        self.matrix = matrix
+        self.terms = terms
+        self.rows = rows.reset_index(drop=True)
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+
+    @classmethod
+    def from_tokens(
+        cls, tokens: Iterable[List[str]], rows: pd.DataFrame, max_n: int = 2
+    ) -> "CorpusIndex":
+        """
+        Builds the index in one pass over the tokenized comments.
+
+        Parameters:
+        - tokens (Iterable[List[str]]): Tokens of every comment, in the order of rows.
+        - rows (pd.DataFrame): The metadata of every comment.
+        - max_n (int): Length of the longest n-gram.
+
+        Returns:
+        - CorpusIndex: The index of the comments.
+        """
+        vocabulary: Dict[str, int] = {}
+        indices: List[int] = []
+        indptr = [0]
+        for comment_tokens in tokens:
+            for term in ngrams(list(comment_tokens), max_n):
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+            indptr.append(len(indices))
+
+        matrix = sparse.csr_matrix(
+            (
+                np.ones(len(indices), dtype=np.int32),
+                np.asarray(indices, dtype=np.int32),
+                np.asarray(indptr, dtype=np.int64),
+            ),
+            shape=(len(indptr) - 1, len(vocabulary)),
+        )
+        # repeated terms of a comment are summed into their count
+        matrix.sum_duplicates()
+        return cls(matrix, list(vocabulary), rows)
+
+    def save(self, path: Path) -> None:
+        """
+        Saves the matrix, terms and row metadata into a directory.
+
+        Parameters:
+        - path (Path): Directory of the index.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        sparse.save_npz(path / "matrix.npz", self.matrix)
+        with open(path / "terms.json", "w") as f:
+            json.dump(self.terms, f)
+        write_table(self.rows, path / "rows.parquet")
+
+    @classmethod
+    def load(cls, path: Path) -> "CorpusIndex":
+        """
+        Loads an index saved with save.
+
+        Parameters:
+        - path (Path): Directory of the index.
+
+        Returns:
+        - CorpusIndex: The loaded index.
+        """
+        path = Path(path)
+        with open(path / "terms.json") as f:
+            terms = json.load(f)
+        return cls(
+            sparse.load_npz(path / "matrix.npz").tocsr(),
+            terms,
+            read_table(path / "rows.parquet"),
+        )
+
+    def term_columns(self, terms: Iterable[str]) -> List[int]:
+        """returns the columns of the terms that occur in the corpus"""
+        return [self.vocabulary[term] for term in terms if term in self.vocabulary]
+
+    def term_counts(self, terms: Iterable[str]) -> np.ndarray:
+        """
+        Counts the occurrences of any of the terms per comment.
+
+        Parameters:
+        - terms (Iterable[str]): Normalized unigrams or bigrams.
+
+        Returns:
+        - np.ndarray: Total count of the terms in every comment.
+        """
+        columns = self.term_columns(terms)
+        if not columns:
+            return np.zeros(self.matrix.shape[0], dtype=np.int64)
+        return np.asarray(self.matrix[:, columns].sum(axis=1)).ravel()
+
+    def marker_counts(
+        self,
+        markers: Dict[str, Dict[str, List[str]]],
+        normalize: Callable[[str], str] = lambda keyword: keyword,
+    ) -> pd.DataFrame:
+        """
+        Counts the keyword occurrences of every marker per comment.
+
+        Keywords are matched as whole unigrams or bigrams, unlike the substring
+        search of markers_in_comments.
+
+        Parameters:
+        - markers (dict): Maps a topic to its markers, every marker to its keywords.
+        - normalize (Callable): Normalizes a keyword like the indexed tokens,
+          e.g. stem_keyword for an index of stems.
+
+        Returns:
+        - pd.DataFrame: text_index, marker, topic and count of every found marker.
+        """
+        keys: List[Tuple[str, str]] = []
+        indicator_rows, indicator_columns = [], []
+        for topic, topic_markers in markers.items():
+            for marker, keywords in topic_markers.items():
+                columns = set(self.term_columns(normalize(kw) for kw in keywords))
+                indicator_rows.extend([len(keys)] * len(columns))
+                indicator_columns.extend(columns)
+                keys.append((marker, topic))
+
+        # (terms x markers) indicator, the product counts the hits of every marker
+        indicator = sparse.csr_matrix(
+            (
+                np.ones(len(indicator_rows), dtype=np.int32),
+                (indicator_columns, indicator_rows),
+            ),
+            shape=(len(self.terms), len(keys)),
+        )
+        counts = (self.matrix @ indicator).tocoo()
+        order = np.lexsort((counts.row, counts.col))
+        text_index = self.rows["text_index"].to_numpy()
+        return pd.DataFrame(
+            {
+                "text_index": text_index[counts.row[order]],
+                "marker": [keys[i][0] for i in counts.col[order]],
+                "topic": [keys[i][1] for i in counts.col[order]],
+                "count": counts.data[order],
+            }
+        )
+
+    def group_term_counts(
+        self, by: str, terms: Optional[Iterable[str]] = None
+    ) -> Tuple[sparse.csr_matrix, List]:
+        """
+        Sums the term counts of the comments of every group.
+
+        Parameters:
+        - by (str): Metadata column to group by, e.g. 'disease' or 'treatment'.
+        - terms (Iterable[str]): Restricts the columns to these terms, all terms if None.
+
+        Returns:
+        - sparse.csr_matrix: (groups x terms) summed counts.
+        - List: The group of every row.
+        """
+        codes, groups = pd.factorize(self.rows[by])
+        has_group = codes >= 0
+        membership = sparse.csr_matrix(
+            (
+                np.ones(has_group.sum(), dtype=np.int32),
+                (codes[has_group], np.flatnonzero(has_group)),
+            ),
+            shape=(len(groups), self.matrix.shape[0]),
+        )
+        matrix = self.matrix
+        if terms is not None:
+            matrix = matrix[:, self.term_columns(terms)]
+        return (membership @ matrix).tocsr(), list(groups)
+
+    def term_frequencies(
+        self, by: str, top_n: Optional[int] = None, min_n: int = 1, max_n: int = 2
+    ) -> pd.DataFrame:
+        """
+        Lists the term counts of every group in long format.
+
+        Parameters:
+        - by (str): Metadata column to group by, e.g. 'disease' or 'treatment'.
+        - top_n (int): Number of most frequent terms kept per group, all if None.
+        - min_n (int): Shortest n-gram kept.
+        - max_n (int): Longest n-gram kept.
+
+        Returns:
+        - pd.DataFrame: by, term and count, sorted by group and descending count.
+        """
+        lengths = np.fromiter(
+            (term.count(" ") + 1 for term in self.terms), dtype=np.int32
+        )
+        keep = np.flatnonzero((lengths >= min_n) & (lengths <= max_n))
+        counts, groups = self.group_term_counts(by)
+        counts = counts[:, keep].tocoo()
+
+        df = pd.DataFrame(
+            {
+                by: np.asarray(groups, dtype=object)[counts.row],
+                "term": np.asarray(self.terms, dtype=object)[keep[counts.col]],
+                "count": counts.data,
+            }
+        )
+        df = df.sort_values([by, "count", "term"], ascending=[True, False, True])
+        if top_n is not None:
+            df = df.groupby(by, sort=False).head(top_n)
+        return df.reset_index(drop=True)
+
+
+def build_corpus_index(
+    config_path: Path, df: Optional[pd.DataFrame] = None
+) -> Dict[str, CorpusIndex]:
+    """
+    Builds the indexes of the lemmatized and the stemmed comments and saves them.
+
+    Parameters:
+    - config_path (Path): Path to config file.
+    - df (pd.DataFrame): Preprocessed comments, read from preprocessing_path if None.
+
+    Returns:
+    - Dict[str, CorpusIndex]: The 'lemmas' and 'stems' indexes, saved as
+      sub directories of corpus_index_path.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    if df is None:
+        df = read_table(
+            Path(config_path.parent / config["preprocessing_path"]),
+            columns=METADATA_COLUMNS + ["comment"],
+        )
+    df = load_normalized_comments(df, config_path)
+    rows = df[[column for column in METADATA_COLUMNS if column in df.columns]]
+
+    index_path = Path(config_path.parent / config["corpus_index_path"])
+    indexes = {}
+    for name, column in [("lemmas", "comment_tokens"), ("stems", "comment_stems")]:
+        indexes[name] = CorpusIndex.from_tokens(df[column], rows)
+        indexes[name].save(index_path / name)
+        print(
+            f"Indexed {indexes[name].matrix.shape[0]} comments with "
+            f"{indexes[name].matrix.shape[1]} {name} n-grams"
+        )
+
+    print("------- Corpus Index Completed -------")
+    return indexes
@@ -1,8 +1,14 @@
+from functools import lru_cache
 import nltk
 from pathlib import Path
 import pandas as pd
+import re
+from typing import List, Optional, Tuple
 import yaml
 
+from utils.categorical import to_categorical
+from utils.io import write_table
+
 
 # Download necessary resources for nltk
 nltk.download("stopwords")
@@ -10,60 +16,125 @@ nltk.download("punkt")
 nltk.download("wordnet")
 
 
+# One pattern extracting treatment, disease, antibody and treatment type. Every
+# field is matched in its own optional lookahead, so each behaves like a separate
+# search for the field pattern on the medication string.
+MEDICATION_PATTERN = re.compile(
+    r"(?=(?P<treatment>.*?)(?:\s*\(.*\)|\s*for))?"
+    r"(?=[\s\S]*?[fF]or (?P<disease>.*?)(?:,|$))?"
+    r"(?=[\s\S]*?\((?P<antibody>[^)]+)\))?"
+    r"(?=[\s\S]*?(?P<treatment_type>, Maintenance|, Acute)$)?"
+)
+MEDICATION_FIELDS = ["treatment", "disease", "antibody", "treatment_type"]
+
+
+@lru_cache(maxsize=None)
+def parse_medication(medication: str) -> Tuple[Optional[str], ...]:
+    """
+    Parses a medication string like "Humira (adalimumab) for Crohn's Disease, Maintenance".
+
+    Parameters:
+    - medication (str): The medication string, parsed once per distinct value.
+
+    Returns:
+    - Tuple: treatment, disease, antibody and treatment type, None for missing fields.
+    """
+    treatment, disease, antibody, treatment_type = MEDICATION_PATTERN.match(
+        medication
+    ).group(*MEDICATION_FIELDS)
+    return (
+        treatment.strip() if treatment is not None else None,
+        disease.strip() if disease is not None else None,
+        antibody,
+        treatment_type.replace(", ", "") if treatment_type is not None else None,
+    )
+
+
+def parse_medications(medications: pd.Series) -> pd.DataFrame:
+    """
+    Parses the distinct medication strings of a column.
+
+    Parameters:
+    - medications (pd.Series): The medication column.
+
+    Returns:
+    - pd.DataFrame: The parsed fields indexed by the distinct medication strings.
+    """
+    distinct = medications.dropna().unique()
+    return pd.DataFrame(
+        [parse_medication(medication) for medication in distinct],
+        index=distinct,
+        columns=MEDICATION_FIELDS,
+        dtype=object,
+    )
+
+
 def extract_filter_process(
     file_path: Path,
     diseases: list = [],
     antibodies: list = [],
     treatments: list = [],
+    columns: Optional[List[str]] = None,
+    chunksize: int = 100000,
 ) -> pd.DataFrame:
     """
     Preprocesses the CSV file specified by extracting treatment, disease, and antibody information.
 
+    The file is read in chunks, every distinct medication string is parsed once and the
+    filters are applied per chunk, so only the selected rows are kept in memory.
+
     Parameters:
     - file_path (Path): Path to the CSV file.
     - diseases (list): List of diseases to filter. If empty, no filtering is applied.
     - antibodies (list): List of antibodies to filter. If empty, no filtering is applied.
     - treatments (list): List of treatments to filter. If empty, no filtering is applied.
+    - columns (list): Columns of the CSV file to load. If empty, all columns are loaded.
+    - chunksize (int): Number of rows read at once.
 
     Returns:
     - pd.DataFrame: The processed dataframe with added 'treatment', 'disease', 'antibody',
-                    and 'processed_comment' columns.
+                    and 'processed_comment' columns. The medication and the added columns
+                    are Categoricals.
     """
-
-    # Read the CSV file into a dataframe
-    dataframe = pd.read_csv(file_path)
-
-    # Extract treatment, disease, treatment type and antibody information
-    dataframe["treatment"] = (
-        dataframe["medication"].str.extract("^(.*?)(?:\s*\(.*\)|\s*for)")[0].str.strip()
-    )
-    dataframe["disease"] = (
-        dataframe["medication"].str.extract("[fF]or (.*?)(?:,|$)")[0].str.strip()
-    )
-    dataframe["antibody"] = dataframe["medication"].str.extract("\(([^)]+)\)")
-
-    dataframe["treatment_type"] = dataframe["medication"].str.extract(
-        r"(, Maintenance|, Acute)$", expand=False
-    )
-
-    dataframe["treatment_type"] = dataframe["treatment_type"].str.replace(", ", "")
-
-    # Filter the dataframe based on the specified diseases
-    if diseases:
-        dataframe = dataframe[dataframe["disease"].isin(diseases)]
-
-    # Filter the dataframe based on the specified antibodies
-    if antibodies:
-        dataframe = dataframe[dataframe["antibody"].isin(antibodies)]
-
-    # Filter the dataframe based on the specified treatments
-    if treatments:
-        dataframe = dataframe[dataframe["treatment"].isin(treatments)]
-
-    return dataframe
-
-
-def preprocess_data(config_path: Path = Path("../config.yaml")):
+    if columns and "medication" not in columns:
+        columns = list(columns) + ["medication"]
+
+    filters = {
+        "disease": diseases,
+        "antibody": antibodies,
+        "treatment": treatments,
+    }
+
+    chunks = []
+    for chunk in pd.read_csv(file_path, usecols=columns or None, chunksize=chunksize):
+        # Extract treatment, disease, treatment type and antibody information
+        parsed = parse_medications(chunk["medication"])
+
+        # Filter the chunk based on the specified diseases, antibodies and treatments
+        if any(filters.values()):
+            keep = pd.Series(True, index=parsed.index)
+            for field, values in filters.items():
+                if values:
+                    keep &= parsed[field].isin(values)
+            chunk = chunk[chunk["medication"].isin(parsed.index[keep])]
+
+        # the fields are looked up once per category instead of once per row
+        medication = chunk["medication"].astype("category")
+        chunks.append(
+            chunk.assign(
+                medication=medication,
+                **{
+                    field: medication.map(parsed[field]).astype("category")
+                    for field in MEDICATION_FIELDS
+                },
+            )
+        )
+
+    # the categories of the chunks can differ, they are unified on the whole data
+    return to_categorical(pd.concat(chunks))
+
+
+def preprocess_data(config_path: Path = Path(__file__).parents[1] / "config.yaml"):
     """
     Initiate preprocessing of data and save the output if specified.
 
@@ -84,14 +155,16 @@ def preprocess_data(config_path: Path = Path("../config.yaml")):
         diseases=config.get("diseases", []),
         antibodies=config.get("antibodies", []),
         treatments=config.get("treatments", []),
+        columns=config.get("raw_columns", []),
+        chunksize=config.get("read_chunksize", 100000),
     )
     print("-------- Data processing done -------")
 
     # set the output path of the csv
     output_path = config.get("preprocessing_path", None)
     if output_path:
-        # save the data to csv if requested
-        df.to_csv(Path(config_path.parent / output_path), index=False)
+        # save the data if requested, the suffix selects csv or parquet
+        write_table(df, Path(config_path.parent / output_path))
 
     return df
 
@@ -0,0 +1,201 @@
+from functools import lru_cache
+from nltk.corpus import stopwords
+from nltk.stem import PorterStemmer, WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+import pandas as pd
+from pathlib import Path
+import string
+from typing import List
+import yaml
+
+from utils.io import read_table, write_table
+from utils.parallel import parallel_map
+
+# maximum number of distinct tokens kept in the lemmatization and stemming caches
+TOKEN_CACHE_SIZE = 2**18
+
+_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+_LEMMATIZER = WordNetLemmatizer()
+_STEMMER = PorterStemmer()
+
+
+@lru_cache(maxsize=None)
+def stop_words() -> frozenset:
+    """
+    Loads the english stopwords once per process.
+
+    Returns:
+    - frozenset: The english stopwords of nltk.
+    """
+    return frozenset(stopwords.words("english"))
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def lemmatize_token(token: str) -> str:
+    """
+    Lemmatizes a single token, results are kept in a bounded LRU cache.
+
+    Parameters:
+    - token (str): The token to lemmatize.
+
+    Returns:
+    - str: The lemma of the token.
+    """
+    return _LEMMATIZER.lemmatize(token)
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def stem_token(token: str) -> str:
+    """
+    Stems a single token, results are kept in a bounded LRU cache.
+
+    Parameters:
+    - token (str): The token to stem.
+
+    Returns:
+    - str: The Porter stem of the token.
+    """
+    return _STEMMER.stem(token)
+
+
+def normalize_text(value: str) -> List[str]:
+    """
+    Converts a text to lowercase, removes punctuation, tokenizes it and lemmatizes
+    all non-stopword, alphabetical tokens.
+
+    Parameters:
+    - value (str): The input text string to be normalized.
+
+    Returns:
+    - list: A list of lemmatized tokens from the input text, excluding stop words and non-alphabetical tokens.
+          If the input value is None or NaN, an empty list is returned.
+    """
+    if not isinstance(value, str) and pd.isna(value):
+        return []
+
+    excluded = stop_words()
+    return [
+        lemmatize_token(token)
+        for token in word_tokenize(value.lower().strip().translate(_PUNCTUATION_TABLE))
+        if token not in excluded and token.isalpha()
+    ]
+
+
+@lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def normalize_keyword(keyword: str) -> str:
+    """
+    Normalizes a short keyword, results are kept in a bounded LRU cache.
+
+    Parameters:
+    - keyword (str): The keyword to be normalized.
+
+    Returns:
+    - str: The lemmatized tokens of the keyword joined by spaces.
+    """
+    return " ".join(normalize_text(keyword))
+
+
+def warm_up() -> None:
+    """
+    Loads the lazily initialized nltk resources, so that later calls do not pay for it.
+    """
+    stop_words()
+    word_tokenize("warm up")
+    _LEMMATIZER.lemmatize("warm")
+
+
+def normalize_comments(
+    df: pd.DataFrame, column_name_comment: str = "comment", workers: int = 1
+) -> pd.DataFrame:
+    """
+    Normalizes every comment once and stores the tokens and their stems.
+
+    Parameters:
+    - df (pd.DataFrame): The dataframe with the comments.
+    - column_name_comment (str): The column with the untreated comments.
+    - workers (int): Number of processes used for the lemmatization.
+
+    Returns:
+    - pd.DataFrame: The input dataframe with the added columns 'comment_tokens'
+                    (lemmatized tokens) and 'comment_stems' (stems of these tokens).
+    """
+    df["comment_tokens"] = parallel_map(
+        df[column_name_comment], normalize_text, workers, "Lemmatization", warm_up
+    )
+    df["comment_stems"] = df["comment_tokens"].map(
+        lambda tokens: [stem_token(token) for token in tokens]
+    )
+    return df
+
+
+def normalize_data(
+    df: pd.DataFrame,
+    config_path: Path = Path("../config.yaml"),
+    workers: int = 1,
+    merge: bool = False,
+) -> pd.DataFrame:
+    """
+    Runs the text normalization stage and saves the tokens if specified.
+
+    Parameters:
+    - df (pd.DataFrame): The preprocessed dataframe.
+    - config_path (Path): Path to config file.
+    - workers (int): Number of processes used for the lemmatization.
+    - merge (bool): Merge the rows into the saved tokens instead of replacing them.
+
+    Returns:
+    - pd.DataFrame: The input dataframe with the added 'comment_tokens' and 'comment_stems' columns.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    df = normalize_comments(df, workers=workers)
+    print("-------- Text normalization done -------")
+
+    output_path = config.get("normalized_path", None)
+    if output_path:
+        write_table(
+            df[["text_index", "comment_tokens", "comment_stems"]],
+            Path(config_path.parent / output_path),
+            merge_on="text_index" if merge else None,
+        )
+
+    return df
+
+
+def load_normalized_comments(
+    df: pd.DataFrame, config_path: Path, column_name_comment: str = "comment"
+) -> pd.DataFrame:
+    """
+    Adds the normalized tokens to a dataframe, reusing the saved artifact when available.
+
+    Parameters:
+    - df (pd.DataFrame): The dataframe with a 'text_index' and the comment column.
+    - config_path (Path): Path to config file.
+    - column_name_comment (str): The column with the untreated comments.
+
+    Returns:
+    - pd.DataFrame: The input dataframe with 'comment_tokens' and 'comment_stems' columns.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    normalized_path = config.get("normalized_path", None)
+    if normalized_path and Path(config_path.parent / normalized_path).exists():
+        normalized = read_table(
+            Path(config_path.parent / normalized_path),
+            list_columns=["comment_tokens", "comment_stems"],
+        )
+        df = df.drop(columns=["comment_tokens", "comment_stems"], errors="ignore")
+        df = df.merge(normalized, on="text_index", how="left")
+        # comments that are missing from the artifact are normalized here
+        missing = df["comment_tokens"].isna()
+        if missing.any():
+            filled = normalize_comments(
+                df.loc[missing, [column_name_comment]].copy(), column_name_comment
+            )
+            for column in ["comment_tokens", "comment_stems"]:
+                df[column] = df[column].where(~missing, filled[column])
+        return df
+
+    return normalize_comments(df, column_name_comment)
@@ -1,14 +1,20 @@
-from ast import literal_eval
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from nltk.tokenize import word_tokenize
+from functools import lru_cache
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from rake_nltk import Rake
-import string
-from typing import List
+from typing import FrozenSet, List
 import yaml
 
+from data_preprocessing.text_normalization import (
+    normalize_keyword,
+    normalize_text,
+    warm_up,
+)
+from utils.categorical import map_distinct
+from utils.io import write_table
+from utils.parallel import parallel_map
+
 
 def kewords_lemmatization(value: str) -> str:
     """
@@ -20,19 +26,20 @@ def kewords_lemmatization(value: str) -> str:
     Returns:
     - str: A string of the lemmatized comment.
     """
-    stop_words = set(stopwords.words("english"))
-    lemmatizer = WordNetLemmatizer()
+    return normalize_keyword(value)
 
-    lemmatized_tokens = [
-        lemmatizer.lemmatize(token)
-        for token in word_tokenize(
-            value.lower().strip().translate(str.maketrans("", "", string.punctuation))
-        )
-        if token not in stop_words and token.isalpha()
-    ]
-    return " ".join(
-        lemmatized_tokens
-    )  # Join the lemmatized tokens into a single string
+
+def lemmatize_keywords(keywords: List[str]) -> List[str]:
+    """
+    Lemmatizes a list of keywords.
+
+    Parameters:
+    - keywords (List[str]): The keywords extracted from a comment.
+
+    Returns:
+    - List[str]: The lemmatized keywords.
+    """
+    return [kewords_lemmatization(keyword) for keyword in keywords]
 
 
 def lemmatize_case(value: str) -> List[str]:
@@ -47,22 +54,52 @@ def lemmatize_case(value: str) -> List[str]:
     - list: A list of lemmatized tokens from the input text, excluding stop words and non-alphabetical tokens.
           If the input value is None or NaN, an empty list is returned.
     """
+    return normalize_text(value)
+
+
+# words removed from the keywords of every comment
+EXCLUDED_WORDS = frozenset(["uc", "year", "month", "week", "day"])
+
+
+def exclusion_set(
+    lemmatized_disease: List[str],
+    lemmatized_treatment: List[str],
+    lemmatized_antibody: List[str],
+) -> FrozenSet[str]:
+    """
+    Builds the words to remove from the keywords of comments about a medication.
+
+    Parameters:
+    - lemmatized_disease (List[str]): The lemmatized disease name.
+    - lemmatized_treatment (List[str]): The lemmatized treatment name.
+    - lemmatized_antibody (List[str]): The lemmatized anti-body name.
+
+    Returns:
+    - frozenset: The full and first word of the disease, the treatment, the anti-body
+    and the generic EXCLUDED_WORDS.
+    """
+    excluded = {
+        " ".join(lemmatized_disease),
+        "".join(lemmatized_treatment),
+        "".join(lemmatized_antibody),
+    }
+    if lemmatized_disease:
+        excluded.add(lemmatized_disease[0])
+    return frozenset(excluded) | EXCLUDED_WORDS
+
+
+def filter_keywords(keywords: List[str], excluded: FrozenSet[str]) -> List[str]:
+    """
+    Keeps the keywords that contain none of the excluded words.
 
-    stop_words = set(stopwords.words("english"))
-    lemmatizer = WordNetLemmatizer()
+    Parameters:
+    - keywords (List[str]): The keywords of a comment.
+    - excluded (frozenset): The words to remove, see exclusion_set.
 
-    if pd.notna(value):
-        return [
-            lemmatizer.lemmatize(token)
-            for token in word_tokenize(
-                value.lower()
-                .strip()
-                .translate(str.maketrans("", "", string.punctuation))
-            )
-            if token not in stop_words and token.isalpha()
-        ]
-    else:
-        return []
+    Returns:
+    - list: The remaining keywords.
+    """
+    return [keyword for keyword in keywords if excluded.isdisjoint(keyword.split())]
 
 
 def remove_disease_terms(row: pd.Series) -> List[str]:
@@ -77,26 +114,62 @@ def remove_disease_terms(row: pd.Series) -> List[str]:
     - list: A list of words from 'processed_comment' that are not found in any of the lemmatized sets
     ('lemmatized_disease', 'lemmatized_treatment', 'lemmatized_antibody').
     """
+    return filter_keywords(
+        row["keywords_comment"],
+        exclusion_set(
+            row["lemmatized_disease"],
+            row["lemmatized_treatment"],
+            row["lemmatized_antibody"],
+        ),
+    )
+
+
+def remove_medication_terms(df: pd.DataFrame) -> pd.Series:
+    """
+    Applies remove_disease_terms to every row, building the exclusion set only once
+    per distinct combination of disease, treatment and anti-body.
+
+    Parameters:
+    - df (pd.DataFrame): Comments with 'keywords_comment', 'disease', 'treatment', 'antibody'
+    and the lemmatized columns of these names.
 
-    return [
-        keyword
-        for keyword in row["keywords_comment"]
-        if all(
-            word
-            not in [
-                " ".join(row["lemmatized_disease"]),
-                row["lemmatized_disease"][0],
-                "".join(row["lemmatized_treatment"]),
-                "".join(row["lemmatized_antibody"]),
-                "uc",
-                "year",
-                "month",
-                "week",
-                "day",
-            ]
-            for word in keyword.split()
+    Returns:
+    - pd.Series: The filtered keywords of every comment.
+    """
+    codes = (
+        df.groupby(
+            ["disease", "treatment", "antibody"],
+            dropna=False,
+            observed=True,
+            sort=False,
         )
+        .ngroup()
+        .to_numpy()
+    )
+    # the lemmatized names of the first row of every combination
+    _, first_rows = np.unique(codes, return_index=True)
+    exclusions = [
+        exclusion_set(
+            df["lemmatized_disease"].iat[i],
+            df["lemmatized_treatment"].iat[i],
+            df["lemmatized_antibody"].iat[i],
+        )
+        for i in first_rows
     ]
+    return pd.Series(
+        [
+            filter_keywords(keywords, exclusions[code])
+            for keywords, code in zip(df["keywords_comment"], codes)
+        ],
+        index=df.index,
+        dtype=object,
+    )
+
+
+@lru_cache(maxsize=None)
+def _rake(max_length: int) -> Rake:
+    # one Rake object per process, it only keeps the results of the last text
+    return Rake(max_length=max_length)
 
 
 def extract_keywords(text: str) -> List[str]:
@@ -109,13 +182,16 @@ def extract_keywords(text: str) -> List[str]:
     Returns:
     - List[str]: A list of extracted keywords for that string.
     """
-    r = Rake(max_length=2)
+    r = _rake(max_length=2)
     r.extract_keywords_from_text(text)
     return r.get_ranked_phrases()
 
 
 def extract_keywords_from_comments(
-    df: pd.DataFrame, config_data: Path = Path("config.yaml")
+    df: pd.DataFrame,
+    config_data: Path = Path("config.yaml"),
+    workers: int = 1,
+    merge: bool = False,
 ) -> pd.DataFrame:
     """
     Takes a dataframe as input, extracts the keywords from the commemts and save the output if specified.
@@ -123,6 +199,8 @@ def extract_keywords_from_comments(
     Args:
     - df (pd.Dataframe): The Dataframe from which to extract the keywords
     - file_path (Path): Path to config file.
+    - workers (int): Number of processes used for the keyword extraction and lemmatization.
+    - merge (bool): Merge the rows into the saved output instead of replacing it.
 
     Returns:
     - pandas.DataFrame: The input DataFrame with a new column containing keywords for each comment.
@@ -132,27 +210,35 @@ def extract_keywords_from_comments(
     with open(config_data) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
 
-    df["keywords_comment"] = df["comment"].apply(extract_keywords)
-
-    # change column to list of strings instead of whole string
-    df["keywords_comment"] = df.keywords_comment.apply(lambda x: literal_eval(str(x)))
+    df["keywords_comment"] = parallel_map(
+        df["comment"], extract_keywords, workers, "Keyword extraction", warm_up
+    )
 
-    df["keywords_comment"] = df["keywords_comment"].apply(
-        lambda keywords: [kewords_lemmatization(keyword) for keyword in keywords]
+    df["keywords_comment"] = parallel_map(
+        df["keywords_comment"],
+        lemmatize_keywords,
+        workers,
+        "Keyword lemmatization",
+        warm_up,
     )
 
     # Convert to lowercase, tokenize, remove stopwords, and apply lemmatization
-    df["lemmatized_disease"] = df["disease"].apply(lemmatize_case)
-    df["lemmatized_antibody"] = df["antibody"].apply(lemmatize_case)
-    df["lemmatized_treatment"] = df["treatment"].apply(lemmatize_case)
+    # once per distinct name
+    df["lemmatized_disease"] = map_distinct(df["disease"], lemmatize_case)
+    df["lemmatized_antibody"] = map_distinct(df["antibody"], lemmatize_case)
+    df["lemmatized_treatment"] = map_distinct(df["treatment"], lemmatize_case)
 
-    df["keywords_comment"] = df.apply(remove_disease_terms, axis=1)
+    df["keywords_comment"] = remove_medication_terms(df)
 
     # Set the output path of the csv
     output_path = config.get("keywords_output_file_path", None)
 
     if output_path:
-        # Save the data to csv if requested
-        df.to_csv(Path(config_data.parent / output_path), index=False)
+        # Save the data if requested, the suffix selects csv or parquet
+        write_table(
+            df,
+            Path(config_data.parent / output_path),
+            merge_on="text_index" if merge else None,
+        )
 
     return df
@@ -1,14 +1,108 @@
+from collections import Counter
 import pandas as pd
 from pathlib import Path
+from typing import Iterable, Iterator
 import yaml
 
-from keywords_extraction import extract_keywords_from_comments
+from utils.io import iter_table, read_table, write_table
+
+from keywords_extraction.keywords_extraction import extract_keywords_from_comments
+
+# columns of the keywords artifact needed for the wordcloud
+WORDCLOUD_COLUMNS = ["text_index", "disease", "treatment", "keywords_comment"]
+
+
+def is_fresh(path: Path, source: Path) -> bool:
+    """
+    Checks if a derived file exists and was written after its source.
+
+    Args:
+        path (Path): The derived file.
+        source (Path): The file it was computed from.
+
+    Returns:
+        bool: True if the derived file can be reused.
+    """
+    return path.exists() and (
+        not source.exists() or path.stat().st_mtime >= source.stat().st_mtime
+    )
+
+
+def keyword_batches(
+    config_path: Path, batch_size: int = 100000
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the keywords of all comments in batches.
+
+    The saved keywords are reused if they are newer than the preprocessed data,
+    otherwise the keywords are extracted again.
+
+    Args:
+        config_path (Path): Path to config file.
+        batch_size (int): Number of comments per batch read from the saved keywords.
+
+    Yields:
+        pd.DataFrame: text_index, disease, treatment and keywords_comment of a batch of comments.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    preprocessing_path = Path(config_path.parent / config["preprocessing_path"])
+    keywords_path = config.get("keywords_output_file_path")
+    if keywords_path and is_fresh(
+        Path(config_path.parent / keywords_path), preprocessing_path
+    ):
+        print("Reusing the saved keywords")
+        yield from iter_table(
+            Path(config_path.parent / keywords_path),
+            columns=WORDCLOUD_COLUMNS,
+            list_columns=["keywords_comment"],
+            batch_size=batch_size,
+        )
+        return
+
+    # Read the preprocessed data and extract keywords from it
+    df = read_table(preprocessing_path)
+    yield extract_keywords_from_comments(df, config_path)[WORDCLOUD_COLUMNS]
+
+
+def aggregate_words(batches: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Counts every word per disease and treatment in a single pass over the batches.
+
+    Args:
+        batches (Iterable[pd.DataFrame]): Batches with disease, treatment and keywords_comment.
+
+    Returns:
+        pd.DataFrame: word, disease, treatment and count, sorted by descending count.
+    """
+    counts: Counter = Counter()
+    for batch in batches:
+        for disease, treatment, words in zip(
+            batch["disease"], batch["treatment"], batch["keywords_comment"]
+        ):
+            if words is None or not len(words):
+                continue
+            counts.update((word, disease, treatment) for word in words)
+
+    df = pd.DataFrame(
+        [(*key, count) for key, count in counts.items()],
+        columns=["word", "disease", "treatment", "count"],
+    )
+    return df.sort_values(
+        ["count", "word", "disease", "treatment"],
+        ascending=[False, True, True, True],
+        ignore_index=True,
+    )
 
 
 def wordcloud(config_path: Path = Path("config.yaml")) -> None:
     """
-    Reads data from a CSV file and extracts keywords from comments based on the configuration
-    specified in a YAML file. Generates a CSV file needed to display a wordcloud in Tableau.
+    Generates the files needed to display a wordcloud in Tableau from the keywords of the comments.
+
+    The exploded file (wordcloud_path) has one row per keyword occurrence, the aggregated
+    file (wordcloud_aggregated_path) one row per word, disease and treatment with its count.
+    Either file is skipped if its path is empty in the config.
 
     Args:
         config_path (Path): Path to config file.
@@ -20,20 +114,39 @@ def wordcloud(config_path: Path = Path("config.yaml")) -> None:
     with open(config_path) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
 
-    # Read the preprocessed data and extract keywords from it
-    df = pd.read_csv(Path(config_path.parent / config["preprocessing_path"]))
-    dataframe = extract_keywords_from_comments(df)
+    exploded_path = config.get("wordcloud_path")
+    aggregated_path = config.get("wordcloud_aggregated_path")
 
-    # Transform each element of a list-like to a row, replicating index values
-    dataframe = dataframe.loc[:, ["text_index", "keywords_comment"]]
-    expanded_df = dataframe.explode("keywords_comment", ignore_index=True)
-    expanded_df = expanded_df.rename(columns={"keywords_comment": "word"})
+    def batches() -> Iterator[pd.DataFrame]:
+        # the exploded file is appended batch by batch while the words are counted
+        if exploded_path:
+            output_path = Path(config_path.parent / exploded_path)
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            header = True
+        for batch in keyword_batches(config_path):
+            if exploded_path:
+                # Transform each element of a list-like to a row, replicating index values
+                expanded_df = batch.loc[:, ["text_index", "keywords_comment"]]
+                expanded_df = expanded_df.explode("keywords_comment", ignore_index=True)
+                expanded_df = expanded_df.rename(columns={"keywords_comment": "word"})
+                expanded_df.to_csv(
+                    output_path,
+                    index=False,
+                    header=header,
+                    mode="w" if header else "a",
+                )
+                header = False
+            yield batch
 
-    # Set the output path of the csv
-    output_path = Path(config_path.parent / config["wordcloud_path"])
+    if aggregated_path:
+        write_table(
+            aggregate_words(batches()), Path(config_path.parent / aggregated_path)
+        )
+    else:
+        for _ in batches():
+            pass
 
-    # Save the data to csv
-    expanded_df.to_csv(output_path, index=False)
+    print("------- Wordcloud Completed -------")
 
 
 if __name__ == "__main__":
@@ -1,51 +1,665 @@
 import click
+from functools import partial
+import pandas as pd
 from pathlib import Path
+import subprocess
+import sys
+from typing import List, Optional
 import yaml
 
+from data_preprocessing.corpus_index import build_corpus_index
 from data_preprocessing.data_preprocess import preprocess_data
+from data_preprocessing.text_normalization import normalize_data, warm_up
 from keywords_extraction.keywords_extraction import extract_keywords_from_comments
+from keywords_extraction.wordcloud_csv import wordcloud
 from markers_extraction.rank_keywords_inside_topic import (
     create_keywords_ranking_for_topics,
 )
-from phrase_modeling.phrase_classification import phrase_classification
+from phrase_modeling.phrase_classification import MODEL_NAME, phrase_classification
 from phrase_modeling.phrase_extraction import phrase_extraction
+from phrase_modeling.vector_classification import VectorTopicClassifier, topic_terms
 from sentiment_analysis.sentiment_analysis import sent_analysis
 from markers_extraction.markers_in_comments import markers_in_comments
+from treatment_evolution.treatment_evolution import main as treatment_evolution
+from utils.incremental import mark_processed, select_new_rows
+from utils.instrumentation import Tracer, record_rows
+from utils.io import read_table, write_table
+from utils.model_manager import (
+    backend_agreement,
+    get_pipeline,
+    get_spacy,
+    label_agreement,
+)
+from utils.sharding import SHARDED_STAGES, merge_shards, split_shards, work_shards
+from utils.stage_runner import Stage, StageRunner
 
+STAGE_NAMES = [
+    "preprocess",
+    "normalize",
+    "corpus_index",
+    "keywords",
+    "wordcloud",
+    "ranking",
+    "phrases",
+    "classification",
+    "sentiment",
+    "markers",
+    "treatment_evolution",
+]
 
-@click.command()
-@click.option(
-    "--config_path",
-    default=Path("config.yaml"),
-    type=click.Path(exists=True),
-    help="Path to the config",
-)
-def main(config_path: Path):
+
+def _state_dir(config_path: Path, config: dict) -> Path:
+    return Path(
+        config_path.parent / config.get("incremental_state_path", "data/incremental")
+    )
+
+
+def _rows_to_process(
+    df: pd.DataFrame, config_path: Path, config: dict, stage: str, incremental: bool
+) -> pd.DataFrame:
+    # in incremental mode only rows the stage has not processed yet are kept
+    if not incremental:
+        return df
+    return select_new_rows(df, _state_dir(config_path, config), stage)
+
+
+def _record_rows(
+    df: pd.DataFrame, config_path: Path, config: dict, stage: str, incremental: bool
+) -> None:
+    # full runs replace the processed rows, incremental runs add to them
+    mark_processed(df, _state_dir(config_path, config), stage, replace=not incremental)
+
+
+def _checkpoint_path(config_path: Path, config: dict) -> Optional[Path]:
+    # checkpoints of the model stages, disabled if the path is empty
+    if not config.get("checkpoint_path"):
+        return None
+    return Path(config_path.parent / config["checkpoint_path"])
+
+
+def _report_agreement(config: dict, task: str, phrases: List[str], **kwargs) -> None:
+    # compares the configured backend with fp32 on a sample of the phrases
+    backend = config.get("inference_backend", "fp32")
+    sample_size = config.get("inference_agreement_sample")
+    if backend != "fp32" and sample_size:
+        backend_agreement(
+            task, phrases, backend=backend, sample_size=sample_size, **kwargs
+        )
+
+
+def _report_vector_agreement(config: dict, phrases: List[str], terms: dict) -> None:
+    # compares the vectors classifier with the fp32 zero-shot model
+    sample_size = config.get("inference_agreement_sample")
+    if sample_size:
+        label_agreement(
+            get_pipeline(
+                "zero-shot-classification",
+                config.get("classification_model", MODEL_NAME),
+            ),
+            VectorTopicClassifier(
+                get_spacy(config.get("spacy_model", "en_core_web_md")),
+                terms,
+                temperature=config.get("vector_temperature", 0.05),
+            ),
+            phrases,
+            candidate_labels=config["topics"],
+            sample_size=sample_size,
+            name="vectors classifier",
+        )
+
+
+def run_preprocess(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
     # perform data preprocessing
     df = preprocess_data(config_path)
+    record_rows(rows_out=len(df))
+
+
+def run_normalize(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    # tokenize and lemmatize every comment once for the later stages
+    df = read_table(
+        Path(config_path.parent / config["preprocessing_path"]),
+        columns=["text_index", "comment"],
+    )
+    df = _rows_to_process(df, config_path, config, "normalize", incremental)
+    record_rows(rows_in=len(df), rows_out=len(df))
+    if len(df):
+        normalize_data(df, config_path, workers=workers, merge=incremental)
+    _record_rows(df, config_path, config, "normalize", incremental)
+
+
+def run_corpus_index(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    # the index is small compared to the comments, so it is always rebuilt
+    indexes = build_corpus_index(config_path)
+    record_rows(rows_in=indexes["lemmas"].matrix.shape[0])
+
 
-    # extract keywords
-    df_keywords = extract_keywords_from_comments(df, config_path)
+def run_keywords(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    df = read_table(Path(config_path.parent / config["preprocessing_path"]))
+    df = _rows_to_process(df, config_path, config, "keywords", incremental)
+    record_rows(rows_in=len(df), rows_out=len(df))
+    if len(df):
+        extract_keywords_from_comments(
+            df, config_path, workers=workers, merge=incremental
+        )
+    _record_rows(df, config_path, config, "keywords", incremental)
+
+
+def run_wordcloud(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    # reuses the keywords written by the keywords stage
+    wordcloud(config_path)
+
+
+def run_ranking(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    # the ranking aggregates over all comments and always runs on the full data
+    df_keywords = read_table(
+        Path(config_path.parent / config["keywords_output_file_path"]),
+        columns=["disease", "keywords_comment"],
+        list_columns=["keywords_comment"],
+    )
+    record_rows(rows_in=len(df_keywords))
     create_keywords_ranking_for_topics(df_keywords, config_path)
 
-    # read the path from the config.yaml file
-    with open(config_path) as f:
-        config = yaml.load(f, Loader=yaml.FullLoader)
+
+def run_phrases(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
     # do phase extraction
-    df_phrase = phrase_extraction(
-        df, min_length=config["min_length"], max_length=config["max_length"]
-    )
+    df = read_table(Path(config_path.parent / config["preprocessing_path"]))
+    df = _rows_to_process(df, config_path, config, "phrases", incremental)
+    record_rows(rows_in=len(df), rows_out=len(df))
+    if len(df):
+        df_phrase = phrase_extraction(
+            df,
+            min_length=config["min_length"],
+            max_length=config["max_length"],
+            workers=workers,
+        )
+        write_table(
+            df_phrase,
+            Path(config_path.parent / config["extracted_phrases_path"]),
+            merge_on="text_index" if incremental else None,
+        )
+    _record_rows(df, config_path, config, "phrases", incremental)
+
+
+def run_classification(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
     # do phrase classification
-    df_phrase = phrase_classification(
-        df_phrase,
-        file_path=Path(config_path.parent / config["phrase_path"]),
-        category_labels=config["topics"],
+    df_phrase = read_table(
+        Path(config_path.parent / config["extracted_phrases_path"]),
+        list_columns=["phrases"],
+    )
+    df_phrase = _rows_to_process(
+        df_phrase, config_path, config, "classification", incremental
+    )
+    record_rows(rows_in=len(df_phrase), rows_out=0)
+    terms = topic_terms(
+        config["topics"], config.get("chron_markers", {}), config.get("uc_markers", {})
     )
+    if len(df_phrase):
+        df_classified = phrase_classification(
+            df_phrase,
+            file_path=Path(config_path.parent / config["phrase_path"]),
+            category_labels=config["topics"],
+            batch_size=config.get("classification_batch_size"),
+            cache_path=(
+                Path(config_path.parent / config["classification_cache_path"])
+                if config.get("classification_cache_path")
+                else None
+            ),
+            cache_max_entries=config.get("classification_cache_max_entries"),
+            merge=incremental,
+            model=config.get("classification_model", MODEL_NAME),
+            backend=config.get("inference_backend", "fp32"),
+            classifier=config.get("classifier", "zero-shot"),
+            topic_terms=terms,
+            spacy_model=config.get("spacy_model", "en_core_web_md"),
+            temperature=config.get("vector_temperature", 0.05),
+            output_mode=config.get("phrase_output_mode", "rows"),
+            checkpoint_path=_checkpoint_path(config_path, config),
+            checkpoint_every=config.get("checkpoint_every"),
+        )
+        record_rows(rows_out=len(df_classified))
+        phrases = df_classified["phrase"].dropna().tolist()
+        if config.get("classifier", "zero-shot") == "vectors":
+            _report_vector_agreement(config, phrases, terms)
+        else:
+            _report_agreement(
+                config,
+                "zero-shot-classification",
+                phrases,
+                model=config.get("classification_model", MODEL_NAME),
+                candidate_labels=config["topics"],
+            )
+    _record_rows(df_phrase, config_path, config, "classification", incremental)
+
+
+def run_sentiment(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
     # do sentiment analysis on phrases
-    df_phrase = sent_analysis(
-        df_phrase, out_path=Path(config_path.parent / config["sent_phrase_path"])
+    df_phrase = read_table(
+        Path(config_path.parent / config["phrase_path"]),
+        list_columns=["phrases", "category", "score"],
     )
-    markers_in_comments(config_path)
+    df_phrase = _rows_to_process(
+        df_phrase, config_path, config, "sentiment", incremental
+    )
+    record_rows(rows_in=len(df_phrase), rows_out=0)
+    if len(df_phrase):
+        df_sentiment = sent_analysis(
+            df_phrase,
+            out_path=Path(config_path.parent / config["sent_phrase_path"]),
+            batch_size=config.get("sentiment_batch_size", 32),
+            max_length=config.get("sentiment_max_length", 512),
+            truncation=config.get("sentiment_truncation", True),
+            merge=incremental,
+            model=config.get("sentiment_model"),
+            backend=config.get("inference_backend", "fp32"),
+            topic_priority=config.get("topic_priority"),
+            topic_min_score=config.get("topic_min_score", 0.4),
+            checkpoint_path=_checkpoint_path(config_path, config),
+            checkpoint_every=config.get("checkpoint_every"),
+        )
+        record_rows(rows_out=len(df_sentiment))
+        _report_agreement(
+            config,
+            "sentiment-analysis",
+            df_sentiment["phrase"].dropna().tolist(),
+            model=config.get("sentiment_model"),
+        )
+    _record_rows(df_phrase, config_path, config, "sentiment", incremental)
+
+
+def run_markers(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    df = read_table(
+        Path(config_path.parent / config["preprocessing_path"]),
+        columns=["text_index", "comment", "disease"],
+    )
+    df = _rows_to_process(df, config_path, config, "markers", incremental)
+    record_rows(rows_in=len(df), rows_out=0)
+    if len(df):
+        df_markers = markers_in_comments(config_path, df=df, merge=incremental)
+        record_rows(rows_out=len(df_markers))
+    _record_rows(df, config_path, config, "markers", incremental)
+
+
+def run_treatment_evolution(
+    config_path: Path, config: dict, workers: int, incremental: bool
+) -> None:
+    # the treatments searched for depend on all comments, so it always runs on the full data
+    df = treatment_evolution(
+        Path(config_path.parent / config["treatment_evolution_config_path"]),
+        workers=workers,
+    )
+    record_rows(rows_out=len(df))
+
+
+def build_stages(
+    config_path: Path, config: dict, workers: int, incremental: bool = False
+) -> List[Stage]:
+    """
+    Declares the stages of the pipeline with their inputs, outputs and config.
+
+    Parameters:
+    - config_path (Path): Path to the config.
+    - config (dict): The loaded config.
+    - workers (int): Number of processes for the CPU-bound text stages.
+    - incremental (bool): Process only comments that are new since the last run.
+
+    Returns:
+    - List[Stage]: The stages of the pipeline.
+    """
+
+    def path(key: str) -> Path:
+        return Path(config_path.parent / config[key])
+
+    def section(*keys: str) -> dict:
+        return {key: config.get(key) for key in keys}
+
+    treatment_config_path = path("treatment_evolution_config_path")
+    with open(treatment_config_path) as f:
+        treatment_config = yaml.load(f, Loader=yaml.FullLoader)
+
+    markers_dir = Path(config_path.parent / config.get("markers_path", "."))
+    marker_files = [
+        markers_dir / f"markers_{disease}.csv"
+        for disease in ["Crohn's Disease", "Ulcerative Colitis"]
+    ]
+
+    def run(func):
+        return partial(func, config_path, config, workers, incremental)
+
+    return [
+        Stage(
+            "preprocess",
+            run(run_preprocess),
+            inputs=[path("file_path")],
+            outputs=[path("preprocessing_path")],
+            config=section("file_path", "diseases", "treatments", "antibodies"),
+        ),
+        Stage(
+            "normalize",
+            run(run_normalize),
+            inputs=[path("preprocessing_path")],
+            outputs=[path("normalized_path")],
+            depends_on=["preprocess"],
+        ),
+        Stage(
+            "corpus_index",
+            run(run_corpus_index),
+            inputs=[path("preprocessing_path"), path("normalized_path")],
+            outputs=[
+                path("corpus_index_path") / name / file
+                for name in ["lemmas", "stems"]
+                for file in ["matrix.npz", "terms.json", "rows.parquet"]
+            ],
+            depends_on=["normalize"],
+        ),
+        Stage(
+            "keywords",
+            run(run_keywords),
+            inputs=[path("preprocessing_path")],
+            outputs=[path("keywords_output_file_path")],
+            depends_on=["preprocess"],
+        ),
+        Stage(
+            "wordcloud",
+            run(run_wordcloud),
+            inputs=[path("keywords_output_file_path")],
+            outputs=[
+                path(key)
+                for key in ["wordcloud_path", "wordcloud_aggregated_path"]
+                if config.get(key)
+            ],
+            depends_on=["keywords"],
+        ),
+        Stage(
+            "ranking",
+            run(run_ranking),
+            inputs=[path("keywords_output_file_path")],
+            outputs=[path("similarity_scores_path")],
+            config=section("topics", "keywords_top_k", "spacy_model"),
+            depends_on=["keywords"],
+        ),
+        Stage(
+            "phrases",
+            run(run_phrases),
+            inputs=[path("preprocessing_path")],
+            outputs=[path("extracted_phrases_path")],
+            config=section("min_length", "max_length"),
+            depends_on=["preprocess"],
+        ),
+        Stage(
+            "classification",
+            run(run_classification),
+            inputs=[path("extracted_phrases_path")],
+            outputs=[path("phrase_path")],
+            config=section(
+                "topics",
+                "classification_model",
+                "classification_batch_size",
+                "classification_cache_path",
+                "inference_backend",
+                "classifier",
+                "vector_temperature",
+                "phrase_output_mode",
+                "spacy_model",
+                "chron_markers",
+                "uc_markers",
+            ),
+            depends_on=["phrases"],
+        ),
+        Stage(
+            "sentiment",
+            run(run_sentiment),
+            inputs=[path("phrase_path")],
+            outputs=[path("sent_phrase_path")],
+            config=section(
+                "sentiment_model",
+                "sentiment_batch_size",
+                "sentiment_max_length",
+                "sentiment_truncation",
+                "inference_backend",
+                "topic_priority",
+                "topic_min_score",
+            ),
+            depends_on=["classification"],
+        ),
+        Stage(
+            "markers",
+            run(run_markers),
+            inputs=[path("preprocessing_path"), path("normalized_path")],
+            outputs=marker_files,
+            config=section("chron_markers", "uc_markers"),
+            depends_on=["normalize"],
+        ),
+        Stage(
+            "treatment_evolution",
+            run(run_treatment_evolution),
+            inputs=[Path(treatment_config_path.parent / treatment_config["file_path"])],
+            outputs=[
+                Path(treatment_config_path.parent / treatment_config[key])
+                for key in ["output_path", "transition_matrix_path"]
+                if treatment_config.get(key)
+            ],
+            config=treatment_config,
+            depends_on=["preprocess"],
+        ),
+    ]
+
+
+def _runner(
+    config_path: Path, config: dict, workers: int, incremental: bool, **kwargs
+) -> StageRunner:
+    return StageRunner(
+        build_stages(config_path, config, workers, incremental),
+        state_path=Path(
+            config_path.parent
+            / config.get("stage_state_path", "data/.stage_state.json")
+        ),
+        **kwargs,
+    )
+
+
+def run_sharded(
+    config_path: Path,
+    config: dict,
+    shards: int,
+    role: str,
+    workers: int,
+    processes: int,
+    force: bool,
+    **kwargs,
+) -> None:
+    """
+    Runs the phrase, classification, sentiment and markers stages shard by shard.
+
+    Parameters:
+    - config_path (Path): Path to the config.
+    - config (dict): The loaded config.
+    - shards (int): Number of shards the preprocessed comments are split into.
+    - role (str): 'split' preprocesses and queues the shards, 'work' processes
+      queued shards until none is left, 'merge' combines the shard outputs and
+      'all' does all three with local worker processes.
+    - workers (int): Number of processes for the CPU-bound text stages of a shard.
+    - processes (int): Number of local worker processes started by 'all'.
+    - force (bool): Run the stages even if they are up to date.
+    - kwargs: Passed to the StageRunner, e.g. max_parallel and tracer.
+    """
+    if role in ["split", "all"]:
+        _runner(config_path, config, workers, False, **kwargs).run(
+            only=["preprocess"], force=force
+        )
+        split_shards(config_path, config, shards)
+
+    if role == "work":
+
+        def run_shard(shard_config_path: Path) -> None:
+            with open(shard_config_path) as f:
+                shard_config = yaml.load(f, Loader=yaml.FullLoader)
+            _runner(shard_config_path, shard_config, workers, False, **kwargs).run(
+                only=SHARDED_STAGES, force=force
+            )
+
+        processed = work_shards(config_path, config, run_shard)
+        print(f"------- Processed {processed} shards -------")
+
+    if role == "all":
+        # the workers are independent processes, exactly as on separate nodes
+        command = [
+            sys.executable,
+            str(Path(__file__).resolve()),
+            "--config_path",
+            str(config_path),
+            "--workers",
+            str(workers),
+            "--shards",
+            str(shards),
+            "--shard-role",
+            "work",
+        ] + (["--force"] if force else [])
+        for worker in [subprocess.Popen(command) for _ in range(processes)]:
+            worker.wait()
+
+    if role in ["merge", "all"]:
+        merge_shards(config_path, config)
+        print("------- Shards Merged -------")
+
+
+@click.command()
+@click.option(
+    "--config_path",
+    default=Path("config.yaml"),
+    type=click.Path(exists=True, path_type=Path),
+    help="Path to the config",
+)
+@click.option(
+    "--workers",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of processes for the CPU-bound text stages",
+)
+@click.option(
+    "--only",
+    multiple=True,
+    type=click.Choice(STAGE_NAMES),
+    help="Run only this stage, can be given several times",
+)
+@click.option(
+    "--from",
+    "start",
+    type=click.Choice(STAGE_NAMES),
+    help="Run this stage and all stages depending on it",
+)
+@click.option(
+    "--force", is_flag=True, help="Run the stages even if they are up to date"
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Process only comments whose text_index is new since the last run",
+)
+@click.option(
+    "--trace",
+    type=click.Path(path_type=Path),
+    help="Append a json line per stage with timings, rows, memory and batches to this file",
+)
+@click.option(
+    "--trace-summary", is_flag=True, help="Print a summary table of the stages"
+)
+@click.option(
+    "--parallel",
+    default=2,
+    type=click.IntRange(min=1),
+    help="Maximum number of independent stages running at the same time",
+)
+@click.option(
+    "--shards",
+    type=click.IntRange(min=1),
+    help="Split the comments into this many shards for the phrase, classification, "
+    "sentiment and markers stages",
+)
+@click.option(
+    "--shard-role",
+    default="all",
+    type=click.Choice(["split", "work", "merge", "all"]),
+    help="Part of the sharded run done by this process, 'all' splits, starts "
+    "--shard-processes local workers and merges",
+)
+@click.option(
+    "--shard-processes",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Number of local worker processes of --shard-role all",
+)
+def main(
+    config_path: Path,
+    workers: int,
+    only: List[str],
+    start: str,
+    force: bool,
+    incremental: bool,
+    trace: Path,
+    trace_summary: bool,
+    parallel: int,
+    shards: Optional[int],
+    shard_role: str,
+    shard_processes: int,
+):
+    # read the path from the config.yaml file
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    # the nltk corpora are loaded lazily and not thread-safe, so they are loaded
+    # here before the stages run in threads
+    warm_up()
+
+    tracer = Tracer(trace) if trace or trace_summary else None
+    if shards:
+        if only or start or incremental:
+            raise click.UsageError(
+                "--shards runs fixed stages on all comments and cannot be combined "
+                "with --only, --from or --incremental"
+            )
+        run_sharded(
+            config_path,
+            config,
+            shards,
+            shard_role,
+            workers,
+            shard_processes,
+            force,
+            max_parallel=parallel,
+            tracer=tracer,
+        )
+    else:
+        _runner(
+            config_path,
+            config,
+            workers,
+            incremental,
+            max_parallel=parallel,
+            tracer=tracer,
+        ).run(only=only, start=start, force=force)
+
+    if trace_summary:
+        print(tracer.summary().to_string(index=False))
 
 
 if __name__ == "__main__":
@@ -1,20 +1,116 @@
 import pandas as pd
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer, PorterStemmer
-from nltk.tokenize import word_tokenize
 from pathlib import Path
-import string
+from typing import Dict, List, Tuple
 import yaml
 
+from data_preprocessing.text_normalization import (
+    load_normalized_comments,
+    stem_token,
+)
+from utils.io import read_table, write_table
+
 
 def stem_tokens(tokens):
-    stemmer = PorterStemmer()
-    return " ".join(stemmer.stem(token) for token in tokens)
+    return " ".join(stem_token(token) for token in tokens)
 
 
 def stem_tokens_markers(tokens):
-    stemmer = PorterStemmer()
-    return [stemmer.stem(token) for token in tokens]
+    return [stem_keyword(token) for token in tokens]
+
+
+def stem_keyword(keyword: str) -> str:
+    """
+    Stems every token of a (multi-word) keyword, so that "stomach pain" matches
+    the stemmed comment text the same way a single word keyword does.
+    """
+    return " ".join(stem_token(token) for token in keyword.split())
+
+
+class MarkerAutomaton:
+    """
+    Aho-Corasick automaton over the stemmed keywords of all markers.
+
+    The automaton is built once for all diseases and topics and finds every
+    keyword occurring as a substring of a stemmed comment in a single pass.
+    Matches are reported per (disease, topic, marker) key.
+    """
+
+    def __init__(self, markers: Dict[str, Dict[str, Dict[str, List[str]]]]) -> None:
+        """
+        Args:
+            markers (dict): Maps a disease to its topics, every topic maps a marker
+                to its keywords.
+        """
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.output: List[List[int]] = [[]]
+        self.patterns: List[str] = []
+        self.pattern_keys: List[List[Tuple[str, str, str]]] = []
+
+        pattern_ids: Dict[str, int] = {}
+        for disease, topics in markers.items():
+            for topic, topic_markers in topics.items():
+                for marker, keywords in topic_markers.items():
+                    for keyword in keywords:
+                        pattern = stem_keyword(keyword)
+                        if not pattern:
+                            continue
+                        if pattern not in pattern_ids:
+                            pattern_ids[pattern] = len(self.patterns)
+                            self.patterns.append(pattern)
+                            self.pattern_keys.append([])
+                            self._add(pattern, pattern_ids[pattern])
+                        keys = self.pattern_keys[pattern_ids[pattern]]
+                        if (disease, topic, marker) not in keys:
+                            keys.append((disease, topic, marker))
+        self._build_failure_links()
+
+    def _add(self, pattern: str, pattern_id: int) -> None:
+        state = 0
+        for char in pattern:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(pattern_id)
+
+    def _build_failure_links(self) -> None:
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = (
+                    self.output[next_state] + self.output[self.fail[next_state]]
+                )
+
+    def search(self, text: str) -> Dict[Tuple[str, str, str], List[int]]:
+        """
+        Finds all markers in a stemmed comment.
+
+        Args:
+            text (str): The stemmed comment.
+
+        Returns:
+            dict: Maps every found (disease, topic, marker) to the start offsets of
+                its keyword hits.
+        """
+        hits: Dict[Tuple[str, str, str], List[int]] = {}
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for pattern_id in self.output[state]:
+                start = position - len(self.patterns[pattern_id]) + 1
+                for key in self.pattern_keys[pattern_id]:
+                    hits.setdefault(key, []).append(start)
+        return hits
 
 
 def find_marker_in_comments(df: pd.DataFrame, keywords: list) -> pd.DataFrame:
@@ -34,7 +130,14 @@ def find_marker_in_comments(df: pd.DataFrame, keywords: list) -> pd.DataFrame:
     )
 
 
-def search_markers_in_comments(df: pd.DataFrame, topics: list, disease: str):
+def search_markers_in_comments(
+    df: pd.DataFrame,
+    topics: list,
+    disease: str,
+    automaton: MarkerAutomaton = None,
+    output_dir: Path = Path("."),
+    merge: bool = False,
+) -> pd.DataFrame:
     """
     Search for markers in the comments of a DataFrame for a specific disease, and saves result to csv.
 
@@ -42,75 +145,104 @@ def search_markers_in_comments(df: pd.DataFrame, topics: list, disease: str):
         df (pd.DataFrame): The DataFrame to search within.
         topics (list): A list of topics and corresponding markers.
         disease (str): The specific disease to filter by.
+        automaton (MarkerAutomaton): Automaton containing the markers of the disease,
+            built from topics if None. Not needed if df has a 'marker_hits' column.
+        output_dir (Path): Directory of the markers_{disease}.csv file.
+        merge (bool): Merge the found markers into the existing file instead of replacing it.
 
     Returns:
-        pd.DataFrame: A DataFrame containing the found markers for the given disease.
+        pd.DataFrame: A DataFrame containing the found markers and their counts for the given disease.
     """
+    topics = list(topics)
     df = df[df["disease"] == disease]
-    result_df = pd.DataFrame()
 
-    for topic, markers in topics:
-        for marker, keywords in markers.items():
-            df[marker] = find_marker_in_comments(df, keywords)
-
-        df_topic = df[list(markers.keys()) + ["text_index"]]
-
-        # Change layout of the table
-        df_long = pd.melt(
-            df_topic, id_vars="text_index", value_vars=df_topic.columns[1:]
-        )
-        df_long = df_long[df_long["value"] == 1]
-        df_long.drop(columns="value", inplace=True)
-        df_long.columns = ["text_index", "marker"]
-        df_long["topic"] = topic
-
-        # Concatenate datasets vertically
-        if result_df.empty:
-            result_df = df_long
-        else:
-            result_df = pd.concat([result_df, df_long], ignore_index=True)
+    if "marker_hits" in df.columns:
+        hits = df["marker_hits"]
+    else:
+        if automaton is None:
+            automaton = MarkerAutomaton({disease: dict(topics)})
+        hits = df["processed_comment"].map(automaton.search)
+
+    # Collect the comments of every marker in a single pass over the hits
+    found: Dict[Tuple[str, str, str], List[Tuple[int, int]]] = {}
+    for text_index, comment_hits in zip(df["text_index"], hits):
+        for key, offsets in comment_hits.items():
+            found.setdefault(key, []).append((text_index, len(offsets)))
+
+    # Long layout ordered by topic, marker and comment
+    records = [
+        (text_index, marker, topic, count)
+        for topic, markers in topics
+        for marker in markers
+        for text_index, count in found.get((disease, topic, marker), [])
+    ]
+    result_df = pd.DataFrame(
+        records, columns=["text_index", "marker", "topic", "count"]
+    )
 
     print(f"---{disease} markers created---")
 
     # Save file as the CSV file
-    csv_file_path = f"markers_{disease}.csv"
-    result_df.to_csv(csv_file_path, index=False)
+    csv_file_path = Path(output_dir) / f"markers_{disease}.csv"
+    csv_file_path.parent.mkdir(parents=True, exist_ok=True)
+    write_table(result_df, csv_file_path, merge_on="text_index" if merge else None)
+
+    return result_df
 
 
-def markers_in_comments(config_path: Path = Path("../config.yaml")):
+def markers_in_comments(
+    config_path: Path = Path("../config.yaml"),
+    df: pd.DataFrame = None,
+    merge: bool = False,
+):
     """
     The function reads a CSV file specified in the configuration, preprocesses comments, and searches for markers
     for Crohn's Disease and Ulcerative Colitis.
 
     Args:
         config_path (Path, optional): Path to the YAML configuration file. Default is "../config.yaml".
+        df (pd.DataFrame, optional): Comments to search, read from the preprocessed data if None.
+        merge (bool): Merge the found markers into the existing files instead of replacing them.
+
+    Returns:
+        pd.DataFrame: The found markers of both diseases.
     """
     # Load the YAML configuration file
     with open(config_path) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
 
-    # Read the CSV file into a dataframe
-    file_path = Path(config_path.parent / config["preprocessing_path"])
-    df = pd.read_csv(file_path)
-
-    stop_words = set(stopwords.words("english"))
-    lemmatizer = WordNetLemmatizer()
-
-    # Convert to lowercase, tokenize, remove stopwords, and apply lemmatization
-    df["processed_comment"] = df["comment"].apply(
-        lambda text: [
-            lemmatizer.lemmatize(token)
-            for token in word_tokenize(
-                text.lower()
-                .strip()
-                .translate(str.maketrans("", "", string.punctuation))
-            )
-            if token not in stop_words and token.isalpha()
-        ]
+    # Read the columns needed for the markers into a dataframe
+    if df is None:
+        file_path = Path(config_path.parent / config["preprocessing_path"])
+        df = read_table(file_path, columns=["text_index", "comment", "disease"])
+
+    # Reuse the normalized comments instead of tokenizing them again
+    df = load_normalized_comments(df, config_path)
+    df["processed_comment"] = df["comment_stems"].map(" ".join)
+
+    # Match the markers of all diseases and topics in a single pass per comment
+    automaton = MarkerAutomaton(
+        {
+            "Crohn's Disease": config["chron_markers"],
+            "Ulcerative Colitis": config["uc_markers"],
+        }
     )
-
-    df["processed_comment"] = df["processed_comment"].apply(stem_tokens)
+    df["marker_hits"] = df["processed_comment"].map(automaton.search)
 
     # Create file with markers for Crohn's Disease and Ulcerative Coliti
-    search_markers_in_comments(df, config["chron_markers"].items(), "Crohn's Disease")
-    search_markers_in_comments(df, config["uc_markers"].items(), "Ulcerative Colitis")
+    output_dir = Path(config_path.parent / config.get("markers_path", "."))
+    chron_df = search_markers_in_comments(
+        df,
+        config["chron_markers"].items(),
+        "Crohn's Disease",
+        output_dir=output_dir,
+        merge=merge,
+    )
+    uc_df = search_markers_in_comments(
+        df,
+        config["uc_markers"].items(),
+        "Ulcerative Colitis",
+        output_dir=output_dir,
+        merge=merge,
+    )
+    return pd.concat([chron_df, uc_df], ignore_index=True)
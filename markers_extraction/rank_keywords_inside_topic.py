@@ -1,75 +1,182 @@
+from itertools import chain
+import numpy as np
 import os
 import pandas as pd
 from pathlib import Path
-import spacy
+from typing import List, Optional
 import yaml
 
+from utils.model_manager import get_spacy
 
-def rank_keywords_inside_topic(
-    df: pd.DataFrame, topic: str, config_data
-) -> pd.DataFrame:
+
+def embed_terms(nlp, terms: List[str]) -> np.ndarray:
     """
-    Retrieve and calculate the similarity of important keywords related to a specific topic within a dataset of diseases.
+    Embeds terms with the static word vectors of a spaCy model.
+
+    Only the tokenizer is run, the vectors are looked up straight from the
+    vectors table, so every term costs a single tokenization.
+
+    Parameters:
+    - nlp (spacy.Language): Loaded spaCy model with word vectors.
+    - terms (List[str]): Terms to embed.
+
+    Returns:
+    - np.ndarray: A (terms x vector width) matrix of the mean token vector per term.
+    """
+    vectors = np.zeros((len(terms), nlp.vocab.vectors_length), dtype=np.float32)
+    for i, doc in enumerate(nlp.tokenizer.pipe(terms)):
+        if len(doc):
+            vectors[i] = doc.vector
+    return vectors
+
+
+def similarity_matrix(nlp, keywords: List[str], topics: List[str]) -> np.ndarray:
+    """
+    Calculates the cosine similarity between every keyword and every topic.
+
+    The scores follow spaCy's Doc.similarity: identical texts score 1 and
+    terms without a word vector score 0.
+
+    Parameters:
+    - nlp (spacy.Language): Loaded spaCy model with word vectors.
+    - keywords (List[str]): Keywords to score.
+    - topics (List[str]): Topics to score the keywords against.
+
+    Returns:
+    - np.ndarray: A (keywords x topics) matrix of similarity scores.
+    """
+    keyword_vectors = embed_terms(nlp, keywords)
+    topic_vectors = embed_terms(nlp, topics)
+
+    keyword_norms = np.linalg.norm(keyword_vectors, axis=1)
+    topic_norms = np.linalg.norm(topic_vectors, axis=1)
+    norms = np.outer(keyword_norms, topic_norms)
+
+    scores = keyword_vectors @ topic_vectors.T
+    scores = np.divide(scores, norms, out=np.zeros_like(scores), where=norms > 0)
+    scores[np.asarray(keywords, dtype=object)[:, None] == np.asarray(topics)] = 1.0
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, k: Optional[int] = None) -> np.ndarray:
+    """
+    Selects the indices of the k highest scores in descending order.
+
+    Only the selected k scores are sorted, the rest is partitioned away.
+
+    Parameters:
+    - scores (np.ndarray): One dimensional array of scores.
+    - k (int): Number of indices to return, all if None.
+
+    Returns:
+    - np.ndarray: Indices of the highest scores, best first.
+    """
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.array([], dtype=np.int64)
+    best = np.argpartition(-scores, k - 1)[:k]
+    return best[np.argsort(-scores[best], kind="stable")]
+
+
+def rank_keywords_for_topics(
+    df: pd.DataFrame,
+    topics: List[str],
+    config_data: Path,
+    nlp=None,
+    top_k: Optional[int] = None,
+) -> None:
+    """
+    Retrieve and calculate the similarity of important keywords related to several topics within a dataset of diseases.
 
     Parameters:
     - df (pandas.DataFrame): A DataFrame containing information about diseases, including a "disease" column and a "keywords_comment" column.
-    - topic (str): The specific topic for which you want to find related keywords.
+    - topics (List[str]): The topics for which you want to find related keywords.
+    - config_data (Path): path to config file.
+    - nlp (spacy.Language): Loaded spaCy model, the model of the config
+      ("en_core_web_md" by default) is loaded if None.
+    - top_k (int): Number of keywords kept per topic, all if None.
 
     The function performs the following steps:
-    1. Filters the data to select the disease.
-    2. Retrieves all unique keywords related to the selected disease.
-    3. Calculates the similarity score between each keyword and the given topic using spaCy word vectors.
-    4. Sorts the similarity scores in descending order.
-    5. Saves the sorted similarity scores to a CSV file named "{disease}_{topic}.csv".
+    1. Embeds all unique keywords of all diseases and the topics once.
+    2. Calculates the (keywords x topics) similarity matrix in a single matrix product.
+    3. Selects the rows of every disease and the top keywords of every topic.
+    4. Saves the sorted similarity scores to a CSV file named "scores_{disease}_{topic}.csv".
 
     Returns:
-    - pandas.DataFrame: A DataFrame containing keywords with sorted similarity scores.
+    - None
     """
     with open(config_data) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
 
-    nlp = spacy.load("en_core_web_md")
+    if nlp is None:
+        nlp = get_spacy(config.get("spacy_model", "en_core_web_md"))
 
     similarity_scores_path = config.get("similarity_scores_path", "")
+    os.makedirs(Path(config_data.parent / similarity_scores_path), exist_ok=True)
+
+    # Get all unique keywords for every disease
+    disease_keywords = {
+        disease: list(
+            dict.fromkeys(
+                chain.from_iterable(
+                    df.loc[df["disease"] == disease, "keywords_comment"]
+                )
+            )
+        )
+        for disease in df["disease"].unique()
+    }
+    all_keywords = list(dict.fromkeys(chain.from_iterable(disease_keywords.values())))
+    positions = {keyword: i for i, keyword in enumerate(all_keywords)}
+
+    # Calculate similarity score between all key words and all topics at once
+    scores = similarity_matrix(nlp, all_keywords, topics)
+    keyword_array = np.asarray(all_keywords, dtype=object)
+
+    for disease, keywords in disease_keywords.items():
+        rows = np.fromiter(
+            (positions[keyword] for keyword in keywords),
+            dtype=np.int64,
+            count=len(keywords),
+        )
 
-    for disease in df["disease"].unique():
-        disease_data = df[df["disease"] == disease]
-
-        # Get all unique keywords for the disease
-        disease_keywords = disease_data["keywords_comment"]
-
-        all_keywords = []
-        for keyword in disease_keywords:
-            all_keywords.extend(keyword)
+        for j, topic in enumerate(topics):
+            topic_scores = scores[rows, j]
+            best = top_k_indices(topic_scores, top_k)
+            similarity_scores = pd.DataFrame(
+                {
+                    "Keyword": keyword_array[rows[best]],
+                    "Similarity Score": topic_scores[best],
+                }
+            )
 
-        all_keywords = list(set(all_keywords))
+            print(f"-- Key words for {topic} for {disease} --")
 
-        # Calculate similarity score between key words and topic
-        similarity_scores = {}
+            # Save similarity scores as the CSV file
+            csv_file_name = f"scores_{disease}_{topic}.csv"
+            similarity_scores.to_csv(
+                Path(config_data.parent / similarity_scores_path / csv_file_name),
+                index=False,
+            )
 
-        for keyword in all_keywords:
-            keyword_vec = nlp(keyword)
-            topic_vec = nlp(topic)
-            similarity_score = keyword_vec.similarity(topic_vec)
-            similarity_scores[keyword] = similarity_score
 
-        # Sort the similarity scores in descending order
-        sorted_similarity_scores = sorted(
-            similarity_scores.items(), key=lambda x: x[1], reverse=True
-        )
-        similarity_scores = pd.DataFrame(
-            sorted_similarity_scores, columns=["Keyword", "Similarity Score"]
-        )
+def rank_keywords_inside_topic(
+    df: pd.DataFrame, topic: str, config_data, nlp=None, top_k: Optional[int] = None
+) -> None:
+    """
+    Retrieve and calculate the similarity of important keywords related to a specific topic within a dataset of diseases.
 
-        print(f"-- Key words for {topic} for {disease} --")
+    Parameters:
+    - df (pandas.DataFrame): A DataFrame containing information about diseases, including a "disease" column and a "keywords_comment" column.
+    - topic (str): The specific topic for which you want to find related keywords.
+    - config_data (Path): path to config file.
+    - nlp (spacy.Language): Loaded spaCy model, "en_core_web_md" is loaded if None.
+    - top_k (int): Number of keywords kept, all if None.
 
-        # Save similarity scores as the CSV file
-        csv_file_name = f"scores_{disease}_{topic}.csv"
-        os.makedirs(Path(config_data.parent / similarity_scores_path), exist_ok=True)
-        similarity_scores.to_csv(
-            Path(config_data.parent / similarity_scores_path / csv_file_name),
-            index=False,
-        )
+    Returns:
+    - None
+    """
+    rank_keywords_for_topics(df, [topic], config_data, nlp=nlp, top_k=top_k)
 
 
 def create_keywords_ranking_for_topics(
@@ -91,7 +198,8 @@ def create_keywords_ranking_for_topics(
 
     topics = config.get("topics", [])
 
-    for topic in topics:
-        rank_keywords_inside_topic(df, topic, config_path)
+    rank_keywords_for_topics(
+        df, topics, config_path, top_k=config.get("keywords_top_k")
+    )
 
     print("----------- Key words from all topics done ---------")
@@ -0,0 +1,171 @@
+import hashlib
+import json
+from pathlib import Path
+import sqlite3
+import time
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+
+# sqlite limits the number of variables in a single statement
+_QUERY_CHUNK = 500
+
+
+def normalize_phrase(phrase: str) -> str:
+    """normalizes a phrase before it is used as part of a cache key
+
+    Args:
+        phrase (str): the phrase as extracted from the comment
+
+    Returns:
+        str: the unicode normalized phrase with collapsed whitespace
+    """
+    return " ".join(unicodedata.normalize("NFC", phrase).split())
+
+
+class ClassificationCache:
+    """Persistent SQLite cache for zero-shot classification results.
+
+    Entries are addressed by a hash of the normalized phrase, the sorted label
+    set and the model id, so changing the topics or the model never returns
+    stale results. When max_entries is set the least recently used entries
+    are evicted once the cache grows beyond it.
+    """
+
+    def __init__(
+        self, path: Path, model_id: str, max_entries: Optional[int] = None
+    ) -> None:
+        """
+        Args:
+            - path (Path): location of the SQLite file, created if missing
+            - model_id (str): model name including revision
+            - max_entries (int): size cap of the cache, no cap if None
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS classifications (
+                key TEXT PRIMARY KEY,
+                labels TEXT NOT NULL,
+                scores TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS idx_last_used ON classifications (last_used)"
+        )
+        self.connection.commit()
+
+    def key(self, phrase: str, labels: Iterable[str]) -> str:
+        """builds the content address of a phrase for a label set"""
+        payload = json.dumps(
+            [normalize_phrase(phrase), sorted(labels), self.model_id],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get_many(self, phrases: List[str], labels: List[str]) -> Dict[str, dict]:
+        """looks up the cached results of the given phrases
+
+        Args:
+            - phrases (List[str]): phrases to look up
+            - labels (List[str]): candidate labels of the classification
+
+        Returns:
+            Dict[str, dict]: pipeline style results of the phrases found in the cache
+        """
+        # phrases that only differ before normalization share a key
+        keys: Dict[str, List[str]] = {}
+        for phrase in dict.fromkeys(phrases):
+            keys.setdefault(self.key(phrase, labels), []).append(phrase)
+        found = {}
+        hit_keys = []
+        key_list = list(keys)
+        for i in range(0, len(key_list), _QUERY_CHUNK):
+            chunk = key_list[i : i + _QUERY_CHUNK]
+            rows = self.connection.execute(
+                "SELECT key, labels, scores FROM classifications "
+                f"WHERE key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            for key, cached_labels, cached_scores in rows:
+                hit_keys.append(key)
+                for phrase in keys[key]:
+                    found[phrase] = {
+                        "sequence": phrase,
+                        "labels": json.loads(cached_labels),
+                        "scores": json.loads(cached_scores),
+                    }
+
+        # mark the hits as recently used for the eviction
+        now = time.time()
+        self.connection.executemany(
+            "UPDATE classifications SET last_used = ? WHERE key = ?",
+            [(now, key) for key in hit_keys],
+        )
+        self.connection.commit()
+
+        self.hits += len(found)
+        self.misses += sum(len(group) for group in keys.values()) - len(found)
+        return found
+
+    def put_many(self, results: Dict[str, dict], labels: List[str]) -> None:
+        """stores classification results and evicts old entries if needed
+
+        Args:
+            - results (Dict[str, dict]): maps phrases to pipeline results
+            - labels (List[str]): candidate labels of the classification
+        """
+        now = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO classifications VALUES (?, ?, ?, ?)",
+            [
+                (
+                    self.key(phrase, labels),
+                    json.dumps(result["labels"]),
+                    json.dumps([float(score) for score in result["scores"]]),
+                    now,
+                )
+                for phrase, result in results.items()
+            ],
+        )
+        self.connection.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """removes the least recently used entries above max_entries
+
+        Returns:
+            int: number of removed entries
+        """
+        if not self.max_entries:
+            return 0
+        overflow = len(self) - self.max_entries
+        if overflow <= 0:
+            return 0
+        self.connection.execute(
+            "DELETE FROM classifications WHERE key IN "
+            "(SELECT key FROM classifications ORDER BY last_used LIMIT ?)",
+            (overflow,),
+        )
+        self.connection.commit()
+        return overflow
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM classifications"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
@@ -1,7 +1,157 @@
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from transformers import pipeline
-from typing import List
+import time
+from typing import Dict, List, Optional
+
+from phrase_modeling.classification_cache import ClassificationCache
+from phrase_modeling.vector_classification import (
+    VECTOR_BATCH_SIZE,
+    VectorTopicClassifier,
+)
+from utils.checkpoint import ChunkCheckpoint, fingerprint, map_chunks
+from utils.instrumentation import record_batch
+from utils.io import write_table
+from utils.model_manager import get_pipeline, get_spacy, model_id
+
+MODEL_NAME = "facebook/bart-large-mnli"
+
+
+def classify_phrases(
+    classifier,
+    phrases: List[str],
+    category_labels: List[str],
+    batch_size: Optional[int] = None,
+    verbose: bool = True,
+) -> Dict[str, dict]:
+    """classifies a list of phrases, running the model once per unique phrase
+
+    Args:
+        - classifier: zero-shot-classification pipeline or VectorTopicClassifier
+        - phrases (List[str]): phrases to classify, may contain duplicates
+        - category_labels (List[str]): list of topics in config.yaml
+        - batch_size (int): number of phrases per forward pass,
+            if None every phrase is classified with a separate call
+        - verbose (bool): print the throughput, the batches are recorded
+            with record_batch either way
+
+    Returns:
+        Dict[str, dict]: maps every unique phrase to the pipeline result
+    """
+    unique_phrases = list(dict.fromkeys(phrases))
+    start = time.perf_counter()
+
+    results = []
+    step = batch_size or 1
+    for i in range(0, len(unique_phrases), step):
+        batch = unique_phrases[i : i + step]
+        batch_start = time.perf_counter()
+        if batch_size:
+            batch_results = classifier(batch, category_labels, batch_size=batch_size)
+        else:
+            batch_results = classifier(batch[0], category_labels)
+        record_batch(len(batch), time.perf_counter() - batch_start)
+        # the pipeline unwraps single element inputs
+        if isinstance(batch_results, dict):
+            batch_results = [batch_results]
+        results.extend(batch_results)
+
+    if verbose:
+        elapsed = time.perf_counter() - start
+        rate = len(phrases) / elapsed if elapsed > 0 else float("inf")
+        mode = f"batch size {batch_size}" if batch_size else "per phrase"
+        print(
+            f"Classified {len(phrases)} phrases ({len(unique_phrases)} unique, "
+            f"{mode}) in {elapsed:.1f}s - {rate:.1f} phrases/sec"
+        )
+
+    return dict(zip(unique_phrases, results))
+
+
+def load_phrase_classifier(
+    category_labels: List[str],
+    classifier: str = "zero-shot",
+    model: str = MODEL_NAME,
+    model_revision: Optional[str] = None,
+    backend: str = "fp32",
+    topic_terms: Optional[Dict[str, List[str]]] = None,
+    spacy_model: str = "en_core_web_md",
+    temperature: float = 0.05,
+):
+    """loads the zero-shot pipeline or builds the vectors classifier
+
+    Args:
+        - category_labels (List[str]): list of topics in config.yaml
+        - classifier (str): "zero-shot" or "vectors"
+        - model (str): name or local path of the zero-shot model
+        - model_revision (str): revision of the model on the hub
+        - backend (str): "fp32", "int8" or "onnx" inference backend
+        - topic_terms (Dict[str, List[str]]): terms of every topic for the
+            prototypes of the vectors classifier, only the topic names if None
+        - spacy_model (str): spaCy model with word vectors of the vectors classifier
+        - temperature (float): softmax temperature of the vectors classifier
+
+    Returns:
+        a callable with the interface of the zero-shot-classification pipeline
+    """
+    if classifier == "vectors":
+        return VectorTopicClassifier(
+            get_spacy(spacy_model),
+            topic_terms or {label: [label] for label in category_labels},
+            temperature=temperature,
+        )
+    if classifier != "zero-shot":
+        raise ValueError(
+            f"Unknown classifier {classifier}, expected zero-shot or vectors"
+        )
+    return get_pipeline("zero-shot-classification", model, model_revision, backend)
+
+
+def score_column(label: str) -> str:
+    """name of the score column of a topic in the normalized output"""
+    return f"score_{label}"
+
+
+def phrase_table(
+    df: pd.DataFrame,
+    results: Dict[str, dict],
+    category_labels: List[str],
+    column_name_phrase: str = "phrases",
+) -> pd.DataFrame:
+    """builds the normalized output with one row per phrase and one
+    float32 score column per topic, comments without phrases have no row
+
+    Args:
+        - df (pd.DataFrame): comments with 'text_index' and the phrases
+        - results (Dict[str, dict]): pipeline result of every phrase
+        - category_labels (List[str]): list of topics in config.yaml
+        - column_name_phrase (str): the column with the phrases
+
+    Returns:
+        pd.DataFrame: text_index, phrase and a score_<topic> column per topic
+    """
+    phrase_lists = [phrases if phrases else [] for phrases in df[column_name_phrase]]
+    phrases = [phrase for phrase_list in phrase_lists for phrase in phrase_list]
+    text_index = np.repeat(
+        df["text_index"].to_numpy(), [len(phrase_list) for phrase_list in phrase_lists]
+    )
+
+    # the scores are ordered by topic once per unique phrase
+    unique_phrases = {phrase: i for i, phrase in enumerate(dict.fromkeys(phrases))}
+    label_position = {label: i for i, label in enumerate(category_labels)}
+    unique_scores = np.zeros((len(unique_phrases), len(category_labels)), np.float32)
+    for phrase, i in unique_phrases.items():
+        result = results[phrase]
+        for label, score in zip(result["labels"], result["scores"]):
+            unique_scores[i, label_position[label]] = score
+    scores = unique_scores[
+        np.fromiter((unique_phrases[phrase] for phrase in phrases), dtype=np.int64)
+    ]
+
+    phrase_df = pd.DataFrame({"text_index": text_index, "phrase": phrases})
+    for label, column in zip(category_labels, scores.T):
+        phrase_df[score_column(label)] = column
+    return phrase_df
 
 
 def phrase_classification(
@@ -9,22 +159,140 @@ def phrase_classification(
     file_path: Path,
     category_labels: List[str],
     column_name_phrase: str = "phrases",
+    batch_size: Optional[int] = None,
+    cache_path: Optional[Path] = None,
+    cache_max_entries: Optional[int] = None,
+    model_revision: Optional[str] = None,
+    merge: bool = False,
+    model: str = MODEL_NAME,
+    backend: str = "fp32",
+    classifier: str = "zero-shot",
+    topic_terms: Optional[Dict[str, List[str]]] = None,
+    spacy_model: str = "en_core_web_md",
+    temperature: float = 0.05,
+    output_mode: str = "rows",
+    checkpoint_path: Optional[Path] = None,
+    checkpoint_every: Optional[int] = None,
 ) -> pd.DataFrame:
     """classifies the extracted phrases into topics
 
     Args:
         - df (pd.DataFrame): the input dataframe
-        - file_path (Path): file for output csv
+        - file_path (Path): output file, csv or parquet
         - category_labels (List[str]): list of topics in config.yaml
         - column_name_phrase (str): the row name of the dataframe
             that contains the phrases that should be classified
+        - batch_size (int): if set, all unique phrases are classified
+            in batches of this size instead of one call per phrase
+        - cache_path (Path): SQLite file caching results across runs,
+            no caching if None
+        - cache_max_entries (int): size cap of the cache
+        - model_revision (str): revision of the model on the hub
+        - merge (bool): merge the rows into an existing output file
+            instead of replacing it
+        - model (str): name or local path of the zero-shot model
+        - backend (str): "fp32", "int8" or "onnx" inference backend
+        - classifier (str): "zero-shot" for the NLI model or "vectors" for the
+            similarity of word vectors to topic prototypes, which is not cached
+        - topic_terms (Dict[str, List[str]]): terms of every topic for the
+            prototypes of the vectors classifier, only the topic names if None
+        - spacy_model (str): spaCy model with word vectors of the vectors classifier
+        - temperature (float): softmax temperature of the vectors classifier
+        - output_mode (str): "rows" copies the comment row for every phrase
+            and adds 'phrase', 'category', 'score' and 'score_price',
+            "normalized" only keeps 'text_index', 'phrase' and a float32
+            score_<topic> column per topic, see phrase_table
+        - checkpoint_path (Path): directory in which the classified phrases
+            are saved every checkpoint_every unique phrases, a rerun on the
+            same phrases resumes from the saved chunks, no checkpoints if None
+        - checkpoint_every (int): number of unique phrases per checkpoint
 
     Returns:
         pd.DataFrame: the output dataframe in which each phrase
         is represented by a row
     """
+    if output_mode not in ("rows", "normalized"):
+        raise ValueError(
+            f"Unknown output mode {output_mode}, expected rows or normalized"
+        )
+
+    # Collect every phrase up front and classify each unique phrase once
+    all_phrases = [
+        phrase for phrases in df[column_name_phrase] if phrases for phrase in phrases
+    ]
+
+    # Only phrases that were not classified in an earlier run need inference
+    results = {}
+    cache = None
+    if cache_path and classifier == "zero-shot":
+        cache = ClassificationCache(
+            cache_path,
+            model_id=model_id(model, model_revision, backend),
+            max_entries=cache_max_entries,
+        )
+        results = cache.get_many(list(dict.fromkeys(all_phrases)), category_labels)
+        print(f"Classification cache hit rate: {cache.hit_rate:.1%}")
+    missing_phrases = [phrase for phrase in all_phrases if phrase not in results]
+
+    checkpoint = None
+    if missing_phrases:
+        unique_missing = list(dict.fromkeys(missing_phrases))
+        if checkpoint_path and checkpoint_every:
+            checkpoint = ChunkCheckpoint(
+                Path(checkpoint_path) / "classification",
+                fingerprint(
+                    unique_missing,
+                    category_labels,
+                    classifier,
+                    # the vectors classifier depends on the spacy model and topic terms
+                    (
+                        [spacy_model, topic_terms, temperature]
+                        if classifier == "vectors"
+                        else model_id(model, model_revision, backend)
+                    ),
+                ),
+                checkpoint_every,
+            )
+        # the model is only loaded if some chunks are not saved yet
+        model_pipeline = None
+        if checkpoint is None or not checkpoint.is_complete(len(unique_missing)):
+            model_pipeline = load_phrase_classifier(
+                category_labels,
+                classifier=classifier,
+                model=model,
+                model_revision=model_revision,
+                backend=backend,
+                topic_terms=topic_terms,
+                spacy_model=spacy_model,
+                temperature=temperature,
+            )
+        if classifier == "vectors":
+            batch_size = VECTOR_BATCH_SIZE
+
+        def classify_chunk(phrases: List[str]) -> pd.DataFrame:
+            chunk_results = classify_phrases(
+                model_pipeline, phrases, category_labels, batch_size
+            )
+            # cached per chunk, so that finished chunks also survive a crash
+            if cache:
+                cache.put_many(chunk_results, category_labels)
+            return pd.DataFrame(
+                {"phrase": list(chunk_results), "result": list(chunk_results.values())}
+            )
+
+        for chunk_df in map_chunks(unique_missing, classify_chunk, checkpoint):
+            results.update(zip(chunk_df["phrase"], chunk_df["result"]))
+    if cache:
+        cache.close()
 
-    classifier = pipeline("zero-shot-classification", model="facebook/bart-large-mnli")
+    if output_mode == "normalized":
+        phrase_df = phrase_table(df, results, category_labels, column_name_phrase)
+        if file_path:
+            write_table(phrase_df, file_path, merge_on="text_index" if merge else None)
+        if checkpoint:
+            checkpoint.clear()
+        print("------- Phrase Modeling Completed -------")
+        return phrase_df
 
     # Create a list to store the new rows
     new_rows = []
@@ -33,10 +301,10 @@ def phrase_classification(
     for _, row in df.iterrows():
         phrases = row[column_name_phrase]
 
-        # If there are phrases, classify and add new rows
+        # If there are phrases, add the classified rows
         if phrases:
             for phrase in phrases:
-                result = classifier(phrase, category_labels)
+                result = results[phrase]
                 categories = result["labels"]
                 scores = result["scores"]
                 new_row = row.copy()  # Create a copy of the original row
@@ -55,9 +323,12 @@ def phrase_classification(
 
     # Creates a new DataFrame from the new rows
     row_df = pd.DataFrame(new_rows)
-    row_df.drop(columns=column_name_phrase)
+    row_df = row_df.drop(columns=column_name_phrase)
     if file_path:
-        row_df.to_csv(file_path, index=False)
+        write_table(row_df, file_path, merge_on="text_index" if merge else None)
+    # the checkpoints are only needed until the output is written
+    if checkpoint:
+        checkpoint.clear()
 
     print("------- Phrase Modeling Completed -------")
 
@@ -1,7 +1,11 @@
+from functools import lru_cache, partial
 import pandas as pd
 from rake_nltk import Rake
 from typing import List
 
+from data_preprocessing.text_normalization import warm_up
+from utils.parallel import parallel_map
+
 
 def extract_keyphrase(text: str, r: Rake) -> List[str]:
     """extracts key phrases from a text input (in our case the comments)
@@ -17,11 +21,32 @@ def extract_keyphrase(text: str, r: Rake) -> List[str]:
     return r.get_ranked_phrases()
 
 
+@lru_cache(maxsize=None)
+def _rake(min_length: int, max_length: int) -> Rake:
+    # one Rake object per process and length setting
+    return Rake(min_length=min_length, max_length=max_length)
+
+
+def extract_phrases(text: str, min_length: int, max_length: int) -> List[str]:
+    """extracts key phrases from a text with a per process Rake object
+
+    Args:
+        text (str): the text that from which phrases should be extracted
+        min_length (int): minimum length of a key phrase
+        max_length (int): maximum length of a key phrase
+
+    Returns:
+        List of the key phrases from the text
+    """
+    return extract_keyphrase(text, _rake(min_length, max_length))
+
+
 def phrase_extraction(
     df: pd.DataFrame,
     min_length: int,
     max_length: int,
     column_name_comment: str = "comment",
+    workers: int = 1,
 ) -> pd.DataFrame:
     """takes a dataframe as input and extracts the key phrases
        of a column and saves these as a new column
@@ -31,15 +56,19 @@ def phrase_extraction(
         - min_length (int): minimum length of a key phrase
         - max_length (int):  maximum length of a key phrase
         - column_name_comment (str): the column which has the untreated comments
+        - workers (int): number of processes used for the extraction
 
     Returns:
          pd.DataFrame: Returns the input dataframe with two added columns
                        with the key words from the processed and unproccessed columns
     """
-    # setting min length to 4 to extract small phrases
-    r = Rake(min_length=min_length, max_length=max_length)
-
     # applies phrase extraction to chosen comment and creates new column "phrases"
-    df["phrases"] = df[column_name_comment].apply(lambda x: extract_keyphrase(x, r))
+    df["phrases"] = parallel_map(
+        df[column_name_comment],
+        partial(extract_phrases, min_length=min_length, max_length=max_length),
+        workers,
+        "Phrase extraction",
+        warm_up,
+    )
 
     return df
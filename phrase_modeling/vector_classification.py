@@ -0,0 +1,115 @@
+import numpy as np
+from typing import Dict, List, Optional, Union
+
+from markers_extraction.rank_keywords_inside_topic import embed_terms
+
+# number of phrases embedded at once by the vectors classifier
+VECTOR_BATCH_SIZE = 10000
+
+
+def topic_terms(topics: List[str], *markers: dict) -> Dict[str, List[str]]:
+    """
+    Collects the terms describing every topic.
+
+    Args:
+        - topics (List[str]): list of topics in config.yaml
+        - markers (dict): marker configs like chron_markers, {topic: {marker: [keywords]}}
+
+    Returns:
+        Dict[str, List[str]]: the topic itself, its marker names and marker keywords per topic
+    """
+    terms = {topic: [topic] for topic in topics}
+    for disease_markers in markers:
+        for topic, topic_markers in disease_markers.items():
+            if topic not in terms:
+                continue
+            for marker, keywords in topic_markers.items():
+                terms[topic].append(marker)
+                terms[topic].extend(keywords)
+    return {topic: list(dict.fromkeys(values)) for topic, values in terms.items()}
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    # rows without vector stay zero
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+
+class VectorTopicClassifier:
+    """Classifies phrases by the similarity of their word vectors to topic prototypes.
+
+    The prototype of a topic is the mean of the normalized vectors of its terms.
+    Called like the zero-shot-classification pipeline, the cosine similarities of a
+    phrase to the candidate topics are turned into scores with a softmax.
+    """
+
+    def __init__(
+        self, nlp, terms: Dict[str, List[str]], temperature: float = 0.05
+    ) -> None:
+        """
+        Args:
+            - nlp (spacy.Language): Loaded spaCy model with word vectors.
+            - terms (Dict[str, List[str]]): terms of every topic, see topic_terms
+            - temperature (float): softmax temperature, lower values give sharper scores
+        """
+        self.nlp = nlp
+        self.temperature = temperature
+        self.prototypes = {}
+        for topic, values in terms.items():
+            prototype = _normalize(embed_terms(self.nlp, values)).mean(axis=0)
+            self.prototypes[topic] = prototype / (np.linalg.norm(prototype) or 1.0)
+
+    def scores(self, phrases: List[str], labels: List[str]) -> np.ndarray:
+        """
+        Scores phrases against topics.
+
+        Args:
+            - phrases (List[str]): phrases to classify
+            - labels (List[str]): topics with a prototype
+
+        Returns:
+            np.ndarray: (phrases x labels) softmax scores, rows sum to 1
+        """
+        missing = [label for label in labels if label not in self.prototypes]
+        if missing:
+            raise ValueError(f"No prototype for the topics {missing}")
+
+        prototypes = np.stack([self.prototypes[label] for label in labels])
+        similarities = _normalize(embed_terms(self.nlp, phrases)) @ prototypes.T
+        logits = similarities / self.temperature
+        logits -= logits.max(axis=1, keepdims=True)
+        scores = np.exp(logits)
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def __call__(
+        self,
+        sequences: Union[str, List[str]],
+        candidate_labels: List[str],
+        batch_size: Optional[int] = None,
+    ) -> Union[dict, List[dict]]:
+        """
+        Classifies phrases with the output format of the zero-shot-classification pipeline.
+
+        Args:
+            - sequences (str | List[str]): phrase or phrases to classify
+            - candidate_labels (List[str]): topics with a prototype
+            - batch_size (int): unused, all phrases are embedded at once
+
+        Returns:
+            dict | List[dict]: sequence, labels sorted by score and their scores
+        """
+        single = isinstance(sequences, str)
+        phrases = [sequences] if single else list(sequences)
+
+        scores = self.scores(phrases, candidate_labels)
+        results = []
+        for phrase, phrase_scores in zip(phrases, scores):
+            order = np.argsort(-phrase_scores, kind="stable")
+            results.append(
+                {
+                    "sequence": phrase,
+                    "labels": [candidate_labels[i] for i in order],
+                    "scores": [float(phrase_scores[i]) for i in order],
+                }
+            )
+        return results[0] if single else results
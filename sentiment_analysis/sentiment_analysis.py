@@ -1,48 +1,145 @@
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from transformers import pipeline
+import time
+from typing import Dict, List, Optional
 
+from sentiment_analysis.topic_assignment import DEFAULT_MIN_SCORE, assign_topics
+from utils.checkpoint import ChunkCheckpoint, fingerprint, map_chunks
+from utils.instrumentation import record_batch
+from utils.io import write_table
+from utils.model_manager import get_pipeline
 
-def topic_condition(row: pd.Series) -> str:
-    """
-    Selects which topic to be the topic of the phrase.
-
-    Parameters:
-    - row(pd.Series): Row of the dataframe for which we are defining the topics.
-    Returns:
-    - str: string of the topic selected.
-    """
-    if len(row["category"]) > 0 and len(row["score"]) > 0:
-        if row["score_price"] > 0.2:
-            return "price"
-        if row["score"][0] > 0.4:
-            return row["category"][0]
-        else:
-            return None
+# number of phrases tokenized at once when measuring the phrase lengths
+_LENGTH_CHUNK = 10000
 
 
-def process_sent_data(df: pd.DataFrame) -> pd.DataFrame:
+def process_sent_data(
+    df: pd.DataFrame,
+    priority: Optional[Dict[str, float]] = None,
+    min_score: float = DEFAULT_MIN_SCORE,
+) -> pd.DataFrame:
     """
     Processes the data from Topic extraction.
 
     Parameters:
-    - df(pd.DataFrame): Dataframe after phrase_modeling
+    - df(pd.DataFrame): Dataframe after phrase_modeling, in the rows or the normalized output mode
+    - priority(Dict[str, float]): Thresholds of the topics checked first, in order,
+      {"price": 0.2} if None.
+    - min_score(float): Threshold of the best topic if no priority topic is selected.
     Returns:
     - pd.DataFrame: Dataframe contained transformed data.
     """
-    df["topic"] = df.apply(topic_condition, axis=1)
-    df = df.drop(["phrases", "category", "score", "score_price"], axis=1)
+    df["topic"] = assign_topics(df, priority, min_score)
+    if "category" in df.columns:
+        df = df.drop(
+            ["phrases", "category", "score", "score_price"], axis=1, errors="ignore"
+        )
+    else:
+        df = df.drop(
+            [column for column in df.columns if column.startswith("score_")], axis=1
+        )
     df = df.dropna(subset="topic")
     return df
 
 
-def sentiment_analysis_transformers(df: pd.DataFrame) -> pd.DataFrame:
+def token_lengths(
+    tokenizer, phrases: List[str], max_length: Optional[int], truncation: bool
+) -> np.ndarray:
+    """
+    Computes the number of tokens of every phrase without keeping the encodings.
+
+    Parameters:
+    - tokenizer: Tokenizer of the sentiment model.
+    - phrases(List[str]): Phrases to measure.
+    - max_length(int): Maximum number of tokens per phrase.
+    - truncation(bool): Whether phrases longer than max_length are truncated.
+    Returns:
+    - np.ndarray: Token length of every phrase.
+    """
+    lengths = np.empty(len(phrases), dtype=np.int32)
+    for start in range(0, len(phrases), _LENGTH_CHUNK):
+        encodings = tokenizer(
+            phrases[start : start + _LENGTH_CHUNK],
+            truncation=truncation,
+            max_length=max_length,
+        )["input_ids"]
+        lengths[start : start + len(encodings)] = [len(ids) for ids in encodings]
+    return lengths
+
+
+def classify_sentiment(
+    classifier,
+    phrases: List[str],
+    batch_size: int = 32,
+    max_length: Optional[int] = 512,
+    truncation: bool = True,
+    bucket_size: Optional[int] = None,
+) -> np.ndarray:
+    """
+    Classifies phrases in length sorted buckets so that every batch is padded
+    only to its own longest phrase.
+
+    Parameters:
+    - classifier: Sentiment analysis pipeline.
+    - phrases(List[str]): Phrases to classify.
+    - batch_size(int): Number of phrases per forward pass.
+    - max_length(int): Maximum number of tokens per phrase.
+    - truncation(bool): Whether phrases longer than max_length are truncated.
+    - bucket_size(int): Number of phrases passed to the pipeline per call,
+      defaults to 8 batches.
+    Returns:
+    - np.ndarray: 1 for positive and 0 for negative phrases, in the input order.
+    """
+    labels = np.empty(len(phrases), dtype=np.int8)
+    if not phrases:
+        return labels
+
+    bucket_size = bucket_size or batch_size * 8
+    lengths = token_lengths(classifier.tokenizer, phrases, max_length, truncation)
+    order = np.argsort(lengths, kind="stable")
+
+    for start in range(0, len(order), bucket_size):
+        indices = order[start : start + bucket_size]
+        bucket_start = time.perf_counter()
+        results = classifier(
+            [phrases[i] for i in indices],
+            batch_size=batch_size,
+            truncation=truncation,
+            max_length=max_length,
+        )
+        record_batch(
+            len(indices),
+            time.perf_counter() - bucket_start,
+            batches=-(-len(indices) // batch_size),
+        )
+        # write the labels back to the original position of the phrases
+        labels[indices] = [entry["label"] != "NEGATIVE" for entry in results]
+
+    return labels
+
+
+def sentiment_analysis_transformers(
+    df: pd.DataFrame,
+    batch_size: int = 32,
+    max_length: Optional[int] = 512,
+    truncation: bool = True,
+    model: Optional[str] = None,
+    backend: str = "fp32",
+    checkpoint: Optional[ChunkCheckpoint] = None,
+) -> pd.DataFrame:
     """
     Perform sentiment analysis using a pretrained CSV model.
 
     Parameters:
     - df(pd.Dataframe): Dataframe upon wihch sentiment analysis will be conducted.
+    - batch_size(int): Number of phrases per forward pass.
+    - max_length(int): Maximum number of tokens per phrase.
+    - truncation(bool): Whether phrases longer than max_length are truncated.
+    - model(str): Name or local path of the sentiment model, the pipeline default if None.
+    - backend(str): "fp32", "int8" or "onnx" inference backend.
+    - checkpoint(ChunkCheckpoint): Saves the labels of every chunk of phrases, the
+      phrases are classified at once if None.
     Returns:
     - pd.DataFrame: DataFrame containing original data with added transformer sentiment labels.
     """
@@ -53,32 +150,87 @@ def sentiment_analysis_transformers(df: pd.DataFrame) -> pd.DataFrame:
 
     phrases = df["phrase"].tolist()
 
-    # Load the classification pipeline
-    classifier = pipeline("sentiment-analysis")
-
-    # Classify the comments
-    results = classifier(phrases)
-
-    # Extract the labels and scores from the results
-    df["transformer_sentiment_labels"] = [entry["label"] for entry in results]
-    df["transformer_sentiment_labels"] = np.where(
-        df["transformer_sentiment_labels"] == "NEGATIVE", 0, 1
+    # Load the classification pipeline, unless all chunks are saved
+    classifier = None
+    if checkpoint is None or not checkpoint.is_complete(len(phrases)):
+        classifier = get_pipeline("sentiment-analysis", model, backend=backend)
+
+    def classify_chunk(chunk: List[str]) -> pd.DataFrame:
+        # Classify the phrases in length sorted buckets
+        labels = classify_sentiment(
+            classifier,
+            chunk,
+            batch_size=batch_size,
+            max_length=max_length,
+            truncation=truncation,
+        )
+        return pd.DataFrame({"label": labels})
+
+    chunks = list(map_chunks(phrases, classify_chunk, checkpoint))
+    df["transformer_sentiment_labels"] = (
+        np.concatenate([chunk["label"].to_numpy() for chunk in chunks])
+        if chunks
+        else np.empty(0, dtype=np.int8)
     )
     return df
 
 
-def sent_analysis(df: pd.DataFrame, out_path: Path) -> pd.DataFrame:
+def sent_analysis(
+    df: pd.DataFrame,
+    out_path: Path,
+    batch_size: int = 32,
+    max_length: Optional[int] = 512,
+    truncation: bool = True,
+    merge: bool = False,
+    model: Optional[str] = None,
+    backend: str = "fp32",
+    topic_priority: Optional[Dict[str, float]] = None,
+    topic_min_score: float = DEFAULT_MIN_SCORE,
+    checkpoint_path: Optional[Path] = None,
+    checkpoint_every: Optional[int] = None,
+) -> pd.DataFrame:
     """
     Performs sentiment analysis on phrase data.
 
     Parameters:
     - df(pd.Dataframe): Dataframe upon wihch sentiment analysis will be conducted.
-    - out_path(Path): Output path for csv after sentiment analysis.
+    - out_path(Path): Output path (csv or parquet) after sentiment analysis.
+    - batch_size(int): Number of phrases per forward pass.
+    - max_length(int): Maximum number of tokens per phrase.
+    - truncation(bool): Whether phrases longer than max_length are truncated.
+    - merge(bool): Merge the rows into an existing output file instead of replacing it.
+    - model(str): Name or local path of the sentiment model, the pipeline default if None.
+    - backend(str): "fp32", "int8" or "onnx" inference backend.
+    - topic_priority(Dict[str, float]): Thresholds of the topics checked first, in order.
+    - topic_min_score(float): Threshold of the best topic.
+    - checkpoint_path(Path): Directory in which the labels are saved every checkpoint_every
+      phrases, a rerun on the same phrases resumes from the saved chunks, no checkpoints if None.
+    - checkpoint_every(int): Number of phrases per checkpoint.
     Returns:
     - pd.DataFrame: DataFrame containing original data with added transformer sentiment labels and topics.
     """
-    df = process_sent_data(df)
-    df = sentiment_analysis_transformers(df)
-    df.to_csv(out_path, index=False)
+    df = process_sent_data(df, topic_priority, topic_min_score)
+    checkpoint = None
+    if checkpoint_path and checkpoint_every and "phrase" in df.columns:
+        checkpoint = ChunkCheckpoint(
+            Path(checkpoint_path) / "sentiment",
+            fingerprint(
+                df["phrase"].tolist(), model, backend, max_length, truncation
+            ),
+            checkpoint_every,
+        )
+    df = sentiment_analysis_transformers(
+        df,
+        batch_size=batch_size,
+        max_length=max_length,
+        truncation=truncation,
+        model=model,
+        backend=backend,
+        checkpoint=checkpoint,
+    )
+    write_table(df, out_path, merge_on="text_index" if merge else None)
+    # the checkpoints are only needed until the output is written
+    if checkpoint:
+        checkpoint.clear()
     print("------- Sentiment Analysis Completed -------")
     return df
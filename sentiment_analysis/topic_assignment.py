@@ -0,0 +1,214 @@
+import click
+from itertools import product
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import yaml
+
+from utils.io import read_table, write_table
+
+# price if its score exceeds 0.2, else the best topic if its score exceeds 0.4
+DEFAULT_PRIORITY = {"price": 0.2}
+DEFAULT_MIN_SCORE = 0.4
+
+
+def score_matrix(df: pd.DataFrame) -> Tuple[np.ndarray, List[str]]:
+    """
+    Collects the topic scores of the phrases into a (phrases x topics) matrix.
+
+    Parameters:
+    - df(pd.DataFrame): Output of phrase_modeling, either with 'category' and 'score' lists
+      or with a score_<topic> column per topic.
+    Returns:
+    - np.ndarray: float32 scores, rows of phrases without scores are NaN.
+    - List[str]: The topic of every column.
+    """
+    if "category" not in df.columns:
+        columns = [column for column in df.columns if column.startswith("score_")]
+        labels = [column[len("score_") :] for column in columns]
+        return df[columns].to_numpy(dtype=np.float32), labels
+
+    # rows with scores share the same topics, in the order of their scores
+    lengths = df["category"].map(len).to_numpy()
+    valid = np.flatnonzero(lengths > 0)
+    categories = np.array(df["category"].iloc[valid].tolist(), dtype=object)
+    labels = list(dict.fromkeys(categories.ravel())) if len(valid) else []
+
+    scores = np.full((len(df), len(labels)), np.nan, dtype=np.float32)
+    if len(valid):
+        codes = pd.Categorical(categories.ravel(), categories=labels).codes
+        scores[valid[:, None], codes.reshape(categories.shape)] = np.array(
+            df["score"].iloc[valid].tolist(), dtype=np.float32
+        )
+    return scores, labels
+
+
+class TopicScores:
+    """Precomputes the best topic of every phrase, so that topics can be assigned
+    for many thresholds without touching the scores again."""
+
+    def __init__(self, scores: np.ndarray, labels: List[str]) -> None:
+        """
+        Parameters:
+        - scores(np.ndarray): (phrases x topics) scores, NaN rows have no topic.
+        - labels(List[str]): The topic of every column.
+        """
+        self.labels = list(labels)
+        self.scores = np.where(np.isnan(scores), -np.inf, scores)
+        self.has_scores = ~np.isnan(scores).any(axis=1) & (scores.shape[1] > 0)
+        if scores.shape[1]:
+            self.top = self.scores.argmax(axis=1)
+            self.top_score = self.scores[np.arange(len(scores)), self.top]
+        else:
+            self.top = np.zeros(len(scores), dtype=np.int64)
+            self.top_score = np.full(len(scores), -np.inf)
+
+    def codes(self, priority: Dict[str, float], min_score: float) -> np.ndarray:
+        """
+        Assigns the topic of every phrase.
+
+        Topics of the priority rules are checked in order, the first one whose score
+        exceeds its threshold is selected. Otherwise the best topic is selected if its
+        score exceeds min_score.
+
+        Parameters:
+        - priority(Dict[str, float]): Thresholds of the topics checked first, in order.
+        - min_score(float): Threshold of the best topic.
+        Returns:
+        - np.ndarray: The column of the selected topic, -1 if no topic is selected.
+        """
+        codes = np.where(self.top_score > min_score, self.top, -1)
+        # the rules are applied in reverse, so that earlier rules overwrite later ones
+        for label, threshold in reversed(list(priority.items())):
+            if label in self.labels:
+                column = self.labels.index(label)
+                codes = np.where(self.scores[:, column] > threshold, column, codes)
+        return np.where(self.has_scores, codes, -1)
+
+    def topics(self, priority: Dict[str, float], min_score: float) -> np.ndarray:
+        """returns the selected topic of every phrase, None if no topic is selected"""
+        labels = np.array(self.labels + [None], dtype=object)
+        # code -1 selects the appended None
+        return labels[self.codes(priority, min_score)]
+
+
+def assign_topics(
+    df: pd.DataFrame,
+    priority: Optional[Dict[str, float]] = None,
+    min_score: float = DEFAULT_MIN_SCORE,
+) -> pd.Series:
+    """
+    Selects the topic of every phrase from its topic scores.
+
+    Parameters:
+    - df(pd.DataFrame): Output of phrase_modeling in the rows or the normalized output mode.
+    - priority(Dict[str, float]): Thresholds of the topics checked first, in order.
+    - min_score(float): Threshold of the best topic.
+    Returns:
+    - pd.Series: The selected topic of every phrase, None if no topic is selected.
+    """
+    priority = DEFAULT_PRIORITY if priority is None else priority
+    topic_scores = TopicScores(*score_matrix(df))
+    return pd.Series(
+        topic_scores.topics(priority, min_score), index=df.index, dtype=object
+    )
+
+
+def sweep_thresholds(
+    topic_scores: TopicScores,
+    priority_grid: Dict[str, List[float]],
+    min_scores: List[float],
+) -> pd.DataFrame:
+    """
+    Reports the topic distribution for every combination of thresholds.
+
+    Parameters:
+    - topic_scores(TopicScores): The scores of the phrases.
+    - priority_grid(Dict[str, List[float]]): Thresholds to try for every priority topic,
+      the rules are checked in the order of the dict.
+    - min_scores(List[float]): Thresholds of the best topic to try.
+    Returns:
+    - pd.DataFrame: One row per combination with the thresholds, the number of phrases
+      per topic and without topic, and the share of phrases with a topic.
+    """
+    labels = topic_scores.labels
+    records = []
+    for values in product(*priority_grid.values(), min_scores):
+        priority = dict(zip(priority_grid, values[:-1]))
+        codes = topic_scores.codes(priority, values[-1])
+        # phrases without topic (code -1) are counted in the first bin
+        counts = np.bincount(codes + 1, minlength=len(labels) + 1)
+        record = {f"threshold_{label}": value for label, value in priority.items()}
+        record["min_score"] = values[-1]
+        record.update({f"n_{label}": int(n) for label, n in zip(labels, counts[1:])})
+        record["n_none"] = int(counts[0])
+        record["assigned_share"] = round(1 - counts[0] / max(len(codes), 1), 4)
+        records.append(record)
+    return pd.DataFrame(records)
+
+
+def _grid(values: str) -> List[float]:
+    return [float(value) for value in values.split(",") if value]
+
+
+@click.command()
+@click.option(
+    "--config_path",
+    type=click.Path(exists=True, path_type=Path),
+    default=Path(__file__).parents[1] / "config.yaml",
+    help="Path to the configuration file",
+)
+@click.option(
+    "--priority",
+    multiple=True,
+    help="Thresholds of a priority topic, e.g. price=0.1,0.2,0.3, "
+    "the priority rules of the config if not set",
+)
+@click.option(
+    "--min-score",
+    "min_scores",
+    default="0.3,0.4,0.5",
+    help="Comma separated thresholds of the best topic",
+)
+@click.option(
+    "--output",
+    type=click.Path(path_type=Path),
+    help="File the results are written to, only printed if not set",
+)
+def main(
+    config_path: Path, priority: Tuple[str], min_scores: str, output: Optional[Path]
+) -> None:
+    """
+    Sweeps the topic thresholds over the saved classification scores, without any inference.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    if priority:
+        priority_grid = {
+            label: _grid(values)
+            for label, values in (rule.split("=", 1) for rule in priority)
+        }
+    else:
+        priority_grid = {
+            label: [threshold]
+            for label, threshold in config.get(
+                "topic_priority", DEFAULT_PRIORITY
+            ).items()
+        }
+
+    df = read_table(
+        Path(config_path.parent / config["phrase_path"]),
+        list_columns=["category", "score"],
+    )
+    results = sweep_thresholds(
+        TopicScores(*score_matrix(df)), priority_grid, _grid(min_scores)
+    )
+    print(results.to_string(index=False))
+    if output:
+        write_table(results, output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio
+import click
+import json
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import yaml
+
+from data_preprocessing.text_normalization import normalize_text, stem_token, warm_up
+from markers_extraction.markers_in_comments import MarkerAutomaton
+from phrase_modeling.phrase_classification import (
+    MODEL_NAME,
+    classify_phrases,
+    load_phrase_classifier,
+)
+from phrase_modeling.phrase_extraction import extract_phrases
+from phrase_modeling.vector_classification import topic_terms
+from sentiment_analysis.sentiment_analysis import classify_sentiment
+from sentiment_analysis.topic_assignment import assign_topics
+from service.micro_batching import MicroBatcher
+from utils.model_manager import get_pipeline
+
+DISEASES = {"Crohn's Disease": "chron_markers", "Ulcerative Colitis": "uc_markers"}
+
+
+class CommentScorer:
+    """Runs the phrase, topic, sentiment and marker steps of the pipeline on a batch of comments.
+
+    The models are loaded once when the scorer is created, all phrases of a batch
+    share the forward passes of the classification and sentiment models.
+    """
+
+    def __init__(self, config: dict) -> None:
+        """
+        Args:
+            - config (dict): the loaded config.yaml
+        """
+        self.config = config
+        self.topics = config["topics"]
+        self.min_length = config["min_length"]
+        self.max_length = config["max_length"]
+
+        warm_up()
+        self.classifier = load_phrase_classifier(
+            self.topics,
+            classifier=config.get("classifier", "zero-shot"),
+            model=config.get("classification_model", MODEL_NAME),
+            backend=config.get("inference_backend", "fp32"),
+            topic_terms=topic_terms(
+                self.topics, *(config.get(key, {}) for key in DISEASES.values())
+            ),
+            spacy_model=config.get("spacy_model", "en_core_web_md"),
+            temperature=config.get("vector_temperature", 0.05),
+        )
+        self.sentiment = get_pipeline(
+            "sentiment-analysis",
+            config.get("sentiment_model"),
+            backend=config.get("inference_backend", "fp32"),
+        )
+        self.automaton = MarkerAutomaton(
+            {disease: config[key] for disease, key in DISEASES.items()}
+        )
+
+    def markers(self, comment: str, disease: Optional[str]) -> List[dict]:
+        """
+        Finds the markers of a comment.
+
+        Args:
+            - comment (str): the untreated comment
+            - disease (str): only markers of this disease, of all diseases if None
+
+        Returns:
+            List[dict]: disease, topic, marker and number of keyword hits
+        """
+        stems = " ".join(stem_token(token) for token in normalize_text(comment))
+        return [
+            {"disease": d, "topic": topic, "marker": marker, "count": len(offsets)}
+            for (d, topic, marker), offsets in self.automaton.search(stems).items()
+            if disease is None or d == disease
+        ]
+
+    def score(self, requests: List[Tuple[str, Optional[str]]]) -> List[dict]:
+        """
+        Scores a batch of comments.
+
+        Args:
+            - requests (List[Tuple[str, str]]): comment and disease (or None) pairs
+
+        Returns:
+            List[dict]: per comment its phrases with topic and sentiment, and its markers
+        """
+        comment_phrases = [
+            extract_phrases(comment, self.min_length, self.max_length)
+            for comment, _ in requests
+        ]
+        all_phrases = [phrase for phrases in comment_phrases for phrase in phrases]
+        classified = classify_phrases(
+            self.classifier,
+            all_phrases,
+            self.topics,
+            batch_size=self.config.get("classification_batch_size") or 16,
+            # the micro-batches are reported by the /metrics endpoint instead
+            verbose=False,
+        )
+
+        # the topic of a phrase is selected as in the sentiment analysis stage
+        scores = pd.DataFrame(
+            {
+                "category": [result["labels"] for result in classified.values()],
+                "score": [result["scores"] for result in classified.values()],
+            }
+        )
+        topics: Dict[str, Optional[str]] = dict(
+            zip(
+                classified,
+                assign_topics(
+                    scores,
+                    self.config.get("topic_priority"),
+                    self.config.get("topic_min_score", 0.4),
+                ),
+            )
+        )
+        topic_phrases = [phrase for phrase, topic in topics.items() if topic]
+        labels = classify_sentiment(
+            self.sentiment,
+            topic_phrases,
+            batch_size=self.config.get("sentiment_batch_size", 32),
+            max_length=self.config.get("sentiment_max_length", 512),
+            truncation=self.config.get("sentiment_truncation", True),
+        )
+        sentiments = {
+            phrase: "positive" if label else "negative"
+            for phrase, label in zip(topic_phrases, labels)
+        }
+
+        return [
+            {
+                "comment": comment,
+                "phrases": [
+                    {
+                        "phrase": phrase,
+                        "topic": topics[phrase],
+                        "topic_score": classified[phrase]["scores"][0],
+                        "sentiment": sentiments.get(phrase),
+                    }
+                    for phrase in phrases
+                ],
+                "markers": self.markers(comment, disease),
+            }
+            for (comment, disease), phrases in zip(requests, comment_phrases)
+        ]
+
+
+def _response(status: str, body: dict) -> bytes:
+    payload = json.dumps(body).encode()
+    head = (
+        f"HTTP/1.1 {status}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(payload)}\r\n"
+        "Connection: close\r\n\r\n"
+    )
+    return head.encode() + payload
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Tuple[str, str, bytes]:
+    # parses the request line, the headers and the body of a http request
+    request_line = (await reader.readline()).decode().split()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode().strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    body = await reader.readexactly(int(headers.get("content-length", 0)))
+    method, path = (request_line + ["", ""])[:2]
+    return method, path, body
+
+
+class InferenceService:
+    """HTTP service scoring comments with micro-batched model calls.
+
+    Endpoints:
+        - POST /score: {"comment": str, "disease": str} or {"comments": [...]} of these
+        - GET /metrics: queue depth and batch statistics
+        - GET /health: liveness check
+    """
+
+    def __init__(
+        self, scorer: CommentScorer, max_batch_size: int, max_latency_ms: float
+    ) -> None:
+        """
+        Args:
+            - scorer (CommentScorer): scores batches of comments
+            - max_batch_size (int): maximum number of comments per batch
+            - max_latency_ms (float): time a comment waits for other comments
+        """
+        self.batcher = MicroBatcher(scorer.score, max_batch_size, max_latency_ms)
+
+    async def score(self, body: dict) -> dict:
+        items = body["comments"] if "comments" in body else [body]
+        requests = [(item["comment"], item.get("disease")) for item in items]
+        results = await asyncio.gather(*(self.batcher.submit(r) for r in requests))
+        return {"results": list(results)}
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        try:
+            method, path, body = await _read_request(reader)
+            if method == "POST" and path == "/score":
+                response = _response("200 OK", await self.score(json.loads(body)))
+            elif method == "GET" and path == "/metrics":
+                response = _response("200 OK", self.batcher.metrics())
+            elif method == "GET" and path == "/health":
+                response = _response("200 OK", {"status": "ok"})
+            else:
+                response = _response("404 Not Found", {"error": f"{method} {path}"})
+        except (ValueError, KeyError, TypeError) as e:
+            response = _response("400 Bad Request", {"error": repr(e)})
+        except Exception as e:
+            response = _response("500 Internal Server Error", {"error": repr(e)})
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+
+    async def serve(self, host: str, port: int) -> None:
+        self.batcher.start()
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving on http://{host}:{port}")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            await self.batcher.stop()
+
+
+@click.command()
+@click.option(
+    "--config_path",
+    type=click.Path(exists=True, path_type=Path),
+    default=Path(__file__).parents[1] / "config.yaml",
+    help="Path to the configuration file",
+)
+@click.option("--host", help="Host to bind, service_host of the config if not set")
+@click.option("--port", type=int, help="Port, service_port of the config if not set")
+def main(config_path: Path, host: Optional[str], port: Optional[int]) -> None:
+    """
+    Serves the phrase extraction, topic classification, sentiment analysis and marker search over HTTP.
+    """
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    service = InferenceService(
+        CommentScorer(config),
+        max_batch_size=config.get("service_max_batch_size", 32),
+        max_latency_ms=config.get("service_max_latency_ms", 20),
+    )
+    asyncio.run(
+        service.serve(
+            host or config.get("service_host", "127.0.0.1"),
+            port or config.get("service_port", 8000),
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import time
+from typing import Any, Callable, List
+
+
+class MicroBatcher:
+    """Gathers concurrent requests into batches for a batch function.
+
+    A batch is started as soon as max_batch_size items are waiting or the first
+    waiting item has waited max_latency_ms. The batch function runs in a single
+    background thread, so the event loop keeps accepting requests meanwhile and
+    the models never run concurrently.
+    """
+
+    def __init__(
+        self,
+        batch_func: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 32,
+        max_latency_ms: float = 20,
+    ) -> None:
+        """
+        Args:
+            - batch_func (Callable): maps a list of items to a list of results
+            - max_batch_size (int): maximum number of items per batch
+            - max_latency_ms (float): time the first item of a batch waits for more items
+        """
+        self.batch_func = batch_func
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+
+        # monitoring
+        self.items_total = 0
+        self.batches_total = 0
+        self.errors_total = 0
+        self.batch_sizes: Counter = Counter()
+        self.batch_seconds_total = 0.0
+        self.wait_seconds_total = 0.0
+
+    def start(self) -> None:
+        """starts the batching loop on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """stops the batching loop and the background thread"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, item: Any) -> Any:
+        """
+        Queues an item and waits for its result.
+
+        Args:
+            - item: input of the batch function
+
+        Returns:
+            the result of the item
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> list:
+        # waits for the first item, then for more items until the batch is full
+        # or the latency budget of the first item is used up
+        batch = [await self._queue.get()]
+        deadline = batch[0][2] + self.max_latency
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        while len(batch) < self.max_batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            items = [item for item, _, _ in batch]
+            start = time.perf_counter()
+            self.wait_seconds_total += sum(start - queued for _, _, queued in batch)
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self.batch_func, items
+                )
+            except Exception as e:
+                self.errors_total += 1
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            finally:
+                self.batches_total += 1
+                self.items_total += len(batch)
+                self.batch_sizes[len(batch)] += 1
+                self.batch_seconds_total += time.perf_counter() - start
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+    def metrics(self) -> dict:
+        """
+        Reports the queue and batch statistics.
+
+        Returns:
+            dict: queue depth, totals, average batch size, latency and batch size histogram
+        """
+        batches = self.batches_total or 1
+        items = self.items_total or 1
+        return {
+            "queue_depth": self._queue.qsize(),
+            "items_total": self.items_total,
+            "batches_total": self.batches_total,
+            "errors_total": self.errors_total,
+            "avg_batch_size": round(self.items_total / batches, 2),
+            "avg_batch_ms": round(1000 * self.batch_seconds_total / batches, 1),
+            "avg_queue_wait_ms": round(1000 * self.wait_seconds_total / items, 1),
+            "batch_size_histogram": {
+                str(size): count for size, count in sorted(self.batch_sizes.items())
+            },
+        }
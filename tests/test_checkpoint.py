@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from utils.checkpoint import ChunkCheckpoint, fingerprint, map_chunks
+
+ITEMS = list(range(25))
+
+
+def double(items):
+    return pd.DataFrame({"value": [2 * item for item in items]})
+
+
+def collect(chunks):
+    return pd.concat(list(chunks), ignore_index=True)["value"].tolist()
+
+
+def test_without_checkpoint_all_items_are_processed_at_once():
+    calls = []
+
+    def record(items):
+        calls.append(items)
+        return double(items)
+
+    result = collect(map_chunks(ITEMS, record))
+    assert result == [2 * item for item in ITEMS]
+    assert calls == [ITEMS]
+
+
+def test_rerun_resumes_from_the_saved_chunks(tmp_path):
+    key = fingerprint(ITEMS, "model")
+
+    def crash_in_third_chunk(items):
+        if items[0] == 20:
+            raise RuntimeError("killed")
+        return double(items)
+
+    checkpoint = ChunkCheckpoint(tmp_path, key, 10)
+    with pytest.raises(RuntimeError):
+        collect(map_chunks(ITEMS, crash_in_third_chunk, checkpoint))
+
+    calls = []
+
+    def record(items):
+        calls.append(items)
+        return double(items)
+
+    checkpoint = ChunkCheckpoint(tmp_path, key, 10)
+    assert checkpoint.completed == {0, 1}
+    assert not checkpoint.is_complete(len(ITEMS))
+    result = collect(map_chunks(ITEMS, record, checkpoint))
+    assert result == [2 * item for item in ITEMS]
+    assert calls == [ITEMS[20:]]
+    assert ChunkCheckpoint(tmp_path, key, 10).is_complete(len(ITEMS))
+
+
+@pytest.mark.parametrize(
+    "key, chunk_size", [(fingerprint(ITEMS, "other model"), 10), (None, 5)]
+)
+def test_checkpoints_of_other_inputs_are_discarded(tmp_path, key, chunk_size):
+    saved_key = fingerprint(ITEMS, "model")
+    collect(map_chunks(ITEMS, double, ChunkCheckpoint(tmp_path, saved_key, 10)))
+
+    checkpoint = ChunkCheckpoint(tmp_path, key or saved_key, chunk_size)
+    assert checkpoint.completed == set()
+    assert not list(tmp_path.glob("chunk_*"))
+
+
+def test_clear_removes_the_checkpoint(tmp_path):
+    checkpoint = ChunkCheckpoint(tmp_path / "classification", "key", 10)
+    collect(map_chunks(ITEMS, double, checkpoint))
+    checkpoint.clear()
+    assert not (tmp_path / "classification").exists()
+    assert ChunkCheckpoint(tmp_path / "classification", "key", 10).completed == set()
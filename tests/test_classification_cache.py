@@ -0,0 +1,54 @@
+from itertools import count
+
+from phrase_modeling import classification_cache
+from phrase_modeling.classification_cache import ClassificationCache
+
+LABELS = ["effect", "price", "frequency"]
+
+
+def result(phrase, scores=(0.6, 0.3, 0.1)):
+    return {"sequence": phrase, "labels": LABELS, "scores": list(scores)}
+
+
+def test_results_are_keyed_by_phrase_labels_and_model(tmp_path):
+    cache = ClassificationCache(tmp_path / "cache.sqlite", model_id="model@main")
+    cache.put_many({"very expensive": result("very expensive")}, LABELS)
+
+    found = cache.get_many(["very expensive", "works well"], list(reversed(LABELS)))
+    assert found == {"very expensive": result("very expensive")}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # another label set or model never returns the stored result
+    assert cache.get_many(["very expensive"], ["effect", "price"]) == {}
+    other_model = ClassificationCache(tmp_path / "cache.sqlite", model_id="model@v2")
+    assert other_model.get_many(["very expensive"], LABELS) == {}
+
+
+def test_phrases_with_the_same_normalized_key_are_all_hits(tmp_path):
+    cache = ClassificationCache(tmp_path / "cache.sqlite", model_id="model")
+    cache.put_many({"too  expensive": result("too  expensive")}, LABELS)
+
+    phrases = ["too expensive", "too  expensive", " too expensive"]
+    found = cache.get_many(phrases, LABELS)
+    assert set(found) == set(phrases)
+    assert all(found[phrase]["sequence"] == phrase for phrase in found)
+    assert (cache.hits, cache.misses) == (3, 0)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = count()
+    monkeypatch.setattr(classification_cache.time, "time", lambda: next(clock))
+    cache = ClassificationCache(
+        tmp_path / "cache.sqlite", model_id="model", max_entries=2
+    )
+    cache.put_many({"first": result("first")}, LABELS)
+    cache.put_many({"second": result("second")}, LABELS)
+    # a hit marks the entry as recently used
+    cache.get_many(["first"], LABELS)
+    cache.put_many({"third": result("third")}, LABELS)
+
+    assert len(cache) == 2
+    assert set(cache.get_many(["first", "second", "third"], LABELS)) == {
+        "first",
+        "third",
+    }
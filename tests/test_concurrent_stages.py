@@ -0,0 +1,53 @@
+import threading
+
+import nltk
+import pytest
+
+from data_preprocessing.text_normalization import normalize_text, warm_up
+from keywords_extraction.keywords_extraction import extract_keywords
+from phrase_modeling.phrase_extraction import extract_phrases
+from utils.stage_runner import Stage, StageRunner
+
+COMMENTS = [
+    "The injections were expensive but my stomach pain went into full remission.",
+    "Switched from Humira because of constant headaches and fatigue.",
+] * 50
+
+
+def nltk_data_available():
+    for resource in ["corpora/stopwords", "corpora/wordnet", "tokenizers/punkt"]:
+        try:
+            nltk.data.find(resource)
+        except LookupError:
+            return False
+    return True
+
+
+@pytest.mark.skipif(not nltk_data_available(), reason="nltk data is not installed")
+def test_nltk_stages_run_concurrently_after_warm_up(tmp_path):
+    # main.py warms up in the main thread before the runner starts its threads
+    warm_up()
+    started = threading.Barrier(3, timeout=30)
+    results = {}
+
+    def stage(name, func):
+        def run():
+            started.wait()
+            results[name] = [func(comment) for comment in COMMENTS]
+
+        return Stage(name, run)
+
+    runner = StageRunner(
+        [
+            stage("normalize", normalize_text),
+            stage("keywords", extract_keywords),
+            stage("phrases", lambda text: extract_phrases(text, 3, 12)),
+        ],
+        state_path=tmp_path / "state.json",
+        max_parallel=3,
+    )
+    runner.run()
+
+    assert set(results) == {"normalize", "keywords", "phrases"}
+    assert results["normalize"][0] == normalize_text(COMMENTS[0])
+    assert all(results["keywords"]) and all(results["phrases"])
@@ -0,0 +1,49 @@
+import random
+import string
+
+from treatment_evolution.treatment_evolution import (
+    FuzzyTreatmentMatcher,
+    find_fuzzy_treatment,
+)
+
+TREATMENTS = ["Humira", "Stelara", "Entyvio", "Remicade", "Azathioprine", "5-ASA"]
+
+
+def mutate(word, rng):
+    # typos as they appear in the comments: replaced, dropped and added characters
+    chars = list(word)
+    for _ in range(rng.randint(0, 3)):
+        position = rng.randrange(len(chars) + 1)
+        edit = rng.choice(["replace", "drop", "add"])
+        if edit == "add" or not chars:
+            chars.insert(position, rng.choice(string.ascii_letters))
+        elif edit == "drop":
+            chars.pop(min(position, len(chars) - 1))
+        else:
+            chars[min(position, len(chars) - 1)] = rng.choice(string.ascii_letters)
+    return "".join(chars)
+
+
+def random_word(rng):
+    if rng.random() < 0.5:
+        return mutate(rng.choice(TREATMENTS), rng)
+    length = rng.randint(1, 12)
+    return "".join(rng.choice(string.ascii_letters + "-5") for _ in range(length))
+
+
+def test_matcher_matches_find_fuzzy_treatment():
+    rng = random.Random(0)
+    comments = [
+        " ".join(random_word(rng) for _ in range(rng.randint(0, 15)))
+        for _ in range(300)
+    ]
+    for threshold in [50, 70, 85, 100]:
+        found = FuzzyTreatmentMatcher(TREATMENTS, threshold).find_in_comments(comments)
+        expected = [
+            find_fuzzy_treatment(comment, TREATMENTS, threshold) for comment in comments
+        ]
+        assert found == expected, threshold
+
+
+def test_matcher_without_treatments():
+    assert FuzzyTreatmentMatcher([], 80).find_in_comments(["humira", ""]) == [[], []]
@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from utils.io import read_table, write_table
+
+
+def test_parquet_downcasts_only_score_columns(tmp_path):
+    df = pd.DataFrame(
+        {
+            "text_index": [16777217.0, 0.1],
+            "score": [[0.1, 0.2], [0.3]],
+            "score_price": [0.1, 0.2],
+            "sentiment": [0.1, -0.2],
+        }
+    )
+    write_table(df, tmp_path / "table.parquet")
+    loaded = read_table(tmp_path / "table.parquet")
+
+    # keys and other floats keep all their digits
+    assert loaded["text_index"].tolist() == df["text_index"].tolist()
+    assert loaded["sentiment"].dtype == np.float64
+    assert loaded["score_price"].dtype == np.float32
+    assert loaded["score"].iloc[0].dtype == np.float32
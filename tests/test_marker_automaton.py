@@ -0,0 +1,54 @@
+import random
+
+from markers_extraction.markers_in_comments import MarkerAutomaton, stem_keyword
+
+MARKERS = {
+    "Crohn's Disease": {
+        "effect": {
+            "pain": ["stomach pain", "pain"],
+            "remission": ["remission", "full remission"],
+        },
+        "price": {"expensive": ["cost", "expensive"]},
+    },
+    "Ulcerative Colitis": {
+        "effect": {"pain": ["pain", "muscle pain"]},
+        "price": {"cheap": ["cost less"]},
+    },
+}
+
+
+def naive_search(text):
+    # every occurrence of every stemmed keyword, overlapping ones included
+    hits = {}
+    for disease, topics in MARKERS.items():
+        for topic, markers in topics.items():
+            for marker, keywords in markers.items():
+                for pattern in dict.fromkeys(stem_keyword(kw) for kw in keywords):
+                    start = text.find(pattern)
+                    while start >= 0:
+                        hits.setdefault((disease, topic, marker), []).append(start)
+                        start = text.find(pattern, start + 1)
+    return {key: sorted(offsets) for key, offsets in hits.items()}
+
+
+def test_search_finds_nested_and_shared_keywords():
+    automaton = MarkerAutomaton(MARKERS)
+    text = " ".join(stem_keyword(word) for word in "full remission cost less".split())
+    hits = automaton.search(text)
+
+    # "remission" is found inside "full remission" and counted for both keywords
+    assert len(hits[("Crohn's Disease", "effect", "remission")]) == 2
+    # a keyword shared by two diseases is reported for both
+    assert ("Crohn's Disease", "price", "expensive") in hits
+    assert ("Ulcerative Colitis", "price", "cheap") in hits
+    assert ("Ulcerative Colitis", "effect", "pain") not in hits
+
+
+def test_search_matches_substring_search():
+    automaton = MarkerAutomaton(MARKERS)
+    words = ["stomach", "pain", "muscl", "full", "remiss", "cost", "less", "x"]
+    rng = random.Random(0)
+    for _ in range(200):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(0, 12)))
+        hits = {key: sorted(v) for key, v in automaton.search(text).items()}
+        assert hits == naive_search(text), text
@@ -0,0 +1,154 @@
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+import pytest
+import yaml
+
+from utils.io import read_table, write_table
+from utils.sharding import (
+    MARKER_FILES,
+    assign_shards,
+    merge_shards,
+    open_queue,
+    split_shards,
+    work_shards,
+)
+
+N_SHARDS = 8
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    config = {
+        "preprocessing_path": "data/preprocessed.parquet",
+        "extracted_phrases_path": "data/extracted_phrases.parquet",
+        "phrase_path": "data/phrase.parquet",
+        "sent_phrase_path": "data/sent_analysis.parquet",
+        "markers_path": "markers",
+        "shard_dir": "data/shards",
+        "shard_lease_seconds": 60,
+        "shard_max_attempts": 2,
+    }
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.dump(config))
+    # few comments, so that some of the shards are empty
+    comments = pd.DataFrame(
+        {"text_index": [50, 3, 41, 17], "comment": ["a b", "c", "d e f", "g"]}
+    )
+    write_table(comments, config_path.parent / config["preprocessing_path"])
+    return config_path, config, comments
+
+
+def run_shard(shard_config_path):
+    # stands in for the stages, writes the outputs only for comments it got,
+    # like the stages do
+    with open(shard_config_path) as f:
+        config = yaml.safe_load(f)
+    directory = shard_config_path.parent
+    df = read_table(directory / config["preprocessing_path"])
+    if not len(df):
+        return
+    phrases = df.assign(phrase=df["comment"].str.split()).explode("phrase")
+    for key in ["extracted_phrases_path", "phrase_path", "sent_phrase_path"]:
+        write_table(phrases[["text_index", "phrase"]], directory / config[key])
+    for file in MARKER_FILES:
+        write_table(
+            df[["text_index"]].assign(marker="m"),
+            directory / config["markers_path"] / file,
+        )
+
+
+def test_shards_depend_only_on_text_index():
+    text_index = pd.Series(range(1000))
+    shards = assign_shards(text_index, N_SHARDS)
+    assert shards.equals(assign_shards(text_index[::-1], N_SHARDS)[::-1].sort_index())
+    assert set(shards) == set(range(N_SHARDS))
+
+
+def test_split_work_and_merge(pipeline):
+    config_path, config, comments = pipeline
+    split_shards(config_path, config, N_SHARDS)
+
+    processed = []
+    workers = [
+        threading.Thread(
+            target=lambda name: processed.append(
+                work_shards(config_path, config, run_shard, worker=name)
+            ),
+            args=(name,),
+        )
+        for name in ["first", "second"]
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    status = open_queue(config_path, config).status()
+    assert sum(processed) == N_SHARDS
+    assert (status["status"] == "done").all()
+    assert (status["attempts"] == 1).all()
+
+    merge_shards(config_path, config)
+    merged = read_table(config_path.parent / config["phrase_path"])
+    assert merged["text_index"].tolist() == [3, 17, 41, 41, 41, 50, 50]
+    assert merged["phrase"].tolist() == ["c", "g", "d", "e", "f", "a", "b"]
+    markers = read_table(config_path.parent / "markers" / MARKER_FILES[0])
+    assert markers["text_index"].tolist() == sorted(comments["text_index"])
+
+
+def test_expired_lease_is_claimed_again(pipeline):
+    config_path, config, _ = pipeline
+    split_shards(config_path, config, N_SHARDS)
+    queue = open_queue(config_path, config)
+    dead = queue.claim("dead")
+    # the worker is killed, its last heartbeat is older than the lease
+    with sqlite3.connect(str(queue.path)) as connection:
+        connection.execute(
+            "UPDATE shards SET heartbeat = ? WHERE shard = ?",
+            (time.time() - 2 * queue.lease_seconds, dead),
+        )
+
+    assert work_shards(config_path, config, run_shard, worker="alive") == N_SHARDS
+    status = open_queue(config_path, config).status().set_index("shard")
+    assert status.loc[dead, "worker"] == "alive"
+    assert status.loc[dead, "attempts"] == 2
+    # the dead worker cannot finish the shard it lost
+    queue.finish(dead, "dead", error="killed")
+    assert (queue.status()["status"] == "done").all()
+
+
+def test_failed_shard_is_retried_until_max_attempts(pipeline):
+    config_path, config, _ = pipeline
+    split_shards(config_path, config, N_SHARDS)
+    calls = []
+
+    def flaky(shard_config_path):
+        calls.append(shard_config_path.parent.name)
+        # the first attempt of shard 2 is preempted
+        if calls.count("shard_0002") == 1 and calls[-1] == "shard_0002":
+            raise RuntimeError("preempted")
+        run_shard(shard_config_path)
+
+    assert work_shards(config_path, config, flaky, worker="w") == N_SHARDS
+    status = open_queue(config_path, config).status().set_index("shard")
+    assert status.loc[2, "attempts"] == 2
+    assert (status["status"] == "done").all()
+
+    # a shard failing on every attempt stays failed and blocks the merge
+    split_shards(config_path, config, N_SHARDS)
+
+    def broken(shard_config_path):
+        if shard_config_path.parent.name == "shard_0005":
+            raise RuntimeError("broken")
+        run_shard(shard_config_path)
+
+    assert work_shards(config_path, config, broken, worker="w") == N_SHARDS - 1
+    status = open_queue(config_path, config).status().set_index("shard")
+    assert status.loc[5, "status"] == "failed"
+    assert status.loc[5, "attempts"] == 2
+    assert "RuntimeError: broken" in status.loc[5, "error"]
+    with pytest.raises(ValueError, match="not done"):
+        merge_shards(config_path, config)
@@ -1,21 +1,30 @@
 from fuzzywuzzy import fuzz
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from typing import List, Tuple, Union
+from typing import Dict, Iterable, List, Optional, Tuple, Union
 import yaml
 
+from utils.io import read_table, write_table
+from utils.parallel import parallel_map_batches
+
+# number of unique words whose signatures are compared in one numpy operation
+_SIGNATURE_CHUNK = 2048
+
 
 def load_and_extract_treatments(path: Path) -> Tuple[pd.DataFrame, List[str]]:
     """
     Loads the dataframe and extracts unique treatments.
 
     Parameters:
-    - path (Path): Path to the preprocessed CSV file.
+    - path (Path): Path to the preprocessed data (csv or parquet).
 
     Returns:
     - Tuple: A tuple containing the loaded dataframe and the list of unique treatments.
     """
-    df = pd.read_csv(path)
+    df = read_table(
+        path, columns=["text_index", "comment", "disease", "treatment", "rate"]
+    )
     treatments_to_check = df["treatment"].dropna().unique().tolist()
     return df, treatments_to_check
 
@@ -43,6 +52,100 @@ def find_fuzzy_treatment(
     return treatments_found
 
 
+class FuzzyTreatmentMatcher:
+    """
+    Finds treatments in comments with the same results as find_fuzzy_treatment.
+
+    Treatment names are normalized once and every distinct word of the corpus is
+    scored once. Before fuzz.ratio runs, (word, treatment) pairs are pruned with
+    two upper bounds of the ratio 2 * matches / (len(word) + len(treatment)):
+    the number of matching characters can neither exceed the shorter string nor
+    the overlap of the character counts (unigram signatures) of both strings.
+    Pruned pairs can therefore never reach the threshold.
+    """
+
+    def __init__(self, treatments: List[str], fuzzy_threshold: int) -> None:
+        """
+        Parameters:
+        - treatments (List[str]): List of unique treatments
+        - fuzzy_threshold (int): Threshold for fuzzy words
+        """
+        self.treatments = list(treatments)
+        self.fuzzy_threshold = fuzzy_threshold
+        self.normalized = [treatment.lower() for treatment in self.treatments]
+        self.lengths = np.array([len(name) for name in self.normalized])
+
+        # character count signatures over the alphabet of the treatment names
+        self.alphabet = {
+            char: i for i, char in enumerate(sorted(set("".join(self.normalized))))
+        }
+        self.signatures = self._signatures(self.normalized)
+        self._word_cache: Dict[str, Tuple[int, ...]] = {}
+
+    def _signatures(self, strings: List[str]) -> np.ndarray:
+        signatures = np.zeros((len(strings), len(self.alphabet)), dtype=np.int16)
+        for i, string in enumerate(strings):
+            for char in string:
+                j = self.alphabet.get(char)
+                if j is not None:
+                    signatures[i, j] += 1
+        return signatures
+
+    def _candidates(self, words: List[str]) -> np.ndarray:
+        """returns a (words x treatments) mask of pairs that can reach the threshold"""
+        word_lengths = np.array([len(word) for word in words])
+        total = word_lengths[:, None] + self.lengths[None, :]
+        # ratios are rounded to integers, keep everything that could round up
+        limit = (self.fuzzy_threshold - 0.5 - 1e-6) * total / 200
+
+        shorter = np.minimum(word_lengths[:, None], self.lengths[None, :])
+        mask = shorter >= limit
+        if not mask.any():
+            return mask
+
+        overlap = np.minimum(
+            self._signatures(words)[:, None, :], self.signatures[None, :, :]
+        ).sum(axis=2)
+        return mask & (overlap >= limit)
+
+    def _match_words(self, words: List[str]) -> None:
+        """scores all new words and stores their matched treatments"""
+        new_words = [
+            word for word in dict.fromkeys(words) if word not in self._word_cache
+        ]
+        for start in range(0, len(new_words), _SIGNATURE_CHUNK):
+            chunk = new_words[start : start + _SIGNATURE_CHUNK]
+            matches = {word: [] for word in chunk}
+            if self.treatments:
+                word_ids, treatment_ids = np.nonzero(self._candidates(chunk))
+                for i, j in zip(word_ids.tolist(), treatment_ids.tolist()):
+                    if fuzz.ratio(self.normalized[j], chunk[i]) >= self.fuzzy_threshold:
+                        matches[chunk[i]].append(j)
+            for word, treatment_ids in matches.items():
+                self._word_cache[word] = tuple(treatment_ids)
+
+    def find_in_comments(self, comments: Iterable[str]) -> List[List[str]]:
+        """
+        Finds the treatments mentioned in every comment.
+
+        Parameters:
+        - comments (Iterable[str]): Comments to search
+
+        Returns:
+        - List: the treatments of every comment, in the order of the treatments list
+        """
+        tokenized = [[word.lower() for word in comment.split()] for comment in comments]
+        self._match_words([word for words in tokenized for word in words])
+
+        treatments_found = []
+        for words in tokenized:
+            found = set()
+            for word in words:
+                found.update(self._word_cache[word])
+            treatments_found.append([self.treatments[j] for j in sorted(found)])
+        return treatments_found
+
+
 def get_fuzzy_delta_treatment(row: pd.Series) -> List[str]:
     """
     Helper function to get the fuzzy delta treatment for a row
@@ -53,14 +156,36 @@ def get_fuzzy_delta_treatment(row: pd.Series) -> List[str]:
     Returns:
     - List: list of treatments in comments that patient is not taking anymore
     """
-    treatments_in_comment_list = row["fuzzy_treatments_in_comment"]
-    if row["treatment"] in treatments_in_comment_list:
-        treatments_in_comment_list.remove(row["treatment"])
-    return treatments_in_comment_list
+    return [
+        treatment
+        for treatment in row["fuzzy_treatments_in_comment"]
+        if treatment != row["treatment"]
+    ]
+
+
+def fuzzy_delta_treatments(df: pd.DataFrame) -> pd.Series:
+    """
+    Gets the fuzzy delta treatment of every row without modifying the found treatments.
+
+    Parameters:
+    - df (pd.DataFrame): The dataframe with 'treatment' and 'fuzzy_treatments_in_comment'.
+
+    Returns:
+    - pd.Series: list of treatments in comments that patient is not taking anymore
+    """
+    found = df["fuzzy_treatments_in_comment"].explode()
+    current = df["treatment"].astype(object).reindex(found.index)
+    delta = found[found.notna() & (found != current)]
+    delta = delta.groupby(level=0, sort=False).agg(list).reindex(df.index)
+    # rows without delta treatment get an empty list
+    return delta.where(delta.notna(), pd.Series([[]] * len(df), index=df.index))
 
 
 def apply_fuzzy_logic(
-    df: pd.DataFrame, treatments_to_check: List[str], fuzzy_threshold: int
+    df: pd.DataFrame,
+    treatments_to_check: List[str],
+    fuzzy_threshold: int,
+    workers: int = 1,
 ) -> pd.DataFrame:
     """
     Applies fuzzy logic to identify treatments in comments and calculate delta treatments.
@@ -68,16 +193,19 @@ def apply_fuzzy_logic(
     Parameters:
     - df (pd.DataFrame): The dataframe containing treatment and comment data.
     - treatments_to_check (List[str]): List of treatments to check in comments.
+    - fuzzy_threshold (int): Threshold for fuzzy words
+    - workers (int): Number of processes used for the matching.
 
     Returns:
     - pd.DataFrame: The dataframe with new columns for identified treatments and delta treatments.
     """
 
     # Apply the functions
-    df["fuzzy_treatments_in_comment"] = df["comment"].apply(
-        lambda x: find_fuzzy_treatment(x, treatments_to_check, fuzzy_threshold)
+    matcher = FuzzyTreatmentMatcher(treatments_to_check, fuzzy_threshold)
+    df["fuzzy_treatments_in_comment"] = parallel_map_batches(
+        df["comment"], matcher.find_in_comments, workers, "Fuzzy treatment matching"
     )
-    df["fuzzy_delta_treatment"] = df.apply(get_fuzzy_delta_treatment, axis=1)
+    df["fuzzy_delta_treatment"] = fuzzy_delta_treatments(df)
 
     return df
 
@@ -109,11 +237,87 @@ def quantify_treatment_change(row: pd.Series) -> Union[int, None]:
         return 2
 
 
-def main(config_path: Path = Path("config.yaml")):
+def treatment_change_scores(rate: pd.Series, has_delta: pd.Series) -> pd.Series:
+    """
+    Gets the score of quantify_treatment_change for all rows at once.
+
+    Parameters:
+    - rate (pd.Series): The ratings.
+    - has_delta (pd.Series): Whether the row has a fuzzy delta treatment.
+
+    Returns:
+    - pd.Series: Scores in [-2,2], NaN if there was no treatment evolution.
+    """
+    rate = rate.to_numpy(dtype=float)
+    # ratings outside the bins, including missing ones, get the score 2
+    scores = np.select(
+        [
+            (1 <= rate) & (rate <= 2),
+            (3 <= rate) & (rate <= 4),
+            rate == 5,
+            (6 <= rate) & (rate <= 7),
+        ],
+        [-2.0, -1.0, 0.0, 1.0],
+        default=2.0,
+    )
+    return pd.Series(
+        np.where(has_delta.to_numpy(dtype=bool), scores, np.nan), index=has_delta.index
+    )
+
+
+def transition_matrix(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts the changes from a previous to the current treatment per disease.
+
+    Every row of df is counted once, so the counts add up to the rows of the
+    treatment evolution output. Missing diseases and treatments are grouped as
+    "unknown".
+
+    Parameters:
+    - df (pd.DataFrame): One row per previous treatment with 'disease', 'treatment',
+      'fuzzy_delta_treatment' and 'fuzzy_treatment_change_score'.
+
+    Returns:
+    - pd.DataFrame: disease, from_treatment, to_treatment, count and mean_change_score.
+    """
+    transitions = pd.DataFrame(
+        {
+            "disease": df["disease"].astype(object),
+            "from_treatment": df["fuzzy_delta_treatment"],
+            "to_treatment": df["treatment"].astype(object),
+            "fuzzy_treatment_change_score": df["fuzzy_treatment_change_score"],
+        }
+    )
+    keys = ["disease", "from_treatment", "to_treatment"]
+    transitions[keys] = transitions[keys].fillna("unknown")
+    matrix = (
+        transitions.groupby(keys)
+        .agg(
+            count=("fuzzy_treatment_change_score", "size"),
+            mean_change_score=("fuzzy_treatment_change_score", "mean"),
+        )
+        .reset_index()
+        .sort_values(["disease", "count"], ascending=[True, False], ignore_index=True)
+    )
+    if matrix["count"].sum() != len(df):
+        raise ValueError(
+            f"The transition matrix counts {matrix['count'].sum()} "
+            f"of {len(df)} transitions"
+        )
+    return matrix
+
+
+def main(
+    config_path: Path = Path(__file__).parent / "config.yaml",
+    workers: Optional[int] = None,
+):
     # read the path from the config.yaml file
     with open(config_path) as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
 
+    if workers is None:
+        workers = config.get("workers", 1)
+
     # define the path to the preprocessed data
     path = Path(config_path.parent / config["file_path"])
     output_path = Path(config_path.parent / config["output_path"])
@@ -124,21 +328,34 @@ def main(config_path: Path = Path("config.yaml")):
     df = df.dropna(subset=["treatment"])
 
     # apply fuzzy logic
-    df = apply_fuzzy_logic(df, treatments_to_check, config["fuzzy_threshold"])
+    df = apply_fuzzy_logic(
+        df, treatments_to_check, config["fuzzy_threshold"], workers=workers
+    )
 
     # rate the treatment evolution
-    df["fuzzy_treatment_change_score"] = df.apply(quantify_treatment_change, axis=1)
+    df["fuzzy_treatment_change_score"] = treatment_change_scores(
+        df["rate"], df["fuzzy_delta_treatment"].map(len) > 0
+    )
 
-    # subselect columns, drop no treatment evolutions and explode list of previous treatments
-    df = df[["text_index", "fuzzy_delta_treatment", "fuzzy_treatment_change_score"]]
+    # drop no treatment evolutions and explode list of previous treatments
     df = df.dropna(subset=["fuzzy_treatment_change_score"])
     df = df.explode("fuzzy_delta_treatment")
 
-    # save to output path
+    # aggregate the previous and current treatments per disease for the reporting
+    if config.get("transition_matrix_path"):
+        write_table(
+            transition_matrix(df),
+            Path(config_path.parent / config["transition_matrix_path"]),
+        )
+
+    # subselect columns and save to output path
+    df = df[["text_index", "fuzzy_delta_treatment", "fuzzy_treatment_change_score"]]
     df.to_csv(output_path)
 
     print("------- Treatment Evolution Quantification Completed -------")
 
+    return df
+
 
 if __name__ == "__main__":
     main()
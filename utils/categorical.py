@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Callable, Iterable
+
+# low cardinality columns of the preprocessed comments
+CATEGORICAL_COLUMNS = [
+    "medication",
+    "disease",
+    "treatment",
+    "antibody",
+    "treatment_type",
+]
+
+
+def to_categorical(
+    df: pd.DataFrame, columns: Iterable[str] = CATEGORICAL_COLUMNS
+) -> pd.DataFrame:
+    """
+    Converts the low cardinality columns of a dataframe to pandas Categoricals.
+
+    Args:
+        - df (pd.DataFrame): the dataframe
+        - columns (Iterable[str]): columns to convert, missing columns are skipped
+
+    Returns:
+        pd.DataFrame: the dataframe with categorical columns
+    """
+    return df.astype({column: "category" for column in columns if column in df.columns})
+
+
+def map_distinct(series: pd.Series, func: Callable[[Any], Any]) -> pd.Series:
+    """
+    Applies a function once per distinct value and broadcasts the results by code.
+
+    Missing values are passed to the function once as None.
+
+    Args:
+        - series (pd.Series): categorical or other low cardinality values
+        - func (Callable): maps a value to the derived value, may return lists
+
+    Returns:
+        pd.Series: the derived value of every row, with the index of the series
+    """
+    codes, uniques = pd.factorize(series)
+    # the result of the missing values is stored last, so that code -1 selects it
+    results = np.empty(len(uniques) + 1, dtype=object)
+    for i, value in enumerate(uniques):
+        results[i] = func(value)
+    results[-1] = func(None)
+    return pd.Series(results[codes], index=series.index)
@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import pandas as pd
+from pathlib import Path
+import shutil
+from typing import Callable, Iterator, List, Optional
+
+from utils.io import read_table
+
+
+def fingerprint(*parts) -> str:
+    """hashes the json representation of the inputs of a checkpointed computation"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, default=str, ensure_ascii=False).encode())
+    return digest.hexdigest()
+
+
+class ChunkCheckpoint:
+    """Results of a long running computation, saved to disk chunk by chunk.
+
+    The items are processed in chunks of chunk_size. Every finished chunk is
+    saved as a pickle and recorded in manifest.json, so that a rerun on the
+    same inputs loads the finished chunks instead of computing them again.
+    Checkpoints of other inputs (another fingerprint) or another chunk size
+    are discarded.
+    """
+
+    def __init__(self, directory: Path, key: str, chunk_size: int) -> None:
+        """
+        Args:
+            - directory (Path): directory of the checkpoint, created if missing
+            - key (str): fingerprint of the inputs, see fingerprint
+            - chunk_size (int): number of items per chunk
+        """
+        self.directory = Path(directory)
+        self.key = key
+        self.chunk_size = chunk_size
+        self.completed = set()
+
+        manifest = self._load_manifest()
+        if manifest.get("key") == key and manifest.get("chunk_size") == chunk_size:
+            self.completed = set(manifest["chunks"])
+            if self.completed:
+                print(
+                    f"Resuming from {len(self.completed)} saved chunks in {self.directory}"
+                )
+        else:
+            self.clear()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.directory / "manifest.json"
+
+    def chunk_path(self, chunk: int) -> Path:
+        return self.directory / f"chunk_{chunk:05d}.pkl"
+
+    def _load_manifest(self) -> dict:
+        if not self.manifest_path.exists():
+            return {}
+        return json.loads(self.manifest_path.read_text())
+
+    def _replace(self, path: Path, write: Callable[[Path], None]) -> None:
+        # files are written next to their destination and renamed, so that a
+        # killed process never leaves a partial chunk or manifest behind
+        tmp_path = path.with_name(path.name + ".tmp")
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    def is_complete(self, n_items: int) -> bool:
+        """checks if all chunks of n_items items are saved"""
+        return len(self.completed) >= -(-n_items // self.chunk_size)
+
+    def save(self, chunk: int, df: pd.DataFrame) -> None:
+        """saves the results of a chunk and records it in the manifest"""
+        self._replace(self.chunk_path(chunk), lambda path: df.to_pickle(path))
+        self.completed.add(chunk)
+        manifest = {
+            "key": self.key,
+            "chunk_size": self.chunk_size,
+            "chunks": sorted(self.completed),
+        }
+        self._replace(
+            self.manifest_path, lambda path: path.write_text(json.dumps(manifest))
+        )
+
+    def load(self, chunk: int) -> pd.DataFrame:
+        """loads the saved results of a chunk"""
+        return read_table(self.chunk_path(chunk))
+
+    def clear(self) -> None:
+        """removes all saved chunks and the manifest"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.completed = set()
+
+
+def map_chunks(
+    items: List,
+    func: Callable[[List], pd.DataFrame],
+    checkpoint: Optional[ChunkCheckpoint] = None,
+) -> Iterator[pd.DataFrame]:
+    """
+    Applies a function to the items chunk by chunk, skipping saved chunks.
+
+    Args:
+        - items (List): the items to process, in the same order on every run
+        - func (Callable): maps a list of items to a dataframe of results
+        - checkpoint (ChunkCheckpoint): saves every chunk, all items are passed
+            to func at once without saving if None
+
+    Yields:
+        pd.DataFrame: the results of every chunk, in the order of the items
+    """
+    if checkpoint is None:
+        yield func(items)
+        return
+
+    for chunk, start in enumerate(range(0, len(items), checkpoint.chunk_size)):
+        if chunk in checkpoint.completed:
+            yield checkpoint.load(chunk)
+            continue
+        df = func(items[start : start + checkpoint.chunk_size])
+        checkpoint.save(chunk, df)
+        yield df
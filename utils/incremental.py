@@ -0,0 +1,69 @@
+import pandas as pd
+from pathlib import Path
+
+from utils.io import read_table, write_table
+
+
+def _state_file(state_dir: Path, stage: str) -> Path:
+    return Path(state_dir) / f"{stage}.parquet"
+
+
+def processed_index(state_dir: Path, stage: str, key: str = "text_index") -> pd.Index:
+    """
+    Loads the keys of the rows a stage has already processed.
+
+    Args:
+        - state_dir (Path): directory of the incremental state
+        - stage (str): name of the stage
+        - key (str): column identifying a row
+
+    Returns:
+        pd.Index: the processed keys, empty if the stage never ran
+    """
+    path = _state_file(state_dir, stage)
+    if not path.exists():
+        return pd.Index([])
+    return pd.Index(read_table(path)[key])
+
+
+def select_new_rows(
+    df: pd.DataFrame, state_dir: Path, stage: str, key: str = "text_index"
+) -> pd.DataFrame:
+    """
+    Selects the rows a stage has not processed in an earlier successful run.
+
+    Args:
+        - df (pd.DataFrame): the input of the stage
+        - state_dir (Path): directory of the incremental state
+        - stage (str): name of the stage
+        - key (str): column identifying a row
+
+    Returns:
+        pd.DataFrame: the new rows
+    """
+    new_rows = df[~df[key].isin(processed_index(state_dir, stage, key))]
+    print(f"{stage}: {len(new_rows)} new of {len(df)} rows")
+    return new_rows
+
+
+def mark_processed(
+    df: pd.DataFrame,
+    state_dir: Path,
+    stage: str,
+    key: str = "text_index",
+    replace: bool = False,
+) -> None:
+    """
+    Records the rows a stage has processed successfully.
+
+    Args:
+        - df (pd.DataFrame): the processed input rows
+        - state_dir (Path): directory of the incremental state
+        - stage (str): name of the stage
+        - key (str): column identifying a row
+        - replace (bool): forget the rows recorded before, used after full runs
+    """
+    keys = pd.DataFrame({key: df[key].drop_duplicates()})
+    write_table(
+        keys, _state_file(state_dir, stage), merge_on=None if replace else key
+    )
@@ -0,0 +1,135 @@
+from contextlib import contextmanager
+import json
+import pandas as pd
+from pathlib import Path
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from utils.memory import PeakMemory
+
+# the record of the stage running in the current thread
+_active = threading.local()
+
+
+def record_rows(rows_in: Optional[int] = None, rows_out: Optional[int] = None) -> None:
+    """
+    Sets the input and output row counts of the stage running in this thread.
+
+    Does nothing when no stage is traced.
+
+    Args:
+        - rows_in (int): number of input rows
+        - rows_out (int): number of output rows
+    """
+    record = getattr(_active, "record", None)
+    if record is None:
+        return
+    if rows_in is not None:
+        record["rows_in"] = rows_in
+    if rows_out is not None:
+        record["rows_out"] = rows_out
+
+
+def record_batch(size: int, seconds: float, batches: int = 1) -> None:
+    """
+    Adds model calls to the stage running in this thread.
+
+    Does nothing when no stage is traced.
+
+    Args:
+        - size (int): number of inputs of the call
+        - seconds (float): latency of the call
+        - batches (int): number of batches processed by the call
+    """
+    record = getattr(_active, "record", None)
+    if record is None:
+        return
+    record["batches"] = record.get("batches", 0) + batches
+    record["batch_items"] = record.get("batch_items", 0) + size
+    record["batch_seconds"] = record.get("batch_seconds", 0.0) + seconds
+
+
+class Tracer:
+    """Records timing, row counts, memory and batch statistics of pipeline stages.
+
+    Every finished stage is appended as one json line to the trace file. Peak RSS
+    is measured for the whole process, so stages running concurrently share it.
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        """
+        Args:
+            - path (Path): json lines file the records are appended to, none if None
+        """
+        self.path = Path(path) if path else None
+        self.records: List[dict] = []
+        self._lock = threading.Lock()
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _write(self, record: dict) -> None:
+        with self._lock:
+            self.records.append(record)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def skipped(self, name: str) -> None:
+        """records a stage that was skipped because it is up to date"""
+        self._write({"stage": name, "status": "skipped", "start": time.time()})
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[dict]:
+        """
+        Traces the stage running inside the block in the current thread.
+
+        Args:
+            - name (str): name of the stage
+
+        Yields:
+            dict: the record of the stage, updated by record_rows and record_batch
+        """
+        record = {"stage": name, "status": "ok", "start": time.time()}
+        previous = getattr(_active, "record", None)
+        _active.record = record
+        start = time.perf_counter()
+        try:
+            with PeakMemory() as memory:
+                yield record
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            _active.record = previous
+            seconds = time.perf_counter() - start
+            record["end"] = time.time()
+            record["seconds"] = round(seconds, 3)
+            record["peak_rss_mb"] = round(memory.peak_mb, 1)
+            if record.get("rows_in") is not None and seconds > 0:
+                record["rows_per_sec"] = round(record["rows_in"] / seconds, 1)
+            if record.get("batches"):
+                record["avg_batch_latency_ms"] = round(
+                    1000 * record.pop("batch_seconds") / record["batches"], 1
+                )
+            self._write(record)
+
+    def summary(self) -> pd.DataFrame:
+        """
+        Summarizes the traced stages.
+
+        Returns:
+            pd.DataFrame: one row per stage in the order the stages finished
+        """
+        columns = [
+            "stage",
+            "status",
+            "seconds",
+            "rows_in",
+            "rows_out",
+            "rows_per_sec",
+            "peak_rss_mb",
+            "batches",
+            "avg_batch_latency_ms",
+        ]
+        return pd.DataFrame(self.records).reindex(columns=columns)
@@ -0,0 +1,179 @@
+from ast import literal_eval
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional
+
+# the file format of a table is selected by the suffix of its path
+PARQUET_SUFFIXES = {".parquet", ".pq"}
+PICKLE_SUFFIXES = {".pkl", ".pickle"}
+# float columns of the classification scores, stored as float32 in parquet files
+SCORE_COLUMN = "score"
+SCORE_PREFIX = "score_"
+
+
+def _parse_list(value):
+    # lists are written as their python representation in csv files
+    if isinstance(value, str):
+        return literal_eval(value)
+    return value
+
+
+def _to_list(value):
+    # parquet list columns are loaded as numpy arrays
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return value
+
+
+def _is_score_column(name: str) -> bool:
+    return name == SCORE_COLUMN or name.startswith(SCORE_PREFIX)
+
+
+def _arrow_table(df: pd.DataFrame):
+    """converts a dataframe to an arrow table with float32 score columns
+
+    Only the score columns are downcast, keys like text_index and all other
+    float columns keep their float64 values.
+    """
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    fields = []
+    for table_field in table.schema:
+        field_type = table_field.type
+        if _is_score_column(table_field.name):
+            if pa.types.is_float64(field_type):
+                field_type = pa.float32()
+            elif pa.types.is_list(field_type) and pa.types.is_float64(
+                field_type.value_type
+            ):
+                field_type = pa.list_(pa.float32())
+        fields.append(table_field.with_type(field_type))
+    return table.cast(pa.schema(fields, metadata=table.schema.metadata))
+
+
+def read_table(
+    path: Path,
+    columns: Optional[List[str]] = None,
+    list_columns: Iterable[str] = (),
+) -> pd.DataFrame:
+    """
+    Reads an intermediate table of the pipeline as csv, parquet or pickle file.
+
+    Args:
+        - path (Path): path of the table, the suffix selects the format
+        - columns (List[str]): columns to load, all if None
+        - list_columns (Iterable[str]): columns holding lists
+
+    Returns:
+        pd.DataFrame: the loaded table
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        df = pd.read_parquet(path, columns=columns)
+        convert = _to_list
+    elif suffix in PICKLE_SUFFIXES:
+        df = pd.read_pickle(path)
+        if columns is not None:
+            df = df[columns]
+        convert = None
+    else:
+        df = pd.read_csv(path, usecols=columns)
+        convert = _parse_list
+
+    if convert is not None:
+        for column in list_columns:
+            if column in df.columns:
+                df[column] = df[column].map(convert)
+    return df
+
+
+def iter_table(
+    path: Path,
+    columns: Optional[List[str]] = None,
+    list_columns: Iterable[str] = (),
+    batch_size: int = 100000,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads an intermediate table in batches of rows, so that it never has to fit into memory.
+
+    Args:
+        - path (Path): path of the table, the suffix selects the format
+        - columns (List[str]): columns to load, all if None
+        - list_columns (Iterable[str]): columns holding lists
+        - batch_size (int): number of rows per batch
+
+    Yields:
+        pd.DataFrame: the next batch of rows
+    """
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        import pyarrow.parquet as pq
+
+        batches = (
+            batch.to_pandas()
+            for batch in pq.ParquetFile(path).iter_batches(
+                batch_size=batch_size, columns=columns
+            )
+        )
+        convert = _to_list
+    elif suffix in PICKLE_SUFFIXES:
+        # pickles can only be loaded as a whole
+        df = read_table(path, columns, list_columns)
+        batches = (
+            df.iloc[start : start + batch_size]
+            for start in range(0, len(df), batch_size)
+        )
+        convert = None
+    else:
+        batches = pd.read_csv(path, usecols=columns, chunksize=batch_size)
+        convert = _parse_list
+
+    for df in batches:
+        if convert is not None:
+            for column in list_columns:
+                if column in df.columns:
+                    df[column] = df[column].map(convert)
+        yield df
+
+
+def write_table(df: pd.DataFrame, path: Path, merge_on: Optional[str] = None) -> None:
+    """
+    Writes an intermediate table of the pipeline as csv, parquet or pickle file.
+
+    Parquet files keep list columns natively and store the score columns
+    ('score' and 'score_<topic>') as float32.
+
+    Args:
+        - df (pd.DataFrame): table to write
+        - path (Path): output path, the suffix selects the format
+        - merge_on (str): if set and the file exists, the rows of df replace the
+            rows of the file with the same value in this column and all other
+            rows of the file are kept
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    if merge_on and Path(path).exists():
+        existing = read_table(path, list_columns=_list_columns(df))
+        existing = existing[~existing[merge_on].isin(df[merge_on])]
+        df = pd.concat([existing, df], ignore_index=True)
+
+    suffix = Path(path).suffix.lower()
+    if suffix in PARQUET_SUFFIXES:
+        import pyarrow.parquet as pq
+
+        pq.write_table(_arrow_table(df), path)
+    elif suffix in PICKLE_SUFFIXES:
+        df.to_pickle(path)
+    else:
+        df.to_csv(path, index=False)
+
+
+def _list_columns(df: pd.DataFrame) -> List[str]:
+    # columns of df whose first non missing value is a list
+    columns = []
+    for column in df.columns:
+        values = df[column].dropna()
+        if len(values) and isinstance(values.iloc[0], (list, np.ndarray)):
+            columns.append(column)
+    return columns
@@ -0,0 +1,77 @@
+import os
+import resource
+import sys
+import threading
+from typing import Optional
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def current_rss() -> Optional[int]:
+    """
+    Reads the resident set size of the current process.
+
+    Returns:
+        int: resident memory in bytes, None if it cannot be read on this platform
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+def max_rss() -> int:
+    """
+    Returns the peak resident set size of the process since it started.
+
+    Returns:
+        int: peak resident memory in bytes
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class PeakMemory:
+    """Context manager sampling the resident memory to find the peak of a code block.
+
+    The process-wide ru_maxrss cannot be reset, so the resident memory is polled
+    in a background thread while the block runs. Where the resident memory cannot
+    be read, the peak falls back to ru_maxrss.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        """
+        Args:
+            - interval (float): seconds between two samples
+        """
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = current_rss()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def __enter__(self) -> "PeakMemory":
+        self.peak = current_rss()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if self._thread is None:
+            self.peak = max_rss()
+            return
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss() or 0)
+
+    @property
+    def peak_mb(self) -> float:
+        return (self.peak or 0) / 2**20
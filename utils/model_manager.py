@@ -0,0 +1,204 @@
+from functools import lru_cache
+import random
+import threading
+import time
+from typing import List, Optional
+
+# backends of the transformer pipelines
+#   fp32: the model as published
+#   int8: linear layers dynamically quantized to int8 for cpu inference
+#   onnx: the model exported to onnx and run with onnxruntime (needs optimum)
+BACKENDS = ("fp32", "int8", "onnx")
+
+# stages run in threads, loading a model twice at the same time wastes memory
+_lock = threading.RLock()
+
+
+@lru_cache(maxsize=None)
+def _load_spacy(name: str):
+    import spacy
+
+    return spacy.load(name)
+
+
+def get_spacy(name: str = "en_core_web_md"):
+    """
+    Loads a spaCy model once per process.
+
+    Args:
+        - name (str): name or local path of the model
+
+    Returns:
+        spacy.Language: the loaded model
+    """
+    with _lock:
+        return _load_spacy(name)
+
+
+def _quantize(classifier):
+    # replaces the linear layers by int8 layers, activations are quantized on the fly
+    import torch
+
+    classifier.model = torch.quantization.quantize_dynamic(
+        classifier.model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+    return classifier
+
+
+def _onnx_pipeline(task: str, model: Optional[str], revision: Optional[str]):
+    try:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+    except ImportError as e:
+        raise ImportError(
+            "The onnx backend needs optimum[onnxruntime], "
+            "install it with: pip install optimum[onnxruntime]"
+        ) from e
+    from transformers import AutoTokenizer, pipeline
+
+    if model is None:
+        raise ValueError(f"The onnx backend needs a model name for {task}")
+
+    ort_model = ORTModelForSequenceClassification.from_pretrained(
+        model, revision=revision, export=True
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model, revision=revision)
+    return pipeline(task, model=ort_model, tokenizer=tokenizer)
+
+
+@lru_cache(maxsize=None)
+def _load_pipeline(
+    task: str, model: Optional[str], revision: Optional[str], backend: str
+):
+    from transformers import pipeline
+
+    start = time.perf_counter()
+    if backend == "onnx":
+        classifier = _onnx_pipeline(task, model, revision)
+    else:
+        classifier = pipeline(task, model=model, revision=revision)
+        if backend == "int8":
+            classifier = _quantize(classifier)
+    print(
+        f"Loaded {task} model {model or 'default'} ({backend}) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+    return classifier
+
+
+def get_pipeline(
+    task: str,
+    model: Optional[str] = None,
+    revision: Optional[str] = None,
+    backend: str = "fp32",
+):
+    """
+    Loads a transformers pipeline once per process and backend.
+
+    Args:
+        - task (str): pipeline task, e.g. "zero-shot-classification"
+        - model (str): name or local path of the model, the task default if None
+        - revision (str): revision of the model on the hub
+        - backend (str): one of BACKENDS
+
+    Returns:
+        transformers.Pipeline: the loaded pipeline
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
+    with _lock:
+        return _load_pipeline(task, model, revision, backend)
+
+
+def model_id(
+    model: Optional[str], revision: Optional[str] = None, backend: str = "fp32"
+) -> str:
+    """identifies the model and backend, e.g. for caching results"""
+    identifier = f"{model or 'default'}@{revision or 'main'}"
+    if backend != "fp32":
+        identifier += f"#{backend}"
+    return identifier
+
+
+def _top_labels(classifier, inputs: List[str], candidate_labels: Optional[List[str]]):
+    if candidate_labels is None:
+        return [result["label"] for result in classifier(inputs, truncation=True)]
+    return [result["labels"][0] for result in classifier(inputs, candidate_labels)]
+
+
+def backend_agreement(
+    task: str,
+    inputs: List[str],
+    model: Optional[str] = None,
+    revision: Optional[str] = None,
+    backend: str = "int8",
+    candidate_labels: Optional[List[str]] = None,
+    sample_size: int = 200,
+    seed: int = 0,
+) -> float:
+    """
+    Compares the top labels of a backend with the fp32 model on a sample of the inputs.
+
+    Args:
+        - task (str): pipeline task
+        - inputs (List[str]): texts to sample from
+        - model (str): name or local path of the model
+        - revision (str): revision of the model on the hub
+        - backend (str): backend compared to fp32
+        - candidate_labels (List[str]): labels of a zero-shot task, None otherwise
+        - sample_size (int): number of sampled inputs
+        - seed (int): seed of the sample
+
+    Returns:
+        float: share of the sampled inputs with the same top label
+    """
+    return label_agreement(
+        get_pipeline(task, model, revision, "fp32"),
+        get_pipeline(task, model, revision, backend),
+        inputs,
+        candidate_labels=candidate_labels,
+        sample_size=sample_size,
+        seed=seed,
+        name=f"{task} {backend}",
+    )
+
+
+def label_agreement(
+    reference,
+    candidate,
+    inputs: List[str],
+    candidate_labels: Optional[List[str]] = None,
+    sample_size: int = 200,
+    seed: int = 0,
+    name: str = "candidate",
+) -> float:
+    """
+    Compares the top labels of two classifiers on a sample of the inputs.
+
+    Args:
+        - reference: pipeline whose labels are taken as correct
+        - candidate: pipeline or callable with the same output format
+        - inputs (List[str]): texts to sample from
+        - candidate_labels (List[str]): labels of a zero-shot task, None otherwise
+        - sample_size (int): number of sampled inputs
+        - seed (int): seed of the sample
+        - name (str): name of the candidate in the printed report
+
+    Returns:
+        float: share of the sampled inputs with the same top label
+    """
+    unique_inputs = list(dict.fromkeys(inputs))
+    sample = random.Random(seed).sample(
+        unique_inputs, min(sample_size, len(unique_inputs))
+    )
+    if not sample:
+        return 1.0
+
+    reference_top = _top_labels(reference, sample, candidate_labels)
+    candidate_top = _top_labels(candidate, sample, candidate_labels)
+
+    agreement = sum(r == c for r, c in zip(reference_top, candidate_top)) / len(sample)
+    print(
+        f"{name} agrees with the reference on {agreement:.1%} "
+        f"of {len(sample)} sampled inputs"
+    )
+    return agreement
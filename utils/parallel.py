@@ -0,0 +1,109 @@
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+import multiprocessing
+import numpy as np
+import pandas as pd
+import time
+from typing import Callable, Optional
+
+# every worker gets this many chunks, so that slow chunks do not stall the pool
+CHUNKS_PER_WORKER = 4
+
+
+def _map_values(func: Callable, values: list) -> list:
+    return [func(value) for value in values]
+
+
+def parallel_map_batches(
+    series: pd.Series,
+    batch_func: Callable[[list], list],
+    workers: int = 1,
+    stage: str = "",
+    initializer: Optional[Callable] = None,
+) -> pd.Series:
+    """
+    Applies a function to consecutive chunks of a series in a process pool.
+
+    The first chunk is processed in the calling process and timed, which gives
+    the throughput of the serial path without running the stage twice, the
+    other chunks in workers - 1 processes. The processes are spawned instead of
+    forked, since the stages run in threads of the StageRunner and a fork could
+    copy locks held by other threads. Results are reassembled in the order of
+    the series.
+
+    Args:
+        - series (pd.Series): values to process
+        - batch_func (Callable): picklable function mapping a list of values to
+            a list of results of the same length
+        - workers (int): number of processes including the calling one, 1 runs
+            everything serially
+        - stage (str): name of the stage used in the report
+        - initializer (Callable): picklable function run once in every worker,
+            e.g. to load nltk resources
+
+    Returns:
+        pd.Series: the results with the index of the input series
+    """
+    values = series.tolist()
+    start = time.perf_counter()
+
+    if workers <= 1 or len(values) < 2:
+        results = batch_func(values)
+        elapsed = time.perf_counter() - start
+        print(f"{stage}: {len(values)} rows in {elapsed:.1f}s (serial)")
+        return pd.Series(results, index=series.index, dtype=object)
+
+    bounds = np.array_split(
+        np.arange(len(values)), min(len(values), workers * CHUNKS_PER_WORKER)
+    )
+    chunks = [values[chunk[0] : chunk[-1] + 1] for chunk in bounds]
+
+    with ProcessPoolExecutor(
+        max_workers=workers - 1,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initializer,
+    ) as pool:
+        futures = [pool.submit(batch_func, chunk) for chunk in chunks[1:]]
+
+        if initializer is not None:
+            initializer()
+        serial_start = time.perf_counter()
+        results = list(batch_func(chunks[0]))
+        serial_elapsed = time.perf_counter() - serial_start
+
+        for future in futures:
+            results.extend(future.result())
+
+    elapsed = time.perf_counter() - start
+    estimated_serial = serial_elapsed * len(values) / len(chunks[0])
+    speedup = estimated_serial / elapsed if elapsed > 0 else float("inf")
+    print(
+        f"{stage}: {len(values)} rows in {elapsed:.1f}s on {workers} workers, "
+        f"{speedup:.1f}x vs serial (estimated {estimated_serial:.1f}s)"
+    )
+    return pd.Series(results, index=series.index, dtype=object)
+
+
+def parallel_map(
+    series: pd.Series,
+    func: Callable,
+    workers: int = 1,
+    stage: str = "",
+    initializer: Optional[Callable] = None,
+) -> pd.Series:
+    """
+    Applies a function to every value of a series in a process pool.
+
+    Args:
+        - series (pd.Series): values to process
+        - func (Callable): picklable function applied to every value
+        - workers (int): number of worker processes, 1 runs everything serially
+        - stage (str): name of the stage used in the report
+        - initializer (Callable): picklable function run once in every worker
+
+    Returns:
+        pd.Series: the results with the index of the input series
+    """
+    return parallel_map_batches(
+        series, partial(_map_values, func), workers, stage, initializer
+    )
@@ -0,0 +1,395 @@
+from contextlib import contextmanager
+import os
+import pandas as pd
+from pathlib import Path
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+from typing import Callable, Dict, Iterator, List, Optional
+import yaml
+
+from utils.io import read_table, write_table
+
+# stages run by the workers on every shard
+SHARDED_STAGES = ["normalize", "phrases", "classification", "sentiment", "markers"]
+
+# config keys whose files are written per shard, relative to the shard directory
+SHARD_PATHS = [
+    "preprocessing_path",
+    "normalized_path",
+    "extracted_phrases_path",
+    "phrase_path",
+    "sent_phrase_path",
+    "markers_path",
+    "stage_state_path",
+    "incremental_state_path",
+    "classification_cache_path",
+    "checkpoint_path",
+]
+
+# config keys of the shard outputs that are combined by the merge
+MERGED_PATHS = ["extracted_phrases_path", "phrase_path", "sent_phrase_path"]
+MARKER_FILES = [
+    f"markers_{disease}.csv" for disease in ["Crohn's Disease", "Ulcerative Colitis"]
+]
+
+
+def assign_shards(text_index: pd.Series, n_shards: int) -> pd.Series:
+    """
+    Assigns every comment to a shard by the hash of its text_index.
+
+    The hash does not depend on the process or the machine, so every node
+    computes the same shards.
+
+    Args:
+        - text_index (pd.Series): the text_index of the comments
+        - n_shards (int): number of shards
+
+    Returns:
+        pd.Series: the shard of every comment, with the index of text_index
+    """
+    hashes = pd.util.hash_pandas_object(text_index.astype(str), index=False)
+    return (hashes % n_shards).astype(int)
+
+
+def shard_dir(root: Path, shard: int) -> Path:
+    return Path(root) / f"shard_{shard:04d}"
+
+
+def shard_config(config: dict, config_path: Path) -> dict:
+    """
+    Derives the config of a shard from the config of the pipeline.
+
+    The outputs of the sharded stages are placed in the shard directory, all
+    other paths point to the files of the pipeline.
+
+    Args:
+        - config (dict): the loaded config.yaml
+        - config_path (Path): path of config.yaml, relative paths start from it
+
+    Returns:
+        dict: the config to be saved in the shard directory
+    """
+    sharded = dict(config)
+    for key, value in config.items():
+        if key.endswith("_path") and isinstance(value, str) and value:
+            sharded[key] = str((config_path.parent / value).resolve())
+    for key in SHARD_PATHS:
+        if config.get(key):
+            sharded[key] = Path(config[key]).name or "."
+    return sharded
+
+
+class ShardQueue:
+    """Work queue of the shards in a SQLite file on a shared filesystem.
+
+    Workers claim pending shards in an exclusive transaction, so every shard is
+    processed by one worker at a time. A running worker renews the lease of its
+    shard, shards whose lease expired (e.g. a killed worker) and failed shards
+    are claimed again until max_attempts is reached.
+    """
+
+    def __init__(
+        self, path: Path, lease_seconds: float = 600, max_attempts: int = 2
+    ) -> None:
+        """
+        Args:
+            - path (Path): location of the SQLite file, created if missing
+            - lease_seconds (float): time after which a shard without heartbeat is
+                claimed again
+            - max_attempts (int): number of times a shard is claimed before it stays
+                failed
+        """
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS shards (
+                    shard INTEGER PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    worker TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    heartbeat REAL,
+                    error TEXT
+                )
+                """)
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        # every operation opens its own connection, which keeps the queue usable
+        # from threads and forked processes
+        connection = sqlite3.connect(str(self.path), timeout=60, isolation_level=None)
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            yield connection
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def reset(self, n_shards: int) -> None:
+        """marks all n_shards shards as pending and removes other shards"""
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM shards")
+            connection.executemany(
+                "INSERT INTO shards (shard, status) VALUES (?, 'pending')",
+                [(shard,) for shard in range(n_shards)],
+            )
+
+    def claim(self, worker: str) -> Optional[int]:
+        """
+        Claims the next shard to process.
+
+        Args:
+            - worker (str): name of the claiming worker
+
+        Returns:
+            int: the claimed shard, None if no shard is left
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                """
+                SELECT shard FROM shards
+                WHERE attempts < ? AND (
+                    status IN ('pending', 'failed')
+                    OR (status = 'running' AND heartbeat < ?)
+                )
+                ORDER BY shard LIMIT 1
+                """,
+                (self.max_attempts, now - self.lease_seconds),
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                """
+                UPDATE shards SET status = 'running', worker = ?,
+                    attempts = attempts + 1, heartbeat = ?, error = NULL
+                WHERE shard = ?
+                """,
+                (worker, now, row[0]),
+            )
+        return row[0]
+
+    def heartbeat(self, shard: int, worker: str) -> None:
+        """renews the lease of a running shard"""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE shards SET heartbeat = ? WHERE shard = ? AND worker = ?",
+                (time.time(), shard, worker),
+            )
+
+    def finish(self, shard: int, worker: str, error: Optional[str] = None) -> None:
+        """marks a shard as done, or as failed with the error"""
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE shards SET status = ?, error = ? "
+                "WHERE shard = ? AND worker = ?",
+                ("failed" if error else "done", error, shard, worker),
+            )
+
+    def status(self) -> pd.DataFrame:
+        """returns shard, status, worker, attempts and error of every shard"""
+        with self._transaction() as connection:
+            rows = connection.execute(
+                "SELECT shard, status, worker, attempts, error "
+                "FROM shards ORDER BY shard"
+            ).fetchall()
+        return pd.DataFrame(
+            rows, columns=["shard", "status", "worker", "attempts", "error"]
+        )
+
+
+class LeaseRenewer(threading.Thread):
+    """Renews the lease of a claimed shard while its stages run.
+
+    Failed renewals are logged and retried. If the lease could not be renewed
+    for half of its duration, the worker process exits, before another worker
+    can claim the shard and write the same directory. The stages of the shard
+    run in threads of the StageRunner, which can only be stopped this way.
+    """
+
+    def __init__(self, queue: ShardQueue, shard: int, worker: str) -> None:
+        """
+        Args:
+            - queue (ShardQueue): the queue of the shards
+            - shard (int): the claimed shard
+            - worker (str): name of the worker holding the lease
+        """
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.shard = shard
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        renewed = time.time()
+        while not self.stopped.wait(self.queue.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(self.shard, self.worker)
+                renewed = time.time()
+            except sqlite3.Error as e:
+                print(
+                    f"Worker {self.worker} could not renew the lease of shard "
+                    f"{self.shard}: {e!r}",
+                    flush=True,
+                )
+                if time.time() - renewed >= self.queue.lease_seconds / 2:
+                    print(
+                        f"------- Shard {self.shard} aborted, worker {self.worker} "
+                        "exits -------",
+                        flush=True,
+                    )
+                    os._exit(1)
+
+    def stop(self) -> None:
+        """stops the renewals once the shard is finished"""
+        self.stopped.set()
+        self.join()
+
+
+def open_queue(config_path: Path, config: dict) -> ShardQueue:
+    root = Path(config_path.parent / config.get("shard_dir", "data/shards"))
+    return ShardQueue(
+        root / "queue.sqlite",
+        lease_seconds=config.get("shard_lease_seconds", 600),
+        max_attempts=config.get("shard_max_attempts", 2),
+    )
+
+
+def split_shards(config_path: Path, config: dict, n_shards: int) -> List[Path]:
+    """
+    Splits the preprocessed comments into shards and queues them.
+
+    Every shard directory gets the comments of the shard and a config.yaml
+    under which the pipeline stages run on the shard only.
+
+    Args:
+        - config_path (Path): path to config.yaml
+        - config (dict): the loaded config.yaml
+        - n_shards (int): number of shards
+
+    Returns:
+        List[Path]: the config of every shard
+    """
+    root = Path(config_path.parent / config.get("shard_dir", "data/shards"))
+    df = read_table(Path(config_path.parent / config["preprocessing_path"]))
+    shards = assign_shards(df["text_index"], n_shards)
+
+    sharded = shard_config(config, config_path)
+    config_paths = []
+    for shard in range(n_shards):
+        directory = shard_dir(root, shard)
+        directory.mkdir(parents=True, exist_ok=True)
+        # rewritten with the same content, so the stages of unchanged shards stay
+        # up to date
+        write_table(
+            df[shards.to_numpy() == shard],
+            directory / sharded["preprocessing_path"],
+        )
+        with open(directory / "config.yaml", "w") as f:
+            yaml.dump(sharded, f, allow_unicode=True, sort_keys=False)
+        config_paths.append(directory / "config.yaml")
+
+    open_queue(config_path, config).reset(n_shards)
+    print(f"Split {len(df)} comments into {n_shards} shards in {root}")
+    return config_paths
+
+
+def work_shards(
+    config_path: Path,
+    config: dict,
+    run_shard: Callable[[Path], None],
+    worker: Optional[str] = None,
+) -> int:
+    """
+    Claims and processes shards until the queue is empty.
+
+    The process exits if the lease of its shard cannot be renewed, see
+    LeaseRenewer. The shard is then claimed again by another worker.
+
+    Args:
+        - config_path (Path): path to config.yaml
+        - config (dict): the loaded config.yaml
+        - run_shard (Callable): runs the sharded stages given the config path of a shard
+        - worker (str): name of the worker, host and process id if None
+
+    Returns:
+        int: number of shards processed successfully by this worker
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    queue = open_queue(config_path, config)
+    root = Path(config_path.parent / config.get("shard_dir", "data/shards"))
+    processed = 0
+
+    while (shard := queue.claim(worker)) is not None:
+        print(f"------- Worker {worker} claimed shard {shard} -------")
+        renewer = LeaseRenewer(queue, shard, worker)
+        renewer.start()
+        try:
+            run_shard(shard_dir(root, shard) / "config.yaml")
+        except Exception:
+            queue.finish(shard, worker, error=traceback.format_exc())
+            print(f"------- Shard {shard} failed -------")
+        else:
+            queue.finish(shard, worker)
+            processed += 1
+        finally:
+            renewer.stop()
+    return processed
+
+
+def merge_shards(config_path: Path, config: dict) -> Dict[str, Path]:
+    """
+    Combines the outputs of all shards into the outputs of the pipeline.
+
+    Rows are ordered by text_index, keeping the order of the rows of a comment,
+    so the result does not depend on which worker processed which shard.
+
+    Args:
+        - config_path (Path): path to config.yaml
+        - config (dict): the loaded config.yaml
+
+    Returns:
+        Dict[str, Path]: the merged output of every config key or marker file
+    """
+    status = open_queue(config_path, config).status()
+    unfinished = status[status["status"] != "done"]
+    if len(status) == 0 or len(unfinished):
+        raise ValueError(
+            f"Shards are not done, merge after all workers finished:\n{unfinished}"
+        )
+
+    root = Path(config_path.parent / config.get("shard_dir", "data/shards"))
+    sharded = shard_config(config, config_path)
+    directories = [shard_dir(root, shard) for shard in status["shard"]]
+    markers_dir = Path(config_path.parent / config.get("markers_path", "."))
+
+    outputs = {key: Path(config_path.parent / config[key]) for key in MERGED_PATHS}
+    sources = {
+        key: [directory / sharded[key] for directory in directories]
+        for key in MERGED_PATHS
+    }
+    for file in MARKER_FILES:
+        outputs[file] = markers_dir / file
+        sources[file] = [
+            directory / sharded["markers_path"] / file for directory in directories
+        ]
+
+    for key, output in outputs.items():
+        # shards without comments have no outputs
+        frames = [read_table(path) for path in sources[key] if path.exists()]
+        if not frames:
+            continue
+        df = pd.concat(frames, ignore_index=True)
+        write_table(
+            df.sort_values("text_index", kind="stable", ignore_index=True), output
+        )
+        print(f"Merged {len(df)} rows of {len(frames)} shards into {output}")
+    return outputs
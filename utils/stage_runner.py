@@ -0,0 +1,218 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import hashlib
+import json
+from pathlib import Path
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from utils.instrumentation import Tracer
+
+# files are hashed in blocks of this size
+_HASH_BLOCK = 1 << 20
+
+
+@dataclass
+class Stage:
+    """A pipeline stage with the files it reads and writes.
+
+    Attributes:
+        - name (str): unique name of the stage
+        - run (Callable): runs the stage, reads inputs and writes outputs from disk
+        - inputs (List[Path]): files or directories the stage reads
+        - outputs (List[Path]): files or directories the stage writes
+        - config (dict): configuration values the stage depends on
+        - depends_on (List[str]): stages that have to finish first
+    """
+
+    name: str
+    run: Callable[[], None]
+    inputs: List[Path] = field(default_factory=list)
+    outputs: List[Path] = field(default_factory=list)
+    config: dict = field(default_factory=dict)
+    depends_on: List[str] = field(default_factory=list)
+
+
+def hash_path(path: Path) -> str:
+    """
+    Hashes the content of a file or of all files in a directory.
+
+    Args:
+        - path (Path): file or directory
+
+    Returns:
+        str: hex digest of the content, "missing" if the path does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return "missing"
+
+    digest = hashlib.sha256()
+    files = sorted(p for p in path.rglob("*") if p.is_file()) if path.is_dir() else [path]
+    for file in files:
+        digest.update(str(file.relative_to(path) if path.is_dir() else "").encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(_HASH_BLOCK), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def stage_fingerprint(stage: Stage) -> str:
+    """
+    Combines the content of the inputs and the configuration of a stage.
+
+    Args:
+        - stage (Stage): the stage
+
+    Returns:
+        str: hex digest that changes whenever an input or the config changes
+    """
+    payload = {
+        "inputs": {str(path): hash_path(path) for path in stage.inputs},
+        "config": stage.config,
+    }
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class StageRunner:
+    """Runs a graph of stages, skipping up-to-date ones and running independent ones concurrently.
+
+    A stage is up to date if the fingerprint of its inputs and config matches the
+    one recorded after its last successful run and all of its outputs exist.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        state_path: Path,
+        max_parallel: int = 2,
+        tracer: Optional[Tracer] = None,
+    ) -> None:
+        """
+        Args:
+            - stages (List[Stage]): all stages of the pipeline
+            - state_path (Path): json file storing the fingerprints of the last runs
+            - max_parallel (int): maximum number of concurrently running stages
+            - tracer (Tracer): records the executed stages, no tracing if None
+        """
+        self.tracer = tracer
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = set(stage.depends_on) - set(self.stages)
+            if unknown:
+                raise ValueError(f"Stage {stage.name} depends on unknown {unknown}")
+        self.state_path = Path(state_path)
+        self.max_parallel = max_parallel
+        self._lock = threading.Lock()
+        self.state = (
+            json.loads(self.state_path.read_text()) if self.state_path.exists() else {}
+        )
+
+    def downstream(self, names: Iterable[str]) -> Set[str]:
+        """returns the given stages and every stage depending on them"""
+        selected = set(names)
+        changed = True
+        while changed:
+            changed = False
+            for stage in self.stages.values():
+                if stage.name not in selected and selected & set(stage.depends_on):
+                    selected.add(stage.name)
+                    changed = True
+        return selected
+
+    def select(
+        self, only: Optional[Iterable[str]] = None, start: Optional[str] = None
+    ) -> Set[str]:
+        """
+        Selects the stages to run.
+
+        Args:
+            - only (Iterable[str]): run only these stages
+            - start (str): run this stage and everything downstream of it
+
+        Returns:
+            Set[str]: names of the selected stages
+        """
+        selected = set(self.stages)
+        if only:
+            only = set(only)
+            unknown = only - set(self.stages)
+            if unknown:
+                raise ValueError(f"Unknown stages {unknown}")
+            selected &= only
+        if start:
+            if start not in self.stages:
+                raise ValueError(f"Unknown stage {start}")
+            selected &= self.downstream([start])
+        return selected
+
+    def is_up_to_date(self, stage: Stage, fingerprint: str) -> bool:
+        return self.state.get(stage.name) == fingerprint and all(
+            Path(path).exists() for path in stage.outputs
+        )
+
+    def _run_stage(self, stage: Stage, force: bool) -> None:
+        fingerprint = stage_fingerprint(stage)
+        if not force and self.is_up_to_date(stage, fingerprint):
+            print(f"------- Stage {stage.name} is up to date, skipped -------")
+            if self.tracer:
+                self.tracer.skipped(stage.name)
+            return
+
+        start = time.perf_counter()
+        with self.tracer.stage(stage.name) if self.tracer else nullcontext():
+            stage.run()
+        print(
+            f"------- Stage {stage.name} finished in "
+            f"{time.perf_counter() - start:.1f}s -------"
+        )
+
+        with self._lock:
+            self.state[stage.name] = fingerprint
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            self.state_path.write_text(json.dumps(self.state, indent=2))
+
+    def run(
+        self,
+        only: Optional[Iterable[str]] = None,
+        start: Optional[str] = None,
+        force: bool = False,
+    ) -> None:
+        """
+        Runs the selected stages in dependency order.
+
+        Stages whose dependencies are not selected assume that the outputs of
+        these dependencies are already on disk.
+
+        Args:
+            - only (Iterable[str]): run only these stages
+            - start (str): run this stage and everything downstream of it
+            - force (bool): run the stages even if they are up to date
+        """
+        pending = self.select(only, start)
+        running: Dict = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            while pending or running:
+                ready = [
+                    name
+                    for name in sorted(pending)
+                    if not set(self.stages[name].depends_on)
+                    & (pending | set(running.values()))
+                ]
+                for name in ready:
+                    pending.remove(name)
+                    running[pool.submit(self._run_stage, self.stages[name], force)] = name
+
+                if not running:
+                    raise ValueError(f"Circular dependencies between {pending}")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    running.pop(future)
+                    # re-raise failures, stages already running are finished first
+                    future.result()